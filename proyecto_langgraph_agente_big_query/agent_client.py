@@ -0,0 +1,72 @@
+# agent_client.py - Cliente liviano del servicio HTTP/SSE del agente (server.py)
+
+import json
+
+import httpx
+
+
+class AgentBusyError(Exception):
+    """El servicio respondió 429: está saturado y pide reintentar más tarde."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(
+            f"El servicio está ocupado atendiendo otras preguntas. Reintenta en {retry_after} segundos."
+        )
+        self.retry_after = retry_after
+
+
+class AgentClient:
+    """
+    Habla con `server.py` en lugar de ejecutar el agente en el mismo proceso.
+    Ofrece las mismas operaciones que usa la interfaz de Streamlit.
+    """
+
+    def __init__(self, base_url: str, timeout: float = 300):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def stream(self, query: str, session_id: str = "default"):
+        """
+        Igual que `agent_langgraph.stream_agent`, pero a través de POST /ask/stream:
+        un generador con los mismos eventos ("sql", "rows", "token", "final"...).
+
+        Raises:
+            AgentBusyError: si el servicio responde 429.
+        """
+        body = {"question": query, "session_id": session_id}
+        with httpx.stream(
+            "POST", f"{self.base_url}/ask/stream", json=body, timeout=self.timeout
+        ) as response:
+            if response.status_code == 429:
+                raise AgentBusyError(int(response.headers.get("Retry-After", "1")))
+            response.raise_for_status()
+            for line in response.iter_lines():
+                # Cada evento SSE trae una línea "data: {...}" con el evento completo
+                if not line.startswith("data:"):
+                    continue
+                event = json.loads(line[len("data:"):].strip())
+                if event["type"] == "error":
+                    # Con retry_after: el proveedor siguió saturado tras los reintentos
+                    if event.get("retry_after") is not None:
+                        raise AgentBusyError(int(event["retry_after"]))
+                    raise RuntimeError(event["message"])
+                yield event
+
+    def forget_conversation(self, session_id: str):
+        httpx.delete(f"{self.base_url}/sessions/{session_id}", timeout=30).raise_for_status()
+
+    def set_approximate_mode(self, session_id: str, enabled: bool):
+        httpx.put(
+            f"{self.base_url}/sessions/{session_id}/approximate",
+            json={"enabled": enabled},
+            timeout=30,
+        ).raise_for_status()
+
+    def list_jobs(self, session_id: str) -> list:
+        """Trabajos de consulta en segundo plano de la sesión (el más reciente primero)."""
+        response = httpx.get(f"{self.base_url}/sessions/{session_id}/jobs", timeout=30)
+        response.raise_for_status()
+        return response.json()["jobs"]
+
+    def invalidate_plan_cache(self):
+        httpx.delete(f"{self.base_url}/plan-cache", timeout=30).raise_for_status()
@@ -2,16 +2,19 @@
 
 from typing import TypedDict, Annotated, Sequence
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage
-from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, END
-from langgraph.prebuilt import ToolNode
 from langgraph.graph.message import add_messages
 import os
+import asyncio
+import queue
+import threading
+from dataclasses import dataclass, replace
 from langchain_core.messages import SystemMessage
+from langchain_core.runnables import RunnableConfig
 
-# Cargar variables de entorno desde el archivo .env
-from dotenv import load_dotenv
-load_dotenv()  # Carga las variables del archivo .env automáticamente
+# Las variables del archivo .env las carga quien arranca el proceso (main.py,
+# server.py, o langgraph.json para LangGraph Studio) antes de importar este módulo:
+# importarlo no tiene efectos secundarios
 
 # ============================================
 # 1. IMPORTAR EL TOOL DESDE LA CARPETA TOOLS
@@ -20,31 +23,49 @@ load_dotenv()  # Carga las variables del archivo .env automáticamente
 # Importamos el tool de SQL desde la carpeta tools
 # Esta versión ya viene decorada con @tool de LangChain
 from tools.run_sql_query import run_sql_query_langchain as run_sql_query
+from tools.run_sql_query import CANCEL_SCOPE_KEY, QUERY_TIMEOUT_SECONDS
+from tools.backends import CancelScope
+from tools.query_artifact import query_result_artifact
+from tools.query_jobs import QUERY_JOBS_ENABLED, get_query_job, submit_query_job
+from tools.artifacts import get_artifact_store
+from tools.approximate import APPROX_SAMPLE_PERCENT, approximate_mode
+from tools.sql_validation import parse_table_schema, validate_sql, format_validation_errors
+from tools.catalog import CATALOG_ENABLED, TABLE_SCHEMA, get_catalog
+from plan_cache import get_plan_cache
+from rate_limit import LLM_RESERVED_OUTPUT_TOKENS, llm_scheduler
+from memory import (
+    SYSTEM_MESSAGE_ID,
+    compact_history,
+    current_turn,
+    get_checkpointer,
+    has_history,
+    history_tokens,
+    summary_message,
+)
+from instrumentation import (
+    count_iterations,
+    instrument_node,
+    record_llm_usage,
+    trace_question,
+)
 
 # ============================================
 # 2. ESQUEMA DE LA TABLA
 # ============================================
 
-TABLE_SCHEMA = """
-CREATE TABLE `bigquery-public-data.new_york_citibike.citibike_trips` (
-    tripduration INTEGER,
-    starttime TIMESTAMP,
-    stoptime TIMESTAMP,
-    start_station_id INTEGER,
-    start_station_name STRING,
-    start_station_latitude FLOAT64,
-    start_station_longitude FLOAT64,
-    end_station_id INTEGER,
-    end_station_name STRING,
-    end_station_latitude FLOAT64,
-    end_station_longitude FLOAT64,
-    bikeid INTEGER,
-    usertype STRING,
-    birth_year INTEGER,
-    gender STRING,
-    customer_plan STRING
-)
-"""
+# Sin catálogo (CATALOG_ENABLED=false) se valida contra TABLE_SCHEMA y el prompt
+# lo incluye completo; con catálogo, cada pregunta recibe solo las tablas y
+# columnas relevantes (ver tools/catalog.py)
+DB_SCHEMA = parse_table_schema(TABLE_SCHEMA)
+
+if CATALOG_ENABLED:
+    DATA_CONTEXT = """La tabla principal es `bigquery-public-data.new_york_citibike.citibike_trips`.
+Al final, en **Catálogo de datos**, verás las tablas y columnas relevantes para esta pregunta con sus estadísticas: úsalas para filtrar con valores exactos (respetando mayúsculas) y con rangos de fechas que existan en los datos."""
+else:
+    DATA_CONTEXT = f"""Tienes acceso a una sola tabla llamada `bigquery-public-data.new_york_citibike.citibike_trips`.
+Este es el esquema de la tabla:
+
+{TABLE_SCHEMA}"""
 
 # ============================================
 # 3. INSTRUCCIONES DEL AGENTE
@@ -58,22 +79,25 @@ Tu única tarea es convertir las preguntas de los usuarios, hechas en lenguaje n
 
 ## El Contexto de los Datos
 
-Tienes acceso a una sola tabla llamada `bigquery-public-data.new_york_citibike.citibike_trips`.
-Este es el esquema de la tabla:
-
-{TABLE_SCHEMA}
+{DATA_CONTEXT}
 
 ## Tu Proceso de Pensamiento
 
 1. **Analiza la Pregunta del Usuario**: Comprende profundamente qué métricas, agregaciones, filtros y ordenamientos está pidiendo el usuario.
 2. **Construye la Consulta SQL**: Escribe una consulta SQL para BigQuery que responda a la pregunta.
-   - **SIEMPRE** usa el nombre completo de la tabla: `bigquery-public-data.new_york_citibike.citibike_trips`.
+   - **SIEMPRE** usa el nombre completo de la tabla, por ejemplo `bigquery-public-data.new_york_citibike.citibike_trips`.
    - Presta atención a los tipos de datos. Por ejemplo, `tripduration` está en segundos.
    - No hagas suposiciones. Si la pregunta es ambigua, es mejor que la consulta falle a que devuelva datos incorrectos.
 3. **Ejecuta la Consulta**: Usa la herramienta `run_sql_query` para ejecutar el SQL que has escrito.
-4. **Interpreta los Resultados**: La herramienta te devolverá los datos en formato de texto (Markdown) o un mensaje de error.
+4. **Interpreta los Resultados**: La herramienta te devolverá los datos en CSV compacto (encabezado `columna:TIPO`) o un mensaje de error.
+   - Si el resultado es grande verás solo las primeras y últimas filas, cuántas se omitieron y un resumen por columna (calculado sobre todas las filas). Para totales o rankings, pide al SQL exactamente lo que necesitas (agregaciones, ORDER BY y LIMIT) en vez de filas sueltas.
    - Si obtienes datos, preséntalos al usuario de forma clara y responde a su pregunta original en un lenguaje natural y amigable.
    - Si obtienes un error, analiza el error, corrige tu consulta SQL y vuelve a intentarlo. No le muestres el error de SQL al usuario directamente a menos que no puedas solucionarlo. Explícale el problema en términos sencillos.
+   - Antes de ejecutarse, tu SQL se valida localmente contra el esquema. Si recibes "no pasó la validación local", corrige exactamente los problemas indicados.
+   - Si el resultado se guardó como tabla local (`r_...`), usa `query_result_artifact` para las preguntas de seguimiento sobre ese resultado (filtrar, ordenar, agrupar): es inmediato y no escanea BigQuery. Si esperas hacer varias preguntas sobre un mismo resultado, llama a `run_sql_query` con `save_result=true`.
+   - **Modo aproximado**: para exploración rápida ("¿cuántos viajes…?", promedios, conteos de estaciones distintas) puedes llamar a `run_sql_query` con `approximate=true`. La consulta se ejecuta sobre una muestra del {APPROX_SAMPLE_PERCENT:g}% de la tabla (COUNT/SUM se escalan al total) y `COUNT(DISTINCT ...)` se calcula con `APPROX_COUNT_DISTINCT`; para medianas o percentiles usa `APPROX_QUANTILES(columna, 100)[OFFSET(50)]`. La línea `[Aproximado: ...]` y las columnas `*_error_pct` dan el error relativo estimado: informa siempre al usuario que la cifra es aproximada y su margen (por ejemplo, "≈ 1,2 millones de viajes, ±0,5%"), sin mostrar las columnas de error como datos. Si el usuario pide una cifra exacta, o el error supera el 10% (p. ej. rankings de rutas con pocos viajes), usa `approximate=false`.
+   - **Consultas pesadas en segundo plano**: si la consulta va a tardar (recorre toda la tabla con muchos grupos, usa JOINs o funciones de ventana) o el usuario pide un análisis largo, envíala con `submit_query_job` y pide el resultado con `get_query_job`. Si `get_query_job` indica que sigue en curso, no insistas en el mismo turno: dile al usuario que el resultado estará listo pronto y menciona el ID del trabajo (`j_...`), con el que puede pedirlo más tarde, incluso desde otra conversación.
+   - Si la herramienta rechaza la consulta por presupuesto (`rechazada_por_presupuesto`), reescríbela para escanear menos datos: selecciona solo las columnas necesarias, agrega filtros y evita `SELECT *`.
 
 ## Guía de Comunicación
 
@@ -92,23 +116,69 @@ Empieza ahora.
 class AgentState(TypedDict):
     """Estado que se pasa entre los nodos del grafo"""
     messages: Annotated[Sequence[BaseMessage], add_messages]
+    # Resumen de los turnos antiguos que la compactación quitó del historial
+    summary: str
 
 # ============================================
-# 5. INICIALIZACIÓN DEL MODELO Y TOOLS
+# 5. CONFIGURACIÓN DEL MODELO, LAS TOOLS Y LOS LÍMITES
 # ============================================
 
-# Inicializar el modelo de OpenAI con LangChain
-# Asegúrate de tener la variable de entorno OPENAI_API_KEY configurada
-llm = ChatOpenAI(
-    model="gpt-4o",  # Puedes usar: gpt-4o, gpt-4o-mini, gpt-4-turbo, o gpt-3.5-turbo
-    temperature=0
-)
+# Todos los valores se pueden sobreescribir desde el archivo .env
+# Modelo de OpenAI: gpt-4o, gpt-4o-mini, gpt-4-turbo, o gpt-3.5-turbo
+AGENT_MODEL = os.getenv("AGENT_MODEL", "gpt-4o")
+AGENT_TEMPERATURE = float(os.getenv("AGENT_TEMPERATURE", "0"))
+# Máximo de tool calls de un mismo turno que se ejecutan en paralelo
+MAX_PARALLEL_TOOL_CALLS = int(os.getenv("MAX_PARALLEL_TOOL_CALLS", "4"))
+# Margen extra sobre QUERY_TIMEOUT_SECONDS antes de abandonar una tool desde el grafo
+TOOL_TIMEOUT_GRACE_SECONDS = 5
+# Después de cancelar una consulta por timeout, cuánto se espera a que su hilo termine
+TOOL_CANCEL_WAIT_SECONDS = 10
+
+# Tools cuyo argumento `query` se valida localmente antes de ejecutarse
+SQL_TOOLS = {run_sql_query.name, submit_query_job.name}
 
-# Lista de herramientas disponibles
-tools = [run_sql_query]
 
-# Bind tools al modelo
-llm_with_tools = llm.bind_tools(tools)
+@dataclass
+class AgentConfig:
+    """
+    Configuración con la que se construye el grafo del agente.
+
+    Attributes:
+        model: Nombre del modelo de OpenAI.
+        temperature: Temperatura del modelo.
+        llm: Modelo ya creado (otro proveedor, un modelo falso para el benchmark...).
+            Si tiene `bind_tools` se le enlazan las tools; si no, se usa tal cual.
+            None = ChatOpenAI con `model` y `temperature`.
+        tools: Tools disponibles para el modelo (None = las de `default_tools()`).
+        max_parallel_tool_calls: Tool calls de un turno que corren a la vez (grafo asíncrono).
+        tool_timeout_seconds: Tiempo máximo por tool call en el grafo asíncrono.
+        memory: Si es False, el grafo no guarda las conversaciones (sin checkpointer).
+    """
+    model: str = AGENT_MODEL
+    temperature: float = AGENT_TEMPERATURE
+    llm: object = None
+    tools: tuple = None
+    max_parallel_tool_calls: int = MAX_PARALLEL_TOOL_CALLS
+    tool_timeout_seconds: float = QUERY_TIMEOUT_SECONDS + TOOL_TIMEOUT_GRACE_SECONDS
+    memory: bool = True
+
+
+def default_tools() -> tuple:
+    """Tools del agente: consultas a BigQuery (directas o en segundo plano) y sobre resultados guardados"""
+    if QUERY_JOBS_ENABLED:
+        return (run_sql_query, query_result_artifact, submit_query_job, get_query_job)
+    return (run_sql_query, query_result_artifact)
+
+
+def create_chat_model(config: AgentConfig):
+    """Modelo de chat de la configuración (ChatOpenAI se importa recién aquí: es pesado)"""
+    if config.llm is not None:
+        return config.llm
+    from langchain_openai import ChatOpenAI
+
+    # Asegúrate de tener la variable de entorno OPENAI_API_KEY configurada
+    # Los reintentos los hace llm_scheduler (con límites de tasa compartidos), no el cliente
+    return ChatOpenAI(model=config.model, temperature=config.temperature, max_retries=0)
 
 # ============================================
 # 6. FUNCIONES DE LOS NODOS DEL GRAFO
@@ -125,81 +195,606 @@ def should_continue(state: AgentState):
     # Si no, terminamos
     return "end"
 
-def call_model(state: AgentState):
-    """Nodo que llama al modelo de lenguaje"""
-    messages = state["messages"]
+def pending_tool_calls(messages):
+    """Tool calls del último mensaje del modelo que todavía no tienen respuesta"""
+    answered = set()
+    for message in reversed(messages):
+        if isinstance(message, ToolMessage):
+            answered.add(message.tool_call_id)
+        elif isinstance(message, AIMessage):
+            return [tc for tc in message.tool_calls if tc["id"] not in answered]
+    return []
+
+def validation_schema() -> dict:
+    """Esquema {tabla: {columna: tipo}} contra el que se valida el SQL"""
+    catalog = get_catalog()
+    return catalog.schema() if catalog is not None else DB_SCHEMA
+
+def schema_context(query: str) -> str:
+    """Tablas y columnas del catálogo relevantes para la pregunta ("" sin catálogo)"""
+    catalog = get_catalog()
+    return catalog.context(query) if catalog is not None else ""
+
+def validate_tool_calls(state: AgentState):
+    """
+    Nodo de validación entre el agente y las tools: revisa localmente el SQL de
+    cada tool call (sintaxis de BigQuery, solo SELECT, tablas y columnas de
+    todo el catálogo, no solo las del prompt). Las consultas inválidas se
+    responden aquí mismo con el diagnóstico, sin llegar a BigQuery.
+    """
+    schema = validation_schema()
+    rejections = []
+    for tool_call in pending_tool_calls(state["messages"]):
+        if tool_call["name"] not in SQL_TOOLS:
+            continue
+        errors = validate_sql(tool_call["args"].get("query", ""), schema)
+        if errors:
+            rejections.append(ToolMessage(
+                content=format_validation_errors(errors),
+                tool_call_id=tool_call["id"],
+                name=tool_call["name"],
+                status="error",
+                artifact={"estado": "invalida", "cache": None, "filas": None, "errores": errors},
+            ))
+    return {"messages": rejections}
+
+def after_validation(state: AgentState):
+    """Si quedan consultas válidas se ejecutan; si no, el modelo corrige las rechazadas"""
+    return "tools" if pending_tool_calls(state["messages"]) else "agent"
+
+def call_tokens(messages) -> int:
+    """Tokens estimados de una llamada al modelo (prompt + respuesta), para el límite por minuto"""
+    return history_tokens(messages) + LLM_RESERVED_OUTPUT_TOKENS
+
+def response_tokens(response):
+    """Tokens reales de una respuesta del modelo (None si el proveedor no los informa)"""
+    return (getattr(response, "usage_metadata", None) or {}).get("total_tokens")
+
+def prompt_messages(state: AgentState):
+    """Mensajes que se envían al modelo: system instruction, resumen (si hay) e historial"""
+    messages = list(state["messages"])
     
     # OpenAI soporta system messages nativamente, así que podemos usarlos directamente
-    # Si es el primer mensaje, agregamos el system instruction
-    if len(messages) == 1 and isinstance(messages[0], HumanMessage):
-        from langchain_core.messages import SystemMessage
-        messages = [SystemMessage(content=SYSTEM_INSTRUCTION)] + messages
-    
-    response = llm_with_tools.invoke(messages)
-    return {"messages": [response]}
+    # Si el historial no trae el system instruction (p. ej. desde LangGraph Studio),
+    # lo agregamos al principio con el catálogo de la última pregunta
+    if not messages or not isinstance(messages[0], SystemMessage):
+        questions = [m.content for m in messages if isinstance(m, HumanMessage)]
+        context = schema_context(questions[-1]) if questions else ""
+        messages = [SystemMessage(content=SYSTEM_INSTRUCTION + context)] + messages
+    summary = summary_message(state.get("summary", ""))
+    if summary is not None:
+        messages.insert(1, summary)
+    return messages
 
 # ============================================
 # 7. CONSTRUCCIÓN DEL GRAFO DE LANGGRAPH
 # ============================================
 
-# Crear el grafo con el estado definido
-workflow = StateGraph(AgentState)
-
-# Crear el nodo de tools
-tool_node = ToolNode(tools)
-
-# Agregar nodos al grafo
-workflow.add_node("agent", call_model)
-workflow.add_node("tools", tool_node)
-
-# Definir el punto de entrada
-workflow.set_entry_point("agent")
-
-# Agregar edges condicionales
-workflow.add_conditional_edges(
-    "agent",
-    should_continue,
-    {
-        "tools": "tools",
-        "end": END
-    }
-)
+def build_graph(model_node, tools_node, checkpointer=None):
+    """
+    Construye y compila el grafo compactación -> agente -> validación -> tools con
+    los nodos indicados. Con `checkpointer`, el estado se guarda por `thread_id`
+    (la sesión) y cada pregunta continúa la conversación anterior.
+    """
+    # Crear el grafo con el estado definido
+    workflow = StateGraph(AgentState)
+    
+    # Agregar nodos al grafo
+    # Cada nodo se instrumenta (latencia por nodo en métricas y trazas)
+    workflow.add_node("compact", instrument_node("compact", compact_history))
+    workflow.add_node("agent", instrument_node("agent", model_node))
+    workflow.add_node("validate", instrument_node("validate", validate_tool_calls))
+    workflow.add_node("tools", instrument_node("tools", tools_node))
+    
+    # Cada turno empieza compactando el historial (si pasó del presupuesto de tokens)
+    workflow.set_entry_point("compact")
+    
+    # Después, el modelo decide (también si hay un SQL parecido en la caché de planes)
+    workflow.add_edge("compact", "agent")
+    
+    # Agregar edges condicionales: antes de las tools, el SQL se valida localmente
+    workflow.add_conditional_edges(
+        "agent",
+        should_continue,
+        {
+            "tools": "validate",
+            "end": END
+        }
+    )
+    workflow.add_conditional_edges(
+        "validate",
+        after_validation,
+        {
+            "tools": "tools",
+            "agent": "agent"
+        }
+    )
+    
+    # Después de ejecutar tools, volver al agente
+    workflow.add_edge("tools", "agent")
+    
+    return workflow.compile(checkpointer=checkpointer)
 
-# Después de ejecutar tools, volver al agente
-workflow.add_edge("tools", "agent")
+class AgentGraph:
+    """
+    El agente armado con una configuración: modelo con tools enlazadas y los
+    grafos compilados `app` (síncrono) y `async_app` (tools en paralelo y con
+    timeout por consulta). Los dos comparten el checkpointer, así continúan
+    las mismas conversaciones.
+    """
 
-# Compilar el grafo - EXPORTADO PARA LANGGRAPH STUDIO
-app = workflow.compile()
+    def __init__(self, config: AgentConfig):
+        self.config = config
+        self.llm = create_chat_model(config)
+        self.model_name = getattr(self.llm, "model_name", config.model)
+        self.tools = list(config.tools if config.tools is not None else default_tools())
+        # Bind tools al modelo (un modelo ya preparado sin bind_tools se usa tal cual)
+        bind_tools = getattr(self.llm, "bind_tools", None)
+        self.llm_with_tools = bind_tools(self.tools) if bind_tools is not None else self.llm
+        # Índice de tools por nombre (lo usan los nodos de validación y de tools)
+        self.tools_by_name = {t.name: t for t in self.tools}
+        # Memoria de la conversación por sesión (None si MEMORY_ENABLED=false)
+        self.checkpointer = get_checkpointer() if config.memory else None
+        self.app = build_graph(self.call_model, self.call_tools, self.checkpointer)
+        self.async_app = build_graph(self.acall_model, self.acall_tools, self.checkpointer)
+
+    def call_model(self, state: AgentState):
+        """Nodo que llama al modelo de lenguaje"""
+        messages = prompt_messages(state)
+        
+        # Límites de tasa de OpenAI, llamadas simultáneas (LLM_MAX_CONCURRENT_CALLS, con
+        # concurrencia adaptativa) y reintentos de errores pasajeros (429, 5xx) sin
+        # gastar un turno del modelo; si no se recupera, lanza ProviderUnavailable
+        response = llm_scheduler.call(
+            lambda: self.llm_with_tools.invoke(messages),
+            tokens=call_tokens(messages),
+            usage=response_tokens,
+        )
+        record_llm_usage(response, self.model_name)
+        return {"messages": [response]}
+
+    async def acall_model(self, state: AgentState):
+        """Versión asíncrona del nodo que llama al modelo de lenguaje"""
+        messages = prompt_messages(state)
+        
+        response = await llm_scheduler.acall(
+            lambda: self.llm_with_tools.ainvoke(messages),
+            tokens=call_tokens(messages),
+            usage=response_tokens,
+        )
+        record_llm_usage(response, self.model_name)
+        return {"messages": [response]}
+
+    def call_tools(self, state: AgentState, config: RunnableConfig):
+        """Nodo de tools: ejecuta una por una las tool calls que pasaron la validación"""
+        tool_messages = []
+        for tool_call in pending_tool_calls(state["messages"]):
+            tool = self.tools_by_name.get(tool_call["name"])
+            if tool is None:
+                tool_messages.append(ToolMessage(
+                    content=f"Error: la herramienta '{tool_call['name']}' no existe.",
+                    tool_call_id=tool_call["id"],
+                    name=tool_call["name"],
+                    status="error",
+                ))
+                continue
+            tool_messages.append(tool.invoke({**tool_call, "type": "tool_call"}, config))
+        return {"messages": tool_messages}
+
+    async def acall_tools(self, state: AgentState, config: RunnableConfig):
+        """
+        Nodo asíncrono de tools: ejecuta en paralelo las tool calls que pasaron la
+        validación (como máximo `max_parallel_tool_calls` a la vez) y con un tiempo límite por consulta.
+        Un timeout no rompe el grafo: vuelve al modelo como un error recuperable.
+        """
+        tool_calls = pending_tool_calls(state["messages"])
+        semaphore = asyncio.Semaphore(self.config.max_parallel_tool_calls)
+        timeout = self.config.tool_timeout_seconds
+        
+        async def run_tool_call(tool_call):
+            async with semaphore:
+                tool = self.tools_by_name.get(tool_call["name"])
+                try:
+                    if tool is None:
+                        content = f"Error: la herramienta '{tool_call['name']}' no existe."
+                    else:
+                        # Al pasar el tool call completo, la tool devuelve un ToolMessage
+                        # (incluyendo su artifact con metadatos de la ejecución)
+                        return await self._invoke_with_timeout(tool, tool_call, config, timeout)
+                except asyncio.TimeoutError:
+                    content = (
+                        f"Error: la consulta superó el tiempo límite de {QUERY_TIMEOUT_SECONDS:.0f} "
+                        "segundos y fue cancelada. Intenta una consulta más simple, con más "
+                        "filtros o con menos columnas."
+                    )
+                except Exception as e:
+                    content = f"Error al ejecutar la herramienta: {e}"
+            return ToolMessage(
+                content=content,
+                tool_call_id=tool_call["id"],
+                name=tool_call["name"],
+                status="error",
+            )
+        
+        tool_messages = await asyncio.gather(*(run_tool_call(tc) for tc in tool_calls))
+        return {"messages": list(tool_messages)}
+
+    async def _invoke_with_timeout(self, tool, tool_call, config: RunnableConfig, timeout: float):
+        """
+        Ejecuta la tool con un tiempo límite. La tool síncrona corre en un hilo que
+        `asyncio.wait_for` no puede detener, así que al vencer el plazo se cancela
+        la consulta en el backend (job de BigQuery o cursor de DuckDB) y se espera
+        a que el hilo termine: recién entonces quedan libres su cupo de BigQuery y
+        los bytes que tenía reservados en la guardia de costo.
+
+        Raises:
+            asyncio.TimeoutError: si la tool no terminó a tiempo.
+        """
+        scope = CancelScope()
+        configurable = {**(config or {}).get("configurable", {}), CANCEL_SCOPE_KEY: scope}
+        task = asyncio.ensure_future(
+            tool.ainvoke({**tool_call, "type": "tool_call"}, {**(config or {}), "configurable": configurable})
+        )
+        try:
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+        except asyncio.CancelledError:
+            # El grafo se canceló (p. ej. el cliente se desconectó): la consulta tampoco sigue
+            asyncio.get_running_loop().run_in_executor(None, scope.cancel)
+            raise
+        if done:
+            return task.result()
+        await asyncio.to_thread(scope.cancel)
+        done, _ = await asyncio.wait({task}, timeout=TOOL_CANCEL_WAIT_SECONDS)
+        if done:
+            # El resultado (el error de la consulta cancelada) se descarta
+            task.exception()
+        else:
+            # Sigue en curso: liberará su cupo al terminar, pero el turno no lo espera más
+            task.add_done_callback(lambda finished: finished.exception())
+            print(f"⚠️ La tool {tool_call['name']} sigue en curso después de cancelarla.")
+        raise asyncio.TimeoutError()
+
+
+# Grafo del proceso (lazy loading): se construye en el primer uso, no al importar
+# el módulo, y lo comparten todas las preguntas, sesiones y reruns de Streamlit
+_agent = None
+_agent_config = AgentConfig()
+_agent_lock = threading.Lock()
+
+def configure_agent(config: AgentConfig = None, **overrides):
+    """
+    Cambia la configuración del grafo del proceso (p. ej. `configure_agent(model="gpt-4o-mini")`
+    o `configure_agent(llm=modelo_falso)`). El grafo se vuelve a construir en el próximo uso.
+    """
+    global _agent, _agent_config
+    with _agent_lock:
+        _agent_config = replace(config or _agent_config, **overrides)
+        _agent = None
+
+def get_agent() -> AgentGraph:
+    """Obtiene el grafo del proceso, construyéndolo solo la primera vez."""
+    global _agent
+    if _agent is None:
+        with _agent_lock:
+            if _agent is None:
+                _agent = AgentGraph(_agent_config)
+    return _agent
+
+# Compatibilidad con `from agent_langgraph import app` y con LangGraph Studio
+# (langgraph.json apunta a `agent_langgraph:app`): estos nombres se resuelven
+# recién cuando se piden, construyendo el grafo en ese momento
+_LAZY_ATTRIBUTES = {"app", "async_app", "llm", "llm_with_tools", "tools", "tools_by_name", "checkpointer"}
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return getattr(get_agent(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # ============================================
 # 8. FUNCIÓN PRINCIPAL PARA EJECUTAR EL AGENTE
 # ============================================
 
-def run_agent(query: str):
+def session_artifacts_note(session_id: str) -> str:
+    """Lista de resultados guardados en la sesión, para que el modelo pueda reutilizarlos"""
+    store = get_artifact_store()
+    recent = store.recent(session_id) if store is not None else []
+    if not recent:
+        return ""
+    return (
+        "\n## Resultados guardados en esta sesión (consultables con `query_result_artifact`)\n"
+        + "\n".join(f"- {info.describe()}" for info in recent)
+    )
+
+def approximate_mode_note(session_id: str) -> str:
+    """Aviso para el modelo cuando la sesión tiene activado el modo aproximado"""
+    if not approximate_mode(session_id):
+        return ""
+    return (
+        "\n## Modo aproximado activado en esta sesión\n"
+        "El usuario eligió respuestas rápidas y aproximadas: `run_sql_query` usa el modo "
+        "aproximado salvo que pases `approximate=false`. Indica siempre el margen de error."
+    )
+
+def similar_plan_note(plan_match) -> str:
+    """
+    SQL de una pregunta parecida de la caché de planes, como sugerencia: el modelo
+    lo reutiliza solo si responde exactamente la pregunta actual.
+    """
+    if plan_match is None or not plan_match.entry.sql_queries:
+        return ""
+    sql = "\n\n".join(plan_match.entry.sql_queries)
+    return (
+        "\n## Consulta de una pregunta parecida\n"
+        f'La pregunta "{plan_match.entry.question}" se respondió con este SQL:\n'
+        f"```sql\n{sql}\n```\n"
+        "Si responde exactamente la pregunta actual, ejecútalo tal cual; si la pregunta "
+        "pide otra cosa (otro filtro, orden, métrica o período), escribe tu propia consulta."
+    )
+
+def initial_state(query: str, plan_match=None, session_id: str = "default"):
+    """
+    Estado inicial del grafo: system instruction (con el catálogo de datos de
+    esta pregunta) + pregunta del usuario. Si hay un plan parecido en la caché,
+    su SQL se agrega al system instruction para que el modelo confirme si sirve.
+    """
+    # OpenAI soporta SystemMessage nativamente
+    messages = [
+        # Con id fijo: en una conversación guardada reemplaza al system instruction anterior
+        SystemMessage(
+            # La parte fija va primero; el catálogo cambia con cada pregunta
+            content=SYSTEM_INSTRUCTION
+            + schema_context(query)
+            + session_artifacts_note(session_id)
+            + approximate_mode_note(session_id)
+            + similar_plan_note(plan_match),
+            id=SYSTEM_MESSAGE_ID,
+        ),
+        HumanMessage(content=query)
+    ]
+    return {"messages": messages}
+
+def successful_sql(messages):
+    """SQL de las tool calls que se ejecutaron correctamente (para la caché de planes)"""
+    queries = {}
+    for message in messages:
+        if isinstance(message, AIMessage):
+            for tool_call in message.tool_calls:
+                if tool_call["name"] in SQL_TOOLS:
+                    queries[tool_call["id"]] = tool_call["args"].get("query", "")
+    return [
+        queries[message.tool_call_id]
+        for message in messages
+        if isinstance(message, ToolMessage)
+        and message.tool_call_id in queries
+        and (message.artifact or {}).get("estado") == "ok"
+    ]
+
+def lookup_plan(query: str):
+    """Busca la pregunta en la caché de planes (None si no hay o está desactivada)"""
+    plan_cache = get_plan_cache()
+    return plan_cache.lookup(query) if plan_cache is not None else None
+
+def plan_for_turn(query: str, session_id: str):
+    """
+    Devuelve (es_seguimiento, plan). Las preguntas de seguimiento ("¿y en 2017?")
+    dependen de la conversación, así que solo el primer turno usa la caché de planes.
+    """
+    follow_up = has_history(session_id)
+    return follow_up, None if follow_up else lookup_plan(query)
+
+def used_approximation(messages):
+    """True si alguna consulta del turno se respondió en modo aproximado"""
+    return any(
+        isinstance(message, ToolMessage) and (message.artifact or {}).get("aproximada")
+        for message in messages
+    )
+
+def remember_plan(query: str, messages, follow_up: bool = False):
+    """Guarda el SQL que funcionó y la respuesta final de una pregunta (del turno actual)"""
+    plan_cache = get_plan_cache()
+    if plan_cache is None or follow_up:
+        return
+    turn = current_turn(messages)
+    # Una respuesta aproximada no se reutiliza como si fuera exacta
+    if used_approximation(turn):
+        return
+    sql_queries = successful_sql(turn)
+    answer = messages[-1].content if messages else ""
+    if sql_queries and answer:
+        plan_cache.store(query, sql_queries, answer)
+
+def remember_answer(query: str, answer: str, session_id: str):
+    """Agrega a la memoria de la sesión un turno respondido sin ejecutar el grafo (caché de planes)"""
+    agent = get_agent()
+    if agent.checkpointer is None:
+        return
+    agent.app.update_state(
+        {"configurable": {"thread_id": session_id}},
+        {"messages": initial_state(query, None, session_id)["messages"] + [AIMessage(content=answer)]},
+        as_node="agent",
+    )
+
+def run_agent(query: str, session_id: str = "default"):
     """
     Ejecuta el agente con una consulta del usuario
     
     Args:
         query: Pregunta del usuario en lenguaje natural
+        session_id: Identificador de la sesión (memoria de la conversación y presupuesto de bytes)
         
     Returns:
         La respuesta final del agente
     """
     
-    # Crear el mensaje inicial con el system instruction y la pregunta del usuario
-    # OpenAI soporta SystemMessage nativamente
-    initial_messages = [
-        SystemMessage(content=SYSTEM_INSTRUCTION),
-        HumanMessage(content=query)
-    ]
+    # Si la pregunta ya se respondió antes (misma forma normalizada), no hace falta el grafo
+    follow_up, plan_match = plan_for_turn(query, session_id)
+    if plan_match is not None and plan_match.exact:
+        with trace_question(query, path="plan_cache"):
+            remember_answer(query, plan_match.entry.answer, session_id)
+            return plan_match.entry.answer
     
-    # Ejecutar el grafo (usa la variable global 'app')
-    result = app.invoke({"messages": initial_messages})
+    # Ejecutar el grafo (el del proceso, construido en la primera pregunta)
+    with trace_question(query) as trace:
+        result = get_agent().app.invoke(
+            initial_state(query, plan_match, session_id),
+            config={"configurable": {"thread_id": session_id}},
+        )
+        trace["iterations"] = count_iterations(current_turn(result["messages"]))
+    remember_plan(query, result["messages"], follow_up)
     
     # Obtener la respuesta final
     final_message = result["messages"][-1]
     return final_message.content
 
+async def arun_agent(query: str, session_id: str = "default"):
+    """
+    Versión asíncrona de `run_agent`: usa `async_app`, donde las tool calls de un
+    mismo turno se ejecutan en paralelo y cada consulta tiene un tiempo límite.
+    
+    Args:
+        query: Pregunta del usuario en lenguaje natural
+        session_id: Identificador de la sesión (memoria de la conversación y presupuesto de bytes)
+        
+    Returns:
+        La respuesta final del agente
+    """
+    # La memoria y la caché de planes son SQLite: se leen fuera del event loop
+    follow_up, plan_match = await asyncio.to_thread(plan_for_turn, query, session_id)
+    if plan_match is not None and plan_match.exact:
+        with trace_question(query, path="plan_cache"):
+            await asyncio.to_thread(remember_answer, query, plan_match.entry.answer, session_id)
+            return plan_match.entry.answer
+    
+    with trace_question(query) as trace:
+        result = await get_agent().async_app.ainvoke(
+            initial_state(query, plan_match, session_id),
+            config={"configurable": {"thread_id": session_id}},
+        )
+        trace["iterations"] = count_iterations(current_turn(result["messages"]))
+    await asyncio.to_thread(remember_plan, query, result["messages"], follow_up)
+    
+    final_message = result["messages"][-1]
+    return final_message.content
+
+async def astream_agent(query: str, session_id: str = "default"):
+    """
+    Ejecuta el agente en modo streaming y va entregando eventos de progreso.
+    
+    Args:
+        query: Pregunta del usuario en lenguaje natural
+        session_id: Identificador de la sesión (memoria de la conversación y presupuesto de bytes)
+        
+    Yields:
+        Diccionarios con una clave "type":
+        - "plan_hit": la pregunta está en la caché de planes ("exact", "score").
+        - "sql": el modelo generó una consulta ("query", "tool").
+        - "query_running": se empezaron a ejecutar las consultas del turno ("count").
+        - "rows": llegó el resultado de una consulta ("rows", "cache", "status", "approximate",
+          "rollup", "job": ID del trabajo si se envió o se leyó uno en segundo plano).
+        - "token": un fragmento de la respuesta final ("content").
+        - "final": la respuesta final completa ("content").
+    """
+    follow_up, plan_match = await asyncio.to_thread(plan_for_turn, query, session_id)
+    if plan_match is not None:
+        yield {"type": "plan_hit", "exact": plan_match.exact, "score": plan_match.score}
+        if plan_match.exact:
+            with trace_question(query, path="plan_cache"):
+                await asyncio.to_thread(remember_answer, query, plan_match.entry.answer, session_id)
+                yield {"type": "token", "content": plan_match.entry.answer}
+                yield {"type": "final", "content": plan_match.entry.answer}
+            return
+    
+    with trace_question(query) as trace:
+        async for event in _astream_graph(query, session_id, plan_match, trace, follow_up):
+            yield event
+
+async def _astream_graph(
+    query: str, session_id: str, plan_match, trace: dict, follow_up: bool = False
+):
+    """Eventos de `astream_agent` cuando hay que ejecutar el grafo"""
+    state = initial_state(query, plan_match, session_id)
+    messages = list(state["messages"])
+    final_content = ""
+    
+    async for mode, data in get_agent().async_app.astream(
+        state,
+        config={"configurable": {"thread_id": session_id}},
+        stream_mode=["messages", "updates"],
+    ):
+        if mode == "messages":
+            # Tokens del modelo a medida que llegan (solo texto, no los tool calls)
+            chunk, metadata = data
+            if (
+                metadata.get("langgraph_node") == "agent"
+                and isinstance(chunk, AIMessage)
+                and chunk.content
+                and not getattr(chunk, "tool_call_chunks", None)
+            ):
+                yield {"type": "token", "content": chunk.content}
+            continue
+        
+        for node, update in data.items():
+            if node == "compact":
+                # La compactación solo reescribe turnos anteriores de la memoria
+                continue
+            for message in (update or {}).get("messages", []):
+                messages.append(message)
+                if node == "agent" and message.tool_calls:
+                    for tool_call in message.tool_calls:
+                        yield {
+                            "type": "sql",
+                            "query": tool_call["args"].get("query", ""),
+                            "tool": tool_call["name"],
+                        }
+                    yield {"type": "query_running", "count": len(message.tool_calls)}
+                elif node == "agent":
+                    final_content = message.content
+                elif isinstance(message, ToolMessage):
+                    artifact = message.artifact or {}
+                    yield {
+                        "type": "rows",
+                        "rows": artifact.get("filas"),
+                        "cache": artifact.get("cache"),
+                        "status": artifact.get("estado", message.status),
+                        "approximate": bool(artifact.get("aproximada")),
+                        "rollup": artifact.get("rollup"),
+                        "job": artifact.get("trabajo"),
+                    }
+    
+    trace["iterations"] = count_iterations(messages)
+    await asyncio.to_thread(remember_plan, query, messages, follow_up)
+    yield {"type": "final", "content": final_content}
+
+def stream_agent(query: str, session_id: str = "default"):
+    """
+    Versión síncrona de `astream_agent` (para Streamlit): un generador normal.
+    El grafo asíncrono corre completo en un hilo con su propio event loop y
+    los eventos llegan por una cola, así la ejecución no se detiene mientras
+    la interfaz dibuja cada evento.
+    """
+    events = queue.Queue()
+    done = object()
+    
+    async def produce():
+        try:
+            async for event in astream_agent(query, session_id):
+                events.put(event)
+        except Exception as e:
+            events.put(e)
+        finally:
+            events.put(done)
+    
+    worker = threading.Thread(target=lambda: asyncio.run(produce()), daemon=True)
+    worker.start()
+    while True:
+        event = events.get()
+        if event is done:
+            break
+        if isinstance(event, Exception):
+            raise event
+        yield event
+    worker.join()
+
 # ============================================
 # 9. EJEMPLO DE USO
 # ============================================
@@ -0,0 +1,599 @@
+# benchmark.py - Benchmark y prueba de carga del grafo del agente, sin OpenAI ni BigQuery
+#
+# Ejecuta el grafo compilado (`app` / `async_app`) con un modelo falso y determinista
+# (tool calls y respuestas guionadas) y un backend SQL local (DuckDB sobre un Parquet
+# sintético), y escribe un JSON con latencias por nodo, llamadas al modelo, iteraciones,
+# memoria y throughput para comparar ejecuciones.
+#
+# Ejemplos:
+#   python benchmark.py                                  # 3 repeticiones de cada escenario
+#   python benchmark.py --users 8 --questions-per-user 10 --mode async
+#   python benchmark.py --rollups --output after.json --compare before.json
+#   python benchmark.py --no-catalog --output before.json  # esquema completo en cada prompt
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+
+# ============================================
+# 1. ESCENARIOS (PREGUNTA -> SQL GUIONADO -> RESPUESTA)
+# ============================================
+
+TABLE = "`bigquery-public-data.new_york_citibike.citibike_trips`"
+
+# Cada escenario es una pregunta con las consultas que "escribe" el modelo en cada
+# iteración (una lista de SQL por iteración) y su respuesta final. Incluye los
+# ejemplos de la interfaz y de Preguntas_para_testar_agente.txt.
+DEFAULT_SCENARIOS = [
+    {"question": "hola", "sql": [], "answer": "¡Hola! ¿Qué quieres saber de CitiBike?"},
+    {
+        "question": "¿Cuántos viajes en total hay?",
+        "sql": [[f"SELECT COUNT(*) AS total_viajes FROM {TABLE}"]],
+        "answer": "Hay {total_viajes} viajes en total.",
+    },
+    {
+        "question": "¿Cuál es la ruta más popular?",
+        "sql": [[
+            "SELECT start_station_name, end_station_name, COUNT(*) AS viajes "
+            f"FROM {TABLE} GROUP BY 1, 2 ORDER BY viajes DESC LIMIT 1"
+        ]],
+        "answer": "La ruta más popular es la primera del ranking.",
+    },
+    {
+        "question": "¿Cuál es la duración promedio?",
+        "sql": [[f"SELECT ROUND(AVG(tripduration) / 60, 2) AS minutos FROM {TABLE}"]],
+        "answer": "La duración promedio es de unos minutos.",
+    },
+    {
+        "question": "¿Cuántos usuarios son subscribers y cuántos viajes hay por año?",
+        "sql": [[
+            f"SELECT COUNTIF(usertype = 'Subscriber') AS subscribers FROM {TABLE}",
+            f"SELECT EXTRACT(YEAR FROM starttime) AS anio, COUNT(*) AS viajes FROM {TABLE} "
+            "GROUP BY anio ORDER BY viajes DESC",
+        ]],
+        "answer": "Estos son los subscribers y los viajes por año.",
+    },
+    {
+        "question": "Cuantos de estos viajes inician y terminan en el mismo lugar",
+        "sql": [[f"SELECT COUNTIF(start_station_id = end_station_id) AS circulares FROM {TABLE}"]],
+        "answer": "Algunos viajes empiezan y terminan en la misma estación.",
+    },
+    {
+        # Primera consulta con una columna mal escrita: la rechaza la validación local
+        "question": "¿Cuáles son las 10 rutas más populares y su duración típica?",
+        "sql": [
+            [f"SELECT start_station_name, end_station_name, COUNT(*) AS viajes, AVG(tripduraton) AS d FROM {TABLE} GROUP BY 1, 2"],
+            [
+                "SELECT start_station_name, end_station_name, COUNT(*) AS viajes, "
+                "APPROX_QUANTILES(tripduration, 100)[OFFSET(50)] AS mediana "
+                f"FROM {TABLE} GROUP BY 1, 2 ORDER BY viajes DESC LIMIT 10"
+            ],
+        ],
+        "answer": "Estas son las 10 rutas más populares con su duración mediana.",
+    },
+]
+
+# ============================================
+# 2. MODELO FALSO Y DATOS SINTÉTICOS
+# ============================================
+
+class ScriptedChatModel:
+    """
+    Modelo de chat falso y determinista: según la última pregunta del usuario y
+    cuántas veces ya pidió tools en ese turno, devuelve las tool calls del
+    escenario o su respuesta final. No guarda estado, así que sirve para varios
+    usuarios concurrentes. `latency_s` simula el tiempo de respuesta del modelo.
+    """
+
+    def __init__(self, scenarios: list, latency_s: float = 0.0):
+        self.scenarios = {scenario["question"]: scenario for scenario in scenarios}
+        self.latency_s = latency_s
+
+    def respond(self, messages):
+        from langchain_core.messages import AIMessage, HumanMessage
+
+        from memory import current_turn
+        from tools.result_format import estimate_tokens
+
+        turn = current_turn(messages)
+        question = turn[0].content if turn and isinstance(turn[0], HumanMessage) else ""
+        scenario = self.scenarios.get(question, {"sql": [], "answer": "Sin guion para esta pregunta."})
+        iteration = sum(1 for message in turn if getattr(message, "tool_calls", None))
+        prompt_tokens = sum(estimate_tokens(str(message.content)) for message in messages)
+
+        if iteration < len(scenario["sql"]):
+            tool_calls = [
+                {"name": "run_sql_query_langchain", "args": {"query": sql}, "id": f"bench_{uuid.uuid4().hex[:12]}"}
+                for sql in scenario["sql"][iteration]
+            ]
+            content = ""
+        else:
+            tool_calls = []
+            content = scenario["answer"]
+        return AIMessage(
+            content=content,
+            tool_calls=tool_calls,
+            usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": estimate_tokens(content) + 20 * len(tool_calls),
+                "total_tokens": prompt_tokens + estimate_tokens(content) + 20 * len(tool_calls),
+            },
+        )
+
+    def invoke(self, messages, config=None):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        return self.respond(messages)
+
+    async def ainvoke(self, messages, config=None):
+        if self.latency_s:
+            await asyncio.sleep(self.latency_s)
+        return self.respond(messages)
+
+    def as_runnable(self):
+        from langchain_core.runnables import RunnableLambda
+
+        return RunnableLambda(self.invoke, afunc=self.ainvoke)
+
+
+def generate_trips_parquet(path: str, rows: int, seed: int = 7) -> str:
+    """Escribe un Parquet sintético con el esquema de citibike_trips (determinista por `seed`)."""
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rng = np.random.default_rng(seed)
+    stations = 60
+    start_ids = rng.integers(1, stations + 1, rows)
+    end_ids = rng.integers(1, stations + 1, rows)
+    start = np.datetime64("2014-01-01") + rng.integers(0, 5 * 365 * 24 * 3600, rows).astype("timedelta64[s]")
+    duration = rng.gamma(2.0, 600.0, rows).astype("int64") + 60
+    latitude = 40.7 + start_ids / 1000
+    longitude = -74.0 + start_ids / 1000
+    table = pa.table({
+        "tripduration": duration,
+        "starttime": pa.array(start, pa.timestamp("us")),
+        "stoptime": pa.array(start + duration.astype("timedelta64[s]"), pa.timestamp("us")),
+        "start_station_id": start_ids,
+        "start_station_name": [f"Station {i}" for i in start_ids],
+        "start_station_latitude": latitude,
+        "start_station_longitude": longitude,
+        "end_station_id": end_ids,
+        "end_station_name": [f"Station {i}" for i in end_ids],
+        "end_station_latitude": 40.7 + end_ids / 1000,
+        "end_station_longitude": -74.0 + end_ids / 1000,
+        "bikeid": rng.integers(10000, 30000, rows),
+        "usertype": rng.choice(["Subscriber", "Customer"], rows, p=[0.85, 0.15]),
+        "birth_year": rng.integers(1950, 2002, rows),
+        "gender": rng.choice(["male", "female", "unknown"], rows, p=[0.6, 0.3, 0.1]),
+        "customer_plan": rng.choice(["", "annual"], rows),
+    })
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(table, path)
+    return path
+
+# ============================================
+# 3. ESTADÍSTICAS
+# ============================================
+
+def percentile(values: list, q: float):
+    """Percentil `q` (0-100) con interpolación lineal (None si no hay valores)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def describe(values: list) -> dict:
+    """Conteo, media y percentiles de una lista de latencias o conteos."""
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 6),
+        "p50": round(percentile(values, 50), 6),
+        "p90": round(percentile(values, 90), 6),
+        "p95": round(percentile(values, 95), 6),
+        "p99": round(percentile(values, 99), 6),
+        "max": round(max(values), 6),
+    }
+
+
+def read_spans(trace_file: str, offset: int) -> list:
+    """Spans escritos en el archivo de trazas a partir de `offset` bytes."""
+    if not os.path.exists(trace_file):
+        return []
+    with open(trace_file, "r", encoding="utf-8") as handle:
+        handle.seek(offset)
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def summarize_spans(spans: list) -> dict:
+    """Latencias por nodo y por tool, y llamadas al modelo / iteraciones por pregunta."""
+    nodes, tools, per_trace = {}, {}, {}
+    for record in spans:
+        name = record["span"]
+        trace = per_trace.setdefault(record.get("trace_id"), {"llm_calls": 0, "tool_iterations": 0, "tool_calls": 0})
+        if name.startswith("node:"):
+            node = name[len("node:"):]
+            nodes.setdefault(node, []).append(record["duration_s"])
+            if node == "agent":
+                trace["llm_calls"] += 1
+            elif node == "tools":
+                trace["tool_iterations"] += 1
+        elif name.startswith("tool:"):
+            tools.setdefault(name[len("tool:"):], []).append(record["duration_s"])
+            trace["tool_calls"] += 1
+        elif name == "question":
+            trace["question"] = record.get("question")
+    questions = [trace for trace in per_trace.values() if "question" in trace]
+    return {
+        "nodes": {node: describe(values) for node, values in sorted(nodes.items())},
+        "tools": {tool: describe(values) for tool, values in sorted(tools.items())},
+        "per_question": questions,
+    }
+
+
+def peak_rss_mb():
+    """Memoria residente máxima del proceso en MB (None si el sistema no la informa)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa KB; macOS, bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+# ============================================
+# 4. EJECUCIÓN
+# ============================================
+
+def configure_environment(args, workdir: Path):
+    """
+    Variables de entorno del benchmark (antes de importar el agente, que las lee al
+    importarse): backend DuckDB local y cachés, memoria y trazas en un directorio temporal.
+    """
+    data_path = args.data or str(workdir / "citibike_trips.parquet")
+    if not args.data:
+        generate_trips_parquet(data_path, args.rows)
+    os.environ.update({
+        "SQL_BACKEND": "duckdb",
+        "DUCKDB_PARQUET_PATH": data_path,
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY") or "benchmark",
+        "SQL_CACHE_DIR": str(workdir / "sql_cache"),
+        "SQL_CACHE_ENABLED": "true" if args.sql_cache else "false",
+        "PLAN_CACHE_DIR": str(workdir / "plan_cache"),
+        "PLAN_CACHE_ENABLED": "true" if args.plan_cache else "false",
+        "ARTIFACTS_DIR": str(workdir / "artifacts"),
+        "MEMORY_DB_PATH": str(workdir / "checkpoints.sqlite"),
+        "ROLLUPS_DIR": str(workdir / "rollups"),
+        "ROLLUPS_ENABLED": "true" if args.rollups else "false",
+        "CATALOG_PATH": str(workdir / "catalog.json"),
+        "CATALOG_ENABLED": "false" if args.no_catalog else "true",
+        "TRACE_FILE": str(workdir / "traces.jsonl"),
+        "METRICS_ENABLED": "true",
+        "COST_GUARD_ENABLED": "false",
+        "BQ_WARMUP_ON_STARTUP": "false",
+        # El modelo y el backend son locales: sin límites de tasa del proveedor
+        "LLM_REQUESTS_PER_MINUTE": "0",
+        "LLM_TOKENS_PER_MINUTE": "0",
+        "BIGQUERY_REQUESTS_PER_MINUTE": "0",
+    })
+    return data_path
+
+
+def run_users(agent, questions: list, users: int, per_user: int, mode: str, run_id: str) -> list:
+    """
+    Ejecuta `users` usuarios simulados a la vez (hilos con `run_agent` o tareas con
+    `arun_agent`), cada uno con su propia sesión. Devuelve un registro por pregunta.
+    """
+    results = []
+    lock = threading.Lock()
+
+    def record(user, question, started, error):
+        with lock:
+            results.append({
+                "user": user,
+                "question": question,
+                "latency_s": time.perf_counter() - started,
+                "error": error,
+            })
+
+    def plan(user):
+        return [questions[(user + i) % len(questions)] for i in range(per_user)]
+
+    if mode == "async":
+        async def user_loop(user):
+            for question in plan(user):
+                started, error = time.perf_counter(), None
+                try:
+                    await agent.arun_agent(question, session_id=f"{run_id}-u{user}")
+                except Exception as e:
+                    error = repr(e)
+                record(user, question, started, error)
+
+        async def main():
+            await asyncio.gather(*(user_loop(user) for user in range(users)))
+
+        asyncio.run(main())
+        return results
+
+    def user_thread(user):
+        for question in plan(user):
+            started, error = time.perf_counter(), None
+            try:
+                agent.run_agent(question, session_id=f"{run_id}-u{user}")
+            except Exception as e:
+                error = repr(e)
+            record(user, question, started, error)
+
+    threads = [threading.Thread(target=user_thread, args=(user,)) for user in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def run_benchmark(args) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="agent-bench-"))
+    data_path = configure_environment(args, workdir)
+    scenarios = json.loads(Path(args.scenarios).read_text(encoding="utf-8")) if args.scenarios else DEFAULT_SCENARIOS
+    if args.questions_per_user is None:
+        # 3 vueltas a los escenarios que se van a usar (los de --scenarios, si se pasaron)
+        args.questions_per_user = 3 * len(scenarios)
+
+    import_started = time.perf_counter()
+    import agent_langgraph as agent
+    import_seconds = time.perf_counter() - import_started
+
+    agent.configure_agent(llm=ScriptedChatModel(scenarios, args.llm_latency_ms / 1000).as_runnable())
+    if args.rollups:
+        from tools.rollups import get_rollup_store
+        from tools.run_sql_query import get_backend
+
+        get_rollup_store().refresh(get_backend())
+    if not args.no_catalog:
+        from tools.catalog import get_catalog
+        from tools.run_sql_query import get_backend
+
+        get_catalog().refresh(get_backend())
+
+    from tools.result_format import estimate_tokens
+
+    questions = [scenario["question"] for scenario in scenarios]
+    # Tamaño del system prompt de cada pregunta (instrucciones + catálogo de datos)
+    system_tokens = [
+        estimate_tokens(agent.initial_state(question)["messages"][0].content) for question in questions
+    ]
+    trace_file = os.environ["TRACE_FILE"]
+    # Calentamiento (conexión DuckDB, imports perezosos): no entra en las estadísticas
+    run_users(agent, questions, 1, len(questions) * args.warmup, args.mode, "warmup")
+    offset = os.path.getsize(trace_file) if os.path.exists(trace_file) else 0
+
+    if args.trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    results = run_users(agent, questions, args.users, args.questions_per_user, args.mode, "run")
+    wall_seconds = time.perf_counter() - started
+    peak_python = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+    if args.trace_memory:
+        tracemalloc.stop()
+
+    spans = summarize_spans(read_spans(trace_file, offset))
+    per_question = spans.pop("per_question")
+    latencies = [result["latency_s"] for result in results]
+    scenarios_summary = {}
+    for question in questions:
+        measured = [r["latency_s"] for r in results if r["question"] == question]
+        traced = [t for t in per_question if t["question"] == question]
+        scenarios_summary[question] = {
+            "latency_s": describe(measured),
+            "llm_calls": describe([t["llm_calls"] for t in traced]),
+            "tool_iterations": describe([t["tool_iterations"] for t in traced]),
+            "tool_calls": describe([t["tool_calls"] for t in traced]),
+        }
+
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "mode": args.mode,
+            "users": args.users,
+            "questions_per_user": args.questions_per_user,
+            "llm_latency_ms": args.llm_latency_ms,
+            "rows": None if args.data else args.rows,
+            "data": data_path,
+            "sql_cache": args.sql_cache,
+            "plan_cache": args.plan_cache,
+            "rollups": args.rollups,
+            "catalog": not args.no_catalog,
+            "scenarios": len(scenarios),
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "git_commit": _git_commit(),
+        },
+        "summary": {
+            "questions": len(results),
+            "errors": sum(1 for r in results if r["error"]),
+            "wall_seconds": round(wall_seconds, 4),
+            "throughput_qps": round(len(results) / wall_seconds, 3) if wall_seconds else None,
+            "latency_s": describe(latencies),
+            "llm_calls_per_question": describe([t["llm_calls"] for t in per_question]),
+            "tool_iterations_per_question": describe([t["tool_iterations"] for t in per_question]),
+            "import_seconds": round(import_seconds, 4),
+            "system_prompt_tokens": describe(system_tokens),
+            "peak_rss_mb": peak_rss_mb(),
+            "peak_python_mb": round(peak_python / 1024**2, 2) if peak_python is not None else None,
+        },
+        "nodes": spans["nodes"],
+        "tools": spans["tools"],
+        "scenarios": scenarios_summary,
+        "errors": [r for r in results if r["error"]][:10],
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=Path(__file__).parent,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+# ============================================
+# 5. PRESUPUESTO DE TIEMPO DE IMPORTACIÓN
+# ============================================
+
+# Todos los valores se pueden sobreescribir desde el archivo .env
+# Tiempo máximo para `import agent_langgraph` (el grafo se construye recién en el primer uso)
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "2.0"))
+# Dependencias pesadas que solo se importan al usarse (modelo, cliente de BigQuery, pool,
+# lotes de Arrow, parser de SQL)
+DEFERRED_IMPORTS = (
+    "langchain_openai", "google.cloud.bigquery", "sqlalchemy", "pandas", "pyarrow", "sqlglot",
+)
+
+
+def check_import_budget(module: str = "agent_langgraph", budget_s: float = IMPORT_BUDGET_SECONDS,
+                        attempts: int = 3) -> dict:
+    """
+    Importa `module` en un proceso nuevo con `python -X importtime` (el mejor de
+    `attempts` intentos, para no medir el disco frío) y revisa que no supere
+    `budget_s` ni cargue ninguna de DEFERRED_IMPORTS.
+    """
+    best = None
+    for _ in range(attempts):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True, text=True, cwd=Path(__file__).parent, timeout=120,
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(f"No se pudo importar {module}:\n{completed.stderr[-2000:]}")
+        # Líneas "import time: <propio µs> | <acumulado µs> | <módulo>"
+        rows = []
+        for line in completed.stderr.splitlines():
+            parts = line.removeprefix("import time:").split("|")
+            if line.startswith("import time:") and parts[0].strip().isdigit():
+                rows.append((int(parts[0]), int(parts[1]), parts[2].strip()))
+        total = next(cumulative for _, cumulative, name in rows if name == module) / 1e6
+        if best is None or total < best[0]:
+            best = (total, rows)
+
+    total, rows = best
+    loaded = {name for _, _, name in rows}
+    deferred_loaded = [name for name in DEFERRED_IMPORTS if name in loaded]
+    heaviest = sorted(rows, key=lambda row: row[1], reverse=True)
+    return {
+        "module": module,
+        "seconds": round(total, 4),
+        "budget_s": budget_s,
+        "deferred_loaded": deferred_loaded,
+        "ok": total <= budget_s and not deferred_loaded,
+        "heaviest": [
+            {"module": name, "cumulative_s": round(cumulative / 1e6, 4)}
+            for _, cumulative, name in heaviest[1:11]
+        ],
+    }
+
+# ============================================
+# 6. COMPARACIÓN Y LÍNEA DE COMANDOS
+# ============================================
+
+def compare(current: dict, baseline: dict) -> list:
+    """Líneas con el cambio (%) de las métricas principales respecto a otra ejecución."""
+    def change(new, old):
+        if new is None or old in (None, 0):
+            return "n/a"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    lines = []
+    for label, path in (
+        ("latencia p50", ("summary", "latency_s", "p50")),
+        ("latencia p95", ("summary", "latency_s", "p95")),
+        ("throughput", ("summary", "throughput_qps")),
+        ("memoria pico (RSS)", ("summary", "peak_rss_mb")),
+    ):
+        new, old = current, baseline
+        for key in path:
+            new = (new or {}).get(key)
+            old = (old or {}).get(key)
+        lines.append(f"{label}: {old} -> {new} ({change(new, old)})")
+    for node, stats in current["nodes"].items():
+        old = baseline.get("nodes", {}).get(node, {}).get("p95")
+        lines.append(f"nodo {node} p95: {old} -> {stats.get('p95')} ({change(stats.get('p95'), old)})")
+    return lines
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline del grafo del agente.")
+    parser.add_argument("--users", type=int, default=1, help="Usuarios simulados concurrentes")
+    parser.add_argument("--questions-per-user", type=int, default=None,
+                        help="Preguntas por usuario (por defecto, 3 vueltas a los escenarios)")
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync",
+                        help="sync: `app` en hilos; async: `async_app` en un event loop")
+    parser.add_argument("--llm-latency-ms", type=float, default=50, help="Latencia simulada del modelo")
+    parser.add_argument("--rows", type=int, default=200_000, help="Filas del Parquet sintético")
+    parser.add_argument("--data", help="Parquet propio en lugar del sintético")
+    parser.add_argument("--scenarios", help="JSON con escenarios (mismo formato que DEFAULT_SCENARIOS)")
+    parser.add_argument("--warmup", type=int, default=1, help="Vueltas de calentamiento sin medir")
+    parser.add_argument("--sql-cache", action="store_true", help="Activa la caché de resultados SQL")
+    parser.add_argument("--plan-cache", action="store_true", help="Activa la caché de planes")
+    parser.add_argument("--rollups", action="store_true", help="Construye y usa los rollups locales")
+    parser.add_argument("--no-catalog", action="store_true",
+                        help="Sin catálogo: el esquema completo va en cada prompt (CATALOG_ENABLED=false)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Mide el pico de memoria de Python con tracemalloc (más lento)")
+    parser.add_argument("--output", default=None, help="Archivo JSON de resultados")
+    parser.add_argument("--compare", default=None, help="JSON de una ejecución anterior")
+    parser.add_argument("--check-imports", action="store_true",
+                        help="Solo revisa el tiempo de `import agent_langgraph` (IMPORT_BUDGET_SECONDS)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.check_imports:
+        result = check_import_budget()
+        print(f"import agent_langgraph: {result['seconds']} s (presupuesto {result['budget_s']} s)")
+        for row in result["heaviest"][:5]:
+            print(f"  {row['module']}: {row['cumulative_s']} s")
+        if result["deferred_loaded"]:
+            print("Importados al cargar el módulo (deberían ser perezosos): " + ", ".join(result["deferred_loaded"]))
+        print("OK" if result["ok"] else "FUERA DE PRESUPUESTO")
+        sys.exit(0 if result["ok"] else 1)
+    report = run_benchmark(args)
+    output = Path(args.output or Path(__file__).parent / ".cache" / "benchmarks" / f"bench-{int(time.time())}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    summary = report["summary"]
+    print(f"Preguntas: {summary['questions']} ({summary['errors']} con error) en {summary['wall_seconds']} s "
+          f"-> {summary['throughput_qps']} preguntas/s")
+    print(f"Latencia p50 / p95: {summary['latency_s'].get('p50')} / {summary['latency_s'].get('p95')} s")
+    for node, stats in report["nodes"].items():
+        print(f"  nodo {node}: p50 {stats['p50']} s, p95 {stats['p95']} s ({stats['count']} ejecuciones)")
+    print(f"Resultados: {output}")
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        print("\n".join(compare(report, baseline)))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# concurrency.py - Límites de concurrencia (LLM / BigQuery) y control de admisión del servicio
+#
+# Los límites por recurso los aplica la concurrencia adaptativa (AIMD) de
+# rate_limit.RetryScheduler: es el único cupo por el que pasa cada llamada.
+
+import asyncio
+import math
+import os
+import time
+
+from instrumentation import metrics
+
+# ============================================
+# 1. CONFIGURACIÓN
+# ============================================
+
+# Todos los valores se pueden sobreescribir desde el archivo .env
+# Llamadas simultáneas al modelo en todo el proceso, como máximo (la concurrencia
+# adaptativa lo baja con el throttling); 0 = sin límite, igual que BigQuery
+LLM_MAX_CONCURRENT_CALLS = int(os.getenv("LLM_MAX_CONCURRENT_CALLS", "8"))
+# Consultas simultáneas al backend (jobs de BigQuery) en todo el proceso
+BIGQUERY_MAX_CONCURRENT_JOBS = int(os.getenv("BIGQUERY_MAX_CONCURRENT_JOBS", "4"))
+# Preguntas que el servicio HTTP ejecuta a la vez, y cuántas pueden esperar turno
+AGENT_MAX_CONCURRENT_RUNS = int(os.getenv("AGENT_MAX_CONCURRENT_RUNS", "8"))
+AGENT_MAX_QUEUE = int(os.getenv("AGENT_MAX_QUEUE", "16"))
+# Tiempo máximo de espera en la cola antes de responder 429
+AGENT_QUEUE_TIMEOUT_SECONDS = float(os.getenv("AGENT_QUEUE_TIMEOUT_SECONDS", "30"))
+
+# ============================================
+# 2. CONTROL DE ADMISIÓN (SERVICIO HTTP)
+# ============================================
+
+class Overloaded(Exception):
+    """El servicio está saturado; el cliente debe reintentar en `retry_after` segundos."""
+
+    def __init__(self, retry_after: int, reason: str):
+        super().__init__(f"Servicio saturado ({reason}); reintenta en {retry_after} s.")
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Cola acotada delante del agente: como máximo `max_running` preguntas en
+    ejecución y `max_queue` esperando turno. Si la cola está llena, o la espera
+    supera `queue_timeout`, se rechaza con `Overloaded` (HTTP 429 + Retry-After)
+    en lugar de acumular trabajo sin límite.
+    """
+
+    def __init__(
+        self,
+        max_running: int = AGENT_MAX_CONCURRENT_RUNS,
+        max_queue: int = AGENT_MAX_QUEUE,
+        queue_timeout: float = AGENT_QUEUE_TIMEOUT_SECONDS,
+    ):
+        self.max_running = max_running
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_running)
+        # Duración media (EWMA) de una pregunta, para estimar el Retry-After
+        self._avg_run_seconds = 10.0
+
+    def retry_after(self) -> int:
+        """Segundos estimados hasta que se libere un cupo para una nueva pregunta."""
+        rounds = (self.waiting + 1) / max(self.max_running, 1)
+        return max(1, math.ceil(self._avg_run_seconds * rounds))
+
+    def _reject(self, reason: str):
+        metrics.inc(
+            "agent_admission_rejected_total", help="Preguntas rechazadas con 429", reason=reason
+        )
+        raise Overloaded(self.retry_after(), reason)
+
+    async def acquire(self) -> float:
+        """
+        Espera un cupo de ejecución. Devuelve el instante de inicio (para `release`).
+
+        Raises:
+            Overloaded: si la cola está llena o la espera supera `queue_timeout`.
+        """
+        start = time.perf_counter()
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self._reject("cola_llena")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject("espera_excedida")
+            finally:
+                self.waiting -= 1
+        else:
+            # Hay cupo libre: acquire() lo toma sin ceder el event loop
+            await self._semaphore.acquire()
+        self.running += 1
+        metrics.observe(
+            "agent_admission_wait_seconds",
+            time.perf_counter() - start,
+            help="Espera en la cola del servicio antes de ejecutar una pregunta",
+        )
+        return time.perf_counter()
+
+    def release(self, started_at: float):
+        """Libera el cupo y actualiza la duración media de las preguntas."""
+        self.running -= 1
+        self._semaphore.release()
+        duration = time.perf_counter() - started_at
+        self._avg_run_seconds = 0.8 * self._avg_run_seconds + 0.2 * duration
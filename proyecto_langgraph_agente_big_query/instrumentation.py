@@ -0,0 +1,318 @@
+# instrumentation.py - Métricas (Prometheus) y trazas (JSONL) del agente
+
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# ============================================
+# 1. CONFIGURACIÓN
+# ============================================
+
+# Todos los valores se pueden sobreescribir desde el archivo .env
+# METRICS_ENABLED=false desactiva las trazas en archivo y el endpoint /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Puerto del endpoint /metrics en formato Prometheus (0 = no se levanta el servidor)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Archivo JSONL con una línea por span (vacío = no se escriben trazas)
+TRACE_FILE = os.getenv("TRACE_FILE", str(Path(__file__).parent / ".cache" / "traces.jsonl"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000, 1e8, 1e10, 1e12)
+COUNT_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 15, 25)
+
+# ============================================
+# 2. REGISTRO DE MÉTRICAS
+# ============================================
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _format_labels(key: tuple, extra: dict = None) -> str:
+    items = list(key) + list((extra or {}).items())
+    if not items:
+        return ""
+    body = ",".join(f'{name}="{str(value)}"' for name, value in items)
+    return "{" + body + "}"
+
+
+class MetricsRegistry:
+    """
+    Contadores e histogramas con etiquetas, seguros entre hilos, que se pueden
+    exportar en el formato de texto de Prometheus.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def inc(self, name: str, value: float = 1, help: str = "", **labels):
+        """Suma `value` a un contador."""
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets=LATENCY_BUCKETS, help: str = "", **labels):
+        """Registra una observación en un histograma."""
+        with self._lock:
+            self._help.setdefault(name, help)
+            buckets_by_name, series = self._histograms.setdefault(name, (tuple(buckets), {}))
+            state = series.setdefault(
+                _label_key(labels), {"counts": [0] * len(buckets_by_name), "sum": 0.0, "count": 0}
+            )
+            for i, upper in enumerate(buckets_by_name):
+                if value <= upper:
+                    state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def snapshot(self) -> dict:
+        """Copia de los valores actuales (útil para benchmarks y pruebas)."""
+        with self._lock:
+            return {
+                "counters": {
+                    name: {_format_labels(key): value for key, value in series.items()}
+                    for name, series in self._counters.items()
+                },
+                "histograms": {
+                    name: {
+                        _format_labels(key): {"count": state["count"], "sum": state["sum"]}
+                        for key, state in series.items()
+                    }
+                    for name, (_, series) in self._histograms.items()
+                },
+            }
+
+    def render_prometheus(self) -> str:
+        """Exporta todas las métricas en el formato de texto de Prometheus."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, '')}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, (buckets, series) in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, '')}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, state in series.items():
+                    for upper, count in zip(buckets, state["counts"]):
+                        lines.append(f"{name}_bucket{_format_labels(key, {'le': upper})} {count}")
+                    lines.append(
+                        f"{name}_bucket{_format_labels(key, {'le': '+Inf'})} {state['count']}"
+                    )
+                    lines.append(f"{name}_sum{_format_labels(key)} {state['sum']}")
+                    lines.append(f"{name}_count{_format_labels(key)} {state['count']}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+metrics = MetricsRegistry()
+
+# ============================================
+# 3. TRAZAS (SPANS) EN JSONL
+# ============================================
+
+# Traza de la pregunta en curso (se propaga a hilos y tareas asyncio con contextvars)
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_trace_lock = threading.Lock()
+
+
+def _write_trace(record: dict):
+    if not METRICS_ENABLED or not TRACE_FILE:
+        return
+    Path(TRACE_FILE).parent.mkdir(parents=True, exist_ok=True)
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _trace_lock, open(TRACE_FILE, "a", encoding="utf-8") as trace_file:
+        trace_file.write(line + "\n")
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Mide la duración de un bloque y la escribe como un span en el archivo de trazas.
+    Devuelve un diccionario de atributos que el bloque puede completar
+    (filas, tokens, estado de la caché...).
+    """
+    trace_id = _current_trace.get()
+    start = time.perf_counter()
+    started_at = time.time()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _write_trace({
+            "trace_id": trace_id,
+            "span": name,
+            "start": started_at,
+            "duration_s": round(duration, 6),
+            "error": error,
+            **attributes,
+        })
+        attributes["duration_s"] = duration
+
+
+@contextmanager
+def trace_question(question: str, path: str = "graph"):
+    """
+    Span raíz de una pregunta: asigna un trace_id compartido por todos los spans
+    de nodos y tools que se ejecuten dentro.
+    """
+    token = _current_trace.set(uuid.uuid4().hex)
+    try:
+        with span("question", question=question, path=path) as attributes:
+            yield attributes
+        metrics.inc(
+            "agent_questions_total", help="Preguntas respondidas por el agente", path=path
+        )
+        metrics.observe(
+            "agent_question_latency_seconds",
+            attributes["duration_s"],
+            help="Latencia total por pregunta",
+            path=path,
+        )
+        if "iterations" in attributes:
+            metrics.observe(
+                "agent_loop_iterations",
+                attributes["iterations"],
+                buckets=COUNT_BUCKETS,
+                help="Iteraciones agente <-> tools por pregunta",
+            )
+    finally:
+        _current_trace.reset(token)
+
+
+# ============================================
+# 4. INSTRUMENTACIÓN DE NODOS, LLM Y CONSULTAS
+# ============================================
+
+def instrument_node(name: str, func):
+    """
+    Envuelve un nodo del grafo (síncrono o asíncrono) para medir su latencia.
+    Se usa al construir el grafo: `workflow.add_node("agent", instrument_node("agent", f))`.
+    """
+    def record(attributes):
+        metrics.observe(
+            "agent_node_latency_seconds",
+            attributes["duration_s"],
+            help="Latencia por nodo del grafo",
+            node=name,
+        )
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with span(f"node:{name}") as attributes:
+                result = await func(*args, **kwargs)
+            record(attributes)
+            return result
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(f"node:{name}") as attributes:
+            result = func(*args, **kwargs)
+        record(attributes)
+        return result
+    return wrapper
+
+
+def record_llm_usage(response, model: str = ""):
+    """Cuenta los tokens de prompt y de respuesta de una llamada al modelo."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens", 0)
+    completion_tokens = usage.get("output_tokens", 0)
+    help_text = "Tokens consumidos por el modelo"
+    metrics.inc("agent_llm_calls_total", help="Llamadas al modelo", model=model)
+    metrics.inc("agent_llm_tokens_total", prompt_tokens, help=help_text, kind="prompt")
+    metrics.inc("agent_llm_tokens_total", completion_tokens, help=help_text, kind="completion")
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+
+def record_query(duration_s: float, artifact: dict, tool: str = "run_sql_query"):
+    """Registra la latencia, filas, bytes y estado de caché de una ejecución de SQL."""
+    metrics.observe(
+        "agent_tool_latency_seconds", duration_s, help="Latencia por llamada a tool", tool=tool
+    )
+    metrics.inc(
+        "agent_tool_calls_total",
+        help="Llamadas a tools por estado",
+        tool=tool,
+        status=artifact.get("estado", "ok"),
+    )
+    cache = artifact.get("cache")
+    if cache:
+        result = "hit" if str(cache).startswith("HIT") else "miss"
+        metrics.inc("agent_sql_cache_total", help="Consultas servidas por la caché SQL", result=result)
+    if artifact.get("filas") is not None:
+        metrics.observe(
+            "agent_query_rows", artifact["filas"], buckets=SIZE_BUCKETS, help="Filas por consulta"
+        )
+    if artifact.get("bytes_estimados") is not None:
+        metrics.observe(
+            "agent_query_bytes_scanned",
+            artifact["bytes_estimados"],
+            buckets=SIZE_BUCKETS,
+            help="Bytes escaneados (estimados) por consulta",
+        )
+
+
+def count_iterations(messages) -> int:
+    """Número de turnos del modelo que pidieron tools en una conversación."""
+    return sum(1 for message in messages if getattr(message, "tool_calls", None))
+
+
+# ============================================
+# 5. ENDPOINT /metrics
+# ============================================
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_metrics_server = None
+
+
+def start_metrics_server(port: int = METRICS_PORT):
+    """
+    Levanta (una sola vez por proceso) un servidor HTTP en segundo plano que sirve
+    /metrics para Prometheus. No hace nada si el puerto es 0.
+    """
+    global _metrics_server
+    if _metrics_server is not None or not port or not METRICS_ENABLED:
+        return _metrics_server
+    _metrics_server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+    return _metrics_server
@@ -3,12 +3,56 @@
 
 import streamlit as st
 import os
+import uuid
 from dotenv import load_dotenv
-from agent_langgraph import run_agent
 
 # Cargar variables de entorno
 load_dotenv()
 
+# Con AGENT_API_URL, la interfaz es un cliente liviano del servicio HTTP (server.py):
+# el agente, las colas y los límites de concurrencia viven en ese servicio
+AGENT_API_URL = os.getenv("AGENT_API_URL", "")
+
+if AGENT_API_URL:
+    from agent_client import AgentClient
+    
+    cliente = AgentClient(AGENT_API_URL)
+    stream_agent = cliente.stream
+    forget_conversation = cliente.forget_conversation
+    set_approximate_mode = cliente.set_approximate_mode
+    invalidar_planes = cliente.invalidate_plan_cache
+    listar_trabajos = cliente.list_jobs
+else:
+    from agent_langgraph import stream_agent
+    from plan_cache import get_plan_cache
+    from memory import forget_conversation
+    from tools.approximate import set_approximate_mode
+    from instrumentation import start_metrics_server
+    from tools.run_sql_query import start_rollup_refresh, start_warmup
+    from tools.query_jobs import get_job_store
+    from tools.catalog import start_catalog_refresh
+    
+    def invalidar_planes():
+        plan_cache = get_plan_cache()
+        if plan_cache is not None:
+            plan_cache.invalidate()
+    
+    def listar_trabajos(session_id):
+        store = get_job_store()
+        return [job.to_dict() for job in store.list(session_id)] if store is not None else []
+    
+    # Endpoint /metrics para Prometheus (solo si METRICS_PORT está configurado)
+    start_metrics_server()
+    
+    # Crear el cliente de BigQuery y abrir conexiones del pool antes de la primera pregunta
+    start_warmup()
+    
+    # Construir / actualizar los rollups locales (solo si ROLLUPS_REFRESH_ON_STARTUP=true)
+    start_rollup_refresh()
+    
+    # Introspectar las tablas y calcular sus estadísticas (solo si CATALOG_REFRESH_ON_STARTUP=true)
+    start_catalog_refresh()
+
 # ============================================
 # CONFIGURACIÓN DE LA PÁGINA
 # ============================================
@@ -94,6 +138,18 @@ with st.sidebar:
         if st.button(f"📝 {ejemplo}", key=ejemplo, use_container_width=True):
             st.session_state.ejemplo_seleccionado = ejemplo
     
+    # Respuestas aproximadas (muestra de la tabla): mucho más rápidas, con margen de error
+    st.toggle(
+        "⚡ Modo aproximado",
+        key="modo_aproximado",
+        help="Responde leyendo una muestra de los datos. Es mucho más rápido e indica el margen de error.",
+    )
+    
+    # Invalidar la caché de planes (por ejemplo, si cambiaron los datos)
+    if st.button("🧹 Olvidar respuestas guardadas", use_container_width=True):
+        invalidar_planes()
+        st.toast("Caché de respuestas vaciada")
+    
     st.markdown("---")
     st.markdown("### 🛠️ Tecnologías")
     st.markdown("""
@@ -106,15 +162,19 @@ with st.sidebar:
     st.markdown("---")
     st.markdown("### ℹ️ Estado del sistema")
     
-    # Verificar configuración
-    openai_ok = bool(os.getenv("OPENAI_API_KEY"))
-    bigquery_ok = bool(os.getenv("GOOGLE_APPLICATION_CREDENTIALS"))
-    
-    st.markdown(f"**OpenAI:** {'✅' if openai_ok else '❌'}")
-    st.markdown(f"**BigQuery:** {'✅' if bigquery_ok else '❌'}")
-    
-    if not openai_ok or not bigquery_ok:
-        st.error("⚠️ Faltan configuraciones. Revisa el archivo .env")
+    if AGENT_API_URL:
+        # Las credenciales las tiene el servicio, no esta interfaz
+        st.markdown(f"**Servicio del agente:** `{AGENT_API_URL}`")
+    else:
+        # Verificar configuración
+        openai_ok = bool(os.getenv("OPENAI_API_KEY"))
+        bigquery_ok = bool(os.getenv("GOOGLE_APPLICATION_CREDENTIALS"))
+        
+        st.markdown(f"**OpenAI:** {'✅' if openai_ok else '❌'}")
+        st.markdown(f"**BigQuery:** {'✅' if bigquery_ok else '❌'}")
+        
+        if not openai_ok or not bigquery_ok:
+            st.error("⚠️ Faltan configuraciones. Revisa el archivo .env")
 
 # ============================================
 # HEADER PRINCIPAL
@@ -143,9 +203,39 @@ Puedo responder preguntas sobre:
 **¿Qué te gustaría saber?**"""
     })
 
+if "session_id" not in st.session_state:
+    # Identificador de la sesión (memoria de la conversación y presupuesto de bytes escaneados)
+    st.session_state.session_id = str(uuid.uuid4())
+
 if "ejemplo_seleccionado" not in st.session_state:
     st.session_state.ejemplo_seleccionado = None
 
+# ============================================
+# CONSULTAS EN SEGUNDO PLANO
+# ============================================
+
+# Se actualiza solo cada 5 segundos (sin rerun de toda la página). Los trabajos
+# siguen corriendo y quedan guardados aunque la página se recargue
+@st.fragment(run_every=5)
+def panel_trabajos():
+    trabajos = listar_trabajos(st.session_state.session_id)
+    if not trabajos:
+        return
+    st.markdown("### 🕒 Consultas en segundo plano")
+    iconos = {"queued": "⏳", "running": "⚙️", "done": "✅", "failed": "❌"}
+    for trabajo in trabajos:
+        with st.expander(f"{iconos.get(trabajo['status'], '•')} {trabajo['id']} · {trabajo['elapsed']:.0f} s"):
+            st.code(trabajo["query"], language="sql")
+            if trabajo["status"] == "done":
+                st.text(trabajo["content"])
+            elif trabajo["status"] == "failed":
+                st.error(trabajo["error"])
+            else:
+                st.caption("Ejecutándose... Pídele al agente el resultado de este trabajo cuando termine.")
+
+with st.sidebar:
+    panel_trabajos()
+
 # ============================================
 # MOSTRAR HISTORIAL DE CHAT
 # ============================================
@@ -178,31 +268,79 @@ if prompt:
     with st.chat_message("user"):
         st.markdown(prompt)
     
-    # Mostrar indicador de que está pensando
+    # Mostrar el progreso del agente y la respuesta a medida que llega
     with st.chat_message("assistant"):
-        with st.spinner("🤔 Analizando tu pregunta y consultando BigQuery..."):
-            try:
-                # Llamar al agente
-                respuesta = run_agent(prompt)
-                
-                # Mostrar respuesta
-                st.markdown(respuesta)
-                
-                # Agregar al historial
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": respuesta
-                })
-                
-            except Exception as e:
+        estado = st.status("🤔 Analizando tu pregunta...", expanded=False)
+        respuesta_placeholder = st.empty()
+        respuesta = ""
+        try:
+            # El modo aproximado se guarda por sesión en el agente (lo usa la tool de SQL)
+            set_approximate_mode(st.session_state.session_id, st.session_state.get("modo_aproximado", False))
+            
+            # Llamar al agente en modo streaming (consultas en paralelo y con timeout)
+            for evento in stream_agent(prompt, session_id=st.session_state.session_id):
+                if evento["type"] == "plan_hit":
+                    if evento["exact"]:
+                        estado.write("⚡ Esta pregunta ya se respondió antes: respuesta reutilizada")
+                    else:
+                        estado.write("♻️ Hay una consulta de una pregunta similar: el modelo revisa si sirve")
+                elif evento["type"] == "sql":
+                    if evento.get("tool") == "get_query_job":
+                        estado.write("🕒 Revisando una consulta en segundo plano...")
+                        continue
+                    if evento.get("tool") == "submit_query_job":
+                        estado.write("🕒 Consulta enviada a segundo plano:")
+                    elif evento.get("tool") == "query_result_artifact":
+                        estado.write("🗂️ Consulta local sobre un resultado guardado:")
+                    else:
+                        estado.write("🧾 Consulta generada:")
+                    estado.code(evento["query"], language="sql")
+                elif evento["type"] == "query_running":
+                    estado.update(label="⏳ Consultando BigQuery...")
+                elif evento["type"] == "rows":
+                    if evento["status"] in ("enviada", "en_curso"):
+                        estado.write(f"🕒 Trabajo `{evento['job']}` en segundo plano (ver el panel lateral)")
+                    elif evento["status"] == "ok":
+                        origen = " (caché)" if str(evento["cache"]).startswith("HIT") else ""
+                        if evento.get("rollup"):
+                            origen = f" (rollup local: {evento['rollup']})"
+                        if evento.get("approximate"):
+                            origen += " (aproximado)"
+                        estado.write(f"📦 {evento['rows']} filas recibidas{origen}")
+                    else:
+                        estado.write(f"⚠️ La consulta terminó con estado: {evento['status']}")
+                    estado.update(label="✍️ Redactando la respuesta...")
+                elif evento["type"] == "token":
+                    respuesta += evento["content"]
+                    respuesta_placeholder.markdown(respuesta + "▌")
+                elif evento["type"] == "final":
+                    respuesta = evento["content"] or respuesta
+            
+            # Mostrar respuesta
+            respuesta_placeholder.markdown(respuesta)
+            estado.update(label="✅ Listo", state="complete")
+            
+            # Agregar al historial
+            st.session_state.messages.append({
+                "role": "assistant",
+                "content": respuesta
+            })
+            
+        except Exception as e:
+            estado.update(label="❌ Error", state="error")
+            if getattr(e, "retry_after", None) is not None:
+                # OpenAI / BigQuery (o el servicio) siguen saturados tras los reintentos:
+                # la pregunta está bien, solo hay que volver a intentarlo más tarde
+                error_msg = f"⏳ **Servicio saturado:** {str(e)}"
+            else:
                 error_msg = f"❌ **Error:** {str(e)}\n\nPor favor, intenta reformular tu pregunta o contacta al administrador."
-                st.error(error_msg)
-                
-                # Agregar error al historial
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": error_msg
-                })
+            st.error(error_msg)
+            
+            # Agregar error al historial
+            st.session_state.messages.append({
+                "role": "assistant",
+                "content": error_msg
+            })
 
 # ============================================
 # BOTÓN PARA LIMPIAR CONVERSACIÓN
@@ -212,6 +350,8 @@ col1, col2, col3 = st.columns([1, 1, 1])
 
 with col2:
     if st.button("🗑️ Limpiar conversación", use_container_width=True):
+        # El agente también olvida la conversación (no solo la interfaz)
+        forget_conversation(st.session_state.session_id)
         st.session_state.messages = []
         st.session_state.messages.append({
             "role": "assistant",
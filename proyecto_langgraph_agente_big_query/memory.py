@@ -0,0 +1,236 @@
+# memory.py - Memoria de la conversación (checkpointer SQLite) y compactación del historial
+
+import asyncio
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from langchain_core.messages import (
+    AIMessage,
+    HumanMessage,
+    RemoveMessage,
+    SystemMessage,
+    ToolMessage,
+)
+
+from tools.result_format import estimate_tokens
+
+# ============================================
+# 1. CONFIGURACIÓN
+# ============================================
+
+# Todos los valores se pueden sobreescribir desde el archivo .env
+# MEMORY_ENABLED=false vuelve al comportamiento anterior (cada pregunta empieza de cero)
+MEMORY_ENABLED = os.getenv("MEMORY_ENABLED", "true").lower() in ("1", "true", "yes")
+MEMORY_DB_PATH = os.getenv(
+    "MEMORY_DB_PATH", str(Path(__file__).parent / ".cache" / "checkpoints.sqlite")
+)
+# Tokens (aproximados) del historial a partir de los cuales se compacta
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "6000"))
+# Turnos más recientes que se conservan completos (con los resultados de sus consultas)
+MEMORY_KEEP_RECENT_TURNS = int(os.getenv("MEMORY_KEEP_RECENT_TURNS", "2"))
+# Caracteres que se conservan de los resultados de consultas de turnos antiguos
+MEMORY_TOOL_OUTPUT_CHARS = int(os.getenv("MEMORY_TOOL_OUTPUT_CHARS", "300"))
+# Caracteres de cada respuesta que se conservan en el resumen de turnos eliminados
+MEMORY_SUMMARY_ANSWER_CHARS = int(os.getenv("MEMORY_SUMMARY_ANSWER_CHARS", "200"))
+# Tamaño máximo del resumen; al superarlo se descartan los turnos resumidos más antiguos
+MEMORY_SUMMARY_MAX_CHARS = int(os.getenv("MEMORY_SUMMARY_MAX_CHARS", "2000"))
+
+# Id fijo del system instruction: al enviarlo en cada turno reemplaza al anterior
+SYSTEM_MESSAGE_ID = "system_instruction"
+
+# ============================================
+# 2. CHECKPOINTER SQLITE
+# ============================================
+
+def _create_saver(connection):
+    """
+    SqliteSaver con métodos asíncronos que delegan en los síncronos desde un hilo.
+    Así el mismo checkpointer sirve para `app` y para `async_app`, aunque cada
+    ejecución en streaming use su propio event loop (ver `stream_agent`).
+    """
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    class ThreadedSqliteSaver(SqliteSaver):
+        async def aget_tuple(self, config):
+            return await asyncio.to_thread(self.get_tuple, config)
+
+        async def alist(self, config, *, filter=None, before=None, limit=None):
+            items = await asyncio.to_thread(
+                lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+            )
+            for item in items:
+                yield item
+
+        async def aput(self, config, checkpoint, metadata, new_versions):
+            return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+        async def aput_writes(self, config, writes, task_id, task_path=""):
+            return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+        async def adelete_thread(self, thread_id):
+            return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    return ThreadedSqliteSaver(connection)
+
+
+# Instancia global (lazy loading)
+_checkpointer = None
+_checkpointer_lock = threading.Lock()
+
+
+def get_checkpointer():
+    """
+    Obtiene el checkpointer global que persiste el estado del grafo por sesión
+    (`thread_id`), o None si la memoria está desactivada por configuración.
+    """
+    global _checkpointer
+    if not MEMORY_ENABLED:
+        return None
+    with _checkpointer_lock:
+        if _checkpointer is None:
+            Path(MEMORY_DB_PATH).parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(MEMORY_DB_PATH, check_same_thread=False, timeout=30)
+            _checkpointer = _create_saver(connection)
+    return _checkpointer
+
+
+def _thread_config(session_id: str) -> dict:
+    return {"configurable": {"thread_id": session_id}}
+
+
+def has_history(session_id: str) -> bool:
+    """True si la sesión ya tiene mensajes guardados (la pregunta es un seguimiento)."""
+    checkpointer = get_checkpointer()
+    if checkpointer is None:
+        return False
+    saved = checkpointer.get_tuple(_thread_config(session_id))
+    return bool(saved and saved.checkpoint.get("channel_values", {}).get("messages"))
+
+
+def forget_conversation(session_id: str):
+    """Borra la memoria de una sesión (botón "Limpiar conversación")."""
+    checkpointer = get_checkpointer()
+    if checkpointer is not None:
+        checkpointer.delete_thread(session_id)
+
+
+# ============================================
+# 3. TURNOS DE LA CONVERSACIÓN
+# ============================================
+
+def current_turn(messages) -> list:
+    """Mensajes del turno actual: desde la última pregunta del usuario hasta el final."""
+    for index in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[index], HumanMessage):
+            return list(messages[index:])
+    return list(messages)
+
+
+def split_turns(messages) -> list:
+    """Agrupa el historial (sin system messages) en turnos que empiezan con una pregunta."""
+    turns = []
+    for message in messages:
+        if isinstance(message, SystemMessage):
+            continue
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def message_tokens(message) -> int:
+    """Tokens aproximados de un mensaje (contenido + argumentos de sus tool calls)."""
+    tokens = estimate_tokens(str(message.content)) + 4
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        tokens += estimate_tokens(str(tool_call.get("args", ""))) + 4
+    return tokens
+
+
+def history_tokens(messages, summary: str = "") -> int:
+    return sum(message_tokens(message) for message in messages) + estimate_tokens(summary or "")
+
+
+# ============================================
+# 4. COMPACTACIÓN DEL HISTORIAL
+# ============================================
+
+def _shorten(content: str, max_chars: int) -> str:
+    if len(content) <= max_chars:
+        return content
+    omitted = len(content) - max_chars
+    return content[:max_chars] + f"\n[… resultado antiguo recortado: {omitted} caracteres omitidos]"
+
+
+def _summarize_turn(turn: list) -> str:
+    """Una línea por turno eliminado: la pregunta y el inicio de la respuesta final."""
+    question = " ".join(str(turn[0].content).split())
+    answers = [m for m in turn if isinstance(m, AIMessage) and not m.tool_calls and m.content]
+    answer = " ".join(str(answers[-1].content).split()) if answers else "(sin respuesta)"
+    if len(answer) > MEMORY_SUMMARY_ANSWER_CHARS:
+        answer = answer[:MEMORY_SUMMARY_ANSWER_CHARS] + "…"
+    return f"- Usuario: {question}\n  Respuesta: {answer}"
+
+
+def compact_history(state: dict) -> dict:
+    """
+    Nodo de compactación (se ejecuta al empezar cada turno). Si el historial pasa
+    de MEMORY_TOKEN_BUDGET tokens:
+
+    1. Recorta los resultados de consultas de los turnos antiguos (se conservan
+       completos los últimos MEMORY_KEEP_RECENT_TURNS turnos).
+    2. Si aún no alcanza, elimina los turnos más antiguos y los agrega a un resumen
+       breve (pregunta + inicio de la respuesta) que se envía con el system prompt.
+
+    Así el tamaño del prompt de cada turno se mantiene acotado en lugar de crecer
+    con la conversación.
+    """
+    messages = list(state["messages"])
+    summary = state.get("summary", "")
+    if history_tokens(messages, summary) <= MEMORY_TOKEN_BUDGET:
+        return {}
+
+    turns = split_turns(messages)
+    # El turno actual (la última pregunta) nunca se toca
+    old_turns = turns[: max(len(turns) - max(MEMORY_KEEP_RECENT_TURNS, 1), 0)]
+    replaced = {}
+    for turn in old_turns:
+        for message in turn:
+            if isinstance(message, ToolMessage):
+                content = _shorten(str(message.content), MEMORY_TOOL_OUTPUT_CHARS)
+                if content != message.content:
+                    replaced[message.id] = message.model_copy(update={"content": content})
+
+    compacted = [replaced.get(message.id, message) for message in messages]
+    removed, summary_lines = [], []
+    for turn in old_turns:
+        if history_tokens(compacted, summary + "\n".join(summary_lines)) <= MEMORY_TOKEN_BUDGET:
+            break
+        ids = {message.id for message in turn}
+        compacted = [message for message in compacted if message.id not in ids]
+        removed.extend(ids)
+        summary_lines.append(_summarize_turn(turn))
+
+    updates = [message for key, message in replaced.items() if key not in removed]
+    updates += [RemoveMessage(id=message_id) for message_id in removed]
+    result = {"messages": updates}
+    if summary_lines:
+        result["summary"] = _cap_summary("\n".join(filter(None, [summary] + summary_lines)))
+    return result
+
+
+def _cap_summary(summary: str) -> str:
+    """Deja el resumen dentro de MEMORY_SUMMARY_MAX_CHARS descartando las entradas más antiguas."""
+    entries = summary.split("\n- ")
+    while len(entries) > 1 and len("\n- ".join(entries)) > MEMORY_SUMMARY_MAX_CHARS:
+        entries.pop(0)
+        entries[0] = "- " + entries[0] if not entries[0].startswith("- ") else entries[0]
+    return "\n- ".join(entries)
+
+
+def summary_message(summary: str):
+    """System message con el resumen de los turnos compactados (None si no hay)."""
+    if not summary:
+        return None
+    return SystemMessage(content="## Resumen de la conversación anterior\n" + summary)
@@ -0,0 +1,225 @@
+# plan_cache.py - Caché de preguntas -> SQL + respuesta final del agente
+
+import difflib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+# ============================================
+# 1. CONFIGURACIÓN
+# ============================================
+
+# Todos los valores se pueden sobreescribir desde el archivo .env
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+PLAN_CACHE_TTL_SECONDS = float(os.getenv("PLAN_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "1000"))
+# Similitud mínima (0-1) para proponerle al modelo el SQL de una pregunta parecida; 0 la
+# desactiva. Solo se comparan preguntas con las mismas palabras de contenido, y el SQL
+# no se ejecuta directamente: el modelo confirma si responde la pregunta actual
+PLAN_CACHE_FUZZY_THRESHOLD = float(os.getenv("PLAN_CACHE_FUZZY_THRESHOLD", "0.9"))
+PLAN_CACHE_DIR = os.getenv("PLAN_CACHE_DIR", str(Path(__file__).parent / ".cache"))
+
+# ============================================
+# 2. NORMALIZACIÓN DE PREGUNTAS
+# ============================================
+
+def normalize_question(question: str) -> str:
+    """
+    Normaliza una pregunta: sin tildes, en minúsculas, sin signos de puntuación
+    y con los espacios colapsados. "¿Cuántos viajes hay?" -> "cuantos viajes hay".
+    """
+    text = unicodedata.normalize("NFKD", question)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(text.split())
+
+
+# Palabras sin contenido (ya normalizadas): cambiarlas no cambia la pregunta. "mas",
+# "menos", "mayor", "menor"... no están aquí a propósito: invierten el sentido
+_STOPWORDS = frozenset(
+    "a al con cual cuales de del dime el en es esta este la las lo los me muestra muestrame "
+    "o para por que se sobre son su sus un una y".split()
+)
+
+
+def _numbers(normalized: str) -> list:
+    return re.findall(r"\d+", normalized)
+
+
+def content_words(normalized: str) -> frozenset:
+    """Palabras de contenido de una pregunta normalizada (sin las de _STOPWORDS)."""
+    return frozenset(word for word in normalized.split() if word not in _STOPWORDS)
+
+
+def question_similarity(a: str, b: str) -> float:
+    """
+    Similitud léxica (0-1) entre dos preguntas ya normalizadas. Solo se comparan
+    preguntas con los mismos números (años, límites...) y las mismas palabras de
+    contenido: "estación más popular" y "estación menos popular", o "hombres" y
+    "mujeres", difieren en una palabra y no se consideran parecidas.
+    """
+    if _numbers(a) != _numbers(b) or content_words(a) != content_words(b):
+        return 0.0
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+
+# ============================================
+# 3. CACHÉ DE PLANES
+# ============================================
+
+@dataclass
+class PlanEntry:
+    """Una pregunta ya respondida: el SQL que funcionó y la respuesta final"""
+    question: str
+    sql_queries: list
+    answer: str
+    created_at: float = field(default_factory=time.time)
+
+
+@dataclass
+class PlanMatch:
+    """Resultado de buscar una pregunta en la caché"""
+    entry: PlanEntry
+    score: float
+
+    @property
+    def exact(self) -> bool:
+        return self.score >= 1.0
+
+
+class PlanCache:
+    """
+    Mapea preguntas normalizadas al SQL que el agente ejecutó con éxito y a su
+    respuesta final. Vive en memoria (LRU con máximo de entradas) y se persiste en
+    SQLite para sobrevivir a reinicios. Las entradas caducan con un TTL.
+    """
+
+    def __init__(
+        self,
+        directory: str = PLAN_CACHE_DIR,
+        ttl_seconds: float = PLAN_CACHE_TTL_SECONDS,
+        max_entries: int = PLAN_CACHE_MAX_ENTRIES,
+        fuzzy_threshold: float = PLAN_CACHE_FUZZY_THRESHOLD,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.fuzzy_threshold = fuzzy_threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self._db_path = str(Path(directory) / "plan_cache.sqlite")
+        with self._connect() as db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS plans (
+                    normalized TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            rows = db.execute(
+                "SELECT normalized, payload FROM plans ORDER BY last_access ASC"
+            ).fetchall()
+        for normalized, payload in rows:
+            entry = PlanEntry(**json.loads(payload))
+            if not self._expired(entry):
+                self._entries[normalized] = entry
+        self._trim()
+
+    def _connect(self):
+        return sqlite3.connect(self._db_path, timeout=30)
+
+    def _expired(self, entry: PlanEntry) -> bool:
+        return time.time() - entry.created_at > self.ttl_seconds
+
+    def lookup(self, question: str):
+        """
+        Busca una pregunta. Primero por coincidencia exacta de la forma normalizada
+        y, si está activado, por similitud léxica sobre el umbral configurado (ver
+        `question_similarity`). Solo una coincidencia exacta reutiliza la respuesta;
+        el SQL de una parecida se le propone al modelo, que decide si sirve.
+
+        Returns:
+            Un `PlanMatch` (score 1.0 si es exacta) o None.
+        """
+        normalized = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get(normalized)
+            if entry is not None and self._expired(entry):
+                del self._entries[normalized]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(normalized)
+                return PlanMatch(entry, 1.0)
+
+            if self.fuzzy_threshold <= 0:
+                return None
+            best_key, best_score = None, 0.0
+            for key, candidate in self._entries.items():
+                if self._expired(candidate):
+                    continue
+                score = question_similarity(normalized, key)
+                if score > best_score:
+                    best_key, best_score = key, score
+            if best_key is None or best_score < self.fuzzy_threshold:
+                return None
+            # Por debajo de 1.0 nunca se considera exacta, aunque el ratio redondee
+            return PlanMatch(self._entries[best_key], min(best_score, 0.999))
+
+    def store(self, question: str, sql_queries: list, answer: str):
+        """Guarda (o reemplaza) el plan de una pregunta respondida con éxito."""
+        normalized = normalize_question(question)
+        entry = PlanEntry(question=question, sql_queries=list(sql_queries), answer=answer)
+        with self._lock:
+            self._entries[normalized] = entry
+            self._entries.move_to_end(normalized)
+            evicted = self._trim()
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO plans VALUES (?, ?, ?)",
+                (normalized, json.dumps(entry.__dict__, ensure_ascii=False), time.time()),
+            )
+            db.executemany("DELETE FROM plans WHERE normalized = ?", [(k,) for k in evicted])
+
+    def invalidate(self, question: str = None):
+        """Elimina una pregunta de la caché, o todas si no se indica ninguna."""
+        with self._lock, self._connect() as db:
+            if question is None:
+                self._entries.clear()
+                db.execute("DELETE FROM plans")
+                return
+            normalized = normalize_question(question)
+            self._entries.pop(normalized, None)
+            db.execute("DELETE FROM plans WHERE normalized = ?", (normalized,))
+
+    def _trim(self) -> list:
+        evicted = []
+        while len(self._entries) > self.max_entries:
+            key, _ = self._entries.popitem(last=False)
+            evicted.append(key)
+        return evicted
+
+
+# Instancia global (lazy loading)
+_plan_cache = None
+_plan_cache_lock = threading.Lock()
+
+
+def get_plan_cache():
+    """Obtiene la caché global de planes, o None si está desactivada por configuración."""
+    global _plan_cache
+    if not PLAN_CACHE_ENABLED:
+        return None
+    with _plan_cache_lock:
+        if _plan_cache is None:
+            _plan_cache = PlanCache()
+    return _plan_cache
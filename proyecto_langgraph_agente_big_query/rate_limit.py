@@ -0,0 +1,546 @@
+# rate_limit.py - Límites de tasa, reintentos con backoff y concurrencia adaptativa (OpenAI / BigQuery)
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from concurrency import BIGQUERY_MAX_CONCURRENT_JOBS, LLM_MAX_CONCURRENT_CALLS, Overloaded
+from instrumentation import metrics
+
+# ============================================
+# 1. CONFIGURACIÓN
+# ============================================
+
+# Todos los valores se pueden sobreescribir desde el archivo .env
+# Límites del proveedor del modelo (0 = sin límite). Conviene dejarlos un poco por
+# debajo de los de la cuenta de OpenAI, así el límite se respeta aquí y no con 429
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "30000"))
+# Tokens de respuesta que se reservan por llamada antes de saber el uso real
+LLM_RESERVED_OUTPUT_TOKENS = int(os.getenv("LLM_RESERVED_OUTPUT_TOKENS", "500"))
+# Jobs de BigQuery por minuto (0 = sin límite)
+BIGQUERY_REQUESTS_PER_MINUTE = float(os.getenv("BIGQUERY_REQUESTS_PER_MINUTE", "600"))
+# Reintentos de errores transitorios del proveedor (1 = sin reintentos)
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("RETRY_BASE_DELAY_SECONDS", "0.5"))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv("RETRY_MAX_DELAY_SECONDS", "20"))
+# Tiempo total máximo reintentando una misma llamada antes de rendirse
+RETRY_MAX_TOTAL_SECONDS = float(os.getenv("RETRY_MAX_TOTAL_SECONDS", "60"))
+
+# Segundos de ráfaga que admite cada token bucket
+BUCKET_BURST_SECONDS = 10
+
+# ============================================
+# 2. TOKEN BUCKET
+# ============================================
+
+class TokenBucket:
+    """
+    Límite de tasa (`per_minute` unidades por minuto: requests o tokens) con
+    ráfagas de hasta BUCKET_BURST_SECONDS. `reserve` descuenta al momento y
+    devuelve cuánto esperar, así quienes llegan después hacen fila detrás.
+    """
+
+    def __init__(self, per_minute: float, clock=time.monotonic):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * BUCKET_BURST_SECONDS)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float = 1) -> float:
+        """Reserva `amount` unidades y devuelve los segundos a esperar antes de usarlas."""
+        with self._lock:
+            self._refill()
+            self._tokens -= min(amount, self.capacity)
+            return max(0.0, -self._tokens / self.rate)
+
+    def adjust(self, amount: float):
+        """Devuelve (positivo) o cobra (negativo) unidades, p. ej. al conocer los tokens reales."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def pause(self, seconds: float):
+        """Nadie obtiene unidades durante `seconds` (el proveedor pidió esperar con Retry-After)."""
+        with self._lock:
+            self._refill()
+            # Dentro de `seconds` se habrá repuesto justo una unidad
+            self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+# ============================================
+# 3. CONCURRENCIA ADAPTATIVA (AIMD)
+# ============================================
+
+class AdaptiveConcurrency:
+    """
+    Límite de llamadas simultáneas que se adapta a lo que aguanta el proveedor:
+    sube de a poco con cada éxito (+1/límite) y se reduce a la mitad cuando hay
+    throttling (como mucho una vez por segundo, para que una ráfaga de 429 no lo
+    hunda hasta 1). Nunca supera `max_limit` ni baja de 1.
+
+    Lo comparten hilos y tareas asyncio (de uno o varios event loops): los hilos
+    esperan en la condición y las tareas en un future que `release` despierta
+    desde cualquier hilo. El tiempo de espera se registra en agent_limiter_wait_seconds.
+    """
+
+    DECREASE_COOLDOWN_SECONDS = 1.0
+
+    def __init__(self, max_limit: int, clock=time.monotonic, name: str = ""):
+        self.name = name
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._clock = clock
+        self._last_decrease = float("-inf")
+        self._condition = threading.Condition()
+        # Tareas asyncio esperando un cupo: [(event loop, future)]
+        self._waiters = []
+
+    def _has_slot(self) -> bool:
+        return self.in_flight < max(1, int(self.limit))
+
+    def _record_wait(self, start: float):
+        metrics.observe(
+            "agent_limiter_wait_seconds",
+            time.perf_counter() - start,
+            help="Espera por un cupo de concurrencia",
+            limiter=self.name,
+        )
+
+    def acquire(self):
+        start = time.perf_counter()
+        with self._condition:
+            self._condition.wait_for(self._has_slot)
+            self.in_flight += 1
+        self._record_wait(start)
+
+    async def aacquire(self):
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self._has_slot():
+                    self.in_flight += 1
+                    break
+                waiter = (loop, loop.create_future())
+                self._waiters.append(waiter)
+            # Una tarea cancelada mientras espera no toma el cupo: solo se toma
+            # al volver a revisar, ya con la condición tomada
+            try:
+                await waiter[1]
+            finally:
+                with self._condition:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+        self._record_wait(start)
+
+    def release(self, throttled: bool = False, cancelled: bool = False):
+        with self._condition:
+            self.in_flight -= 1
+            now = self._clock()
+            if cancelled:
+                # La llamada no terminó: no dice nada sobre el proveedor
+                pass
+            elif throttled:
+                if now - self._last_decrease >= self.DECREASE_COOLDOWN_SECONDS:
+                    self.limit = max(1.0, self.limit / 2)
+                    self._last_decrease = now
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            self._condition.notify_all()
+            waiters, self._waiters = self._waiters, []
+        # Las tareas despertadas vuelven a competir por el cupo en `aacquire`
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # El event loop de esa tarea ya se cerró
+                pass
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+# ============================================
+# 4. CLASIFICACIÓN DE ERRORES
+# ============================================
+
+THROTTLED = "throttled"   # límite de tasa / cuota momentánea: reintentar y bajar la concurrencia
+TRANSIENT = "transient"   # falla pasajera del proveedor (5xx, conexión): reintentar
+FATAL = "fatal"           # error del pedido (SQL inválido, credenciales, cuota agotada): no reintentar
+
+
+@dataclass
+class ErrorClass:
+    kind: str
+    retry_after: float = None
+    detail: str = ""
+
+    @property
+    def retryable(self) -> bool:
+        return self.kind in (THROTTLED, TRANSIENT)
+
+
+_THROTTLED_NAMES = {"RateLimitError", "TooManyRequests", "ResourceExhausted"}
+_TRANSIENT_NAMES = {
+    "APIConnectionError", "APITimeoutError", "InternalServerError", "ServiceUnavailable",
+    "BadGateway", "GatewayTimeout", "ConnectionError", "RemoteDisconnected",
+}
+_TRANSIENT_STATUS = {408, 500, 502, 503, 504}
+# Motivos en `errors` de las excepciones de BigQuery
+_BIGQUERY_REASONS = {
+    "rateLimitExceeded": THROTTLED,
+    "quotaExceeded": THROTTLED,
+    "backendError": TRANSIENT,
+    "internalError": TRANSIENT,
+}
+_THROTTLED_MESSAGES = ("rate limit", "ratelimitexceeded", "too many requests", "exceeded rate limits")
+
+
+def _error_chain(exc: BaseException):
+    """La excepción y las que envuelve (SQLAlchemy `.orig`, `raise ... from`)."""
+    seen = set()
+    pending = [exc]
+    while pending:
+        current = pending.pop(0)
+        if current is None or id(current) in seen:
+            continue
+        seen.add(id(current))
+        yield current
+        pending.extend([getattr(current, "orig", None), current.__cause__])
+
+
+def _status_code(exc):
+    for value in (getattr(exc, "status_code", None), getattr(exc, "code", None),
+                  getattr(getattr(exc, "response", None), "status_code", None)):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return int(value)
+    return None
+
+
+def _retry_after(exc):
+    """Segundos de Retry-After que indicó el proveedor (None si no indicó)."""
+    value = getattr(exc, "retry_after", None)
+    if value is None:
+        headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+        value = headers.get("retry-after") if hasattr(headers, "get") else None
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(exc: BaseException) -> ErrorClass:
+    """
+    Decide si un error del proveedor se reintenta. Se reconoce por nombre de
+    clase, código HTTP y motivos de BigQuery (sin importar los SDKs), revisando
+    también las excepciones envueltas por SQLAlchemy o la DB-API.
+    """
+    for current in _error_chain(exc):
+        name = type(current).__name__
+        retry_after = _retry_after(current)
+        # La cuota de OpenAI agotada (facturación) no se arregla esperando
+        if getattr(current, "code", None) == "insufficient_quota":
+            return ErrorClass(FATAL, detail="insufficient_quota")
+        for error in getattr(current, "errors", None) or []:
+            reason = error.get("reason") if isinstance(error, dict) else None
+            if reason in _BIGQUERY_REASONS:
+                message = str(error.get("message", "")).lower()
+                if reason == "quotaExceeded" and ("per day" in message or "daily" in message):
+                    return ErrorClass(FATAL, detail=reason)
+                return ErrorClass(_BIGQUERY_REASONS[reason], retry_after, reason)
+        status = _status_code(current)
+        if name in _THROTTLED_NAMES or status == 429:
+            return ErrorClass(THROTTLED, retry_after, name)
+        if name in _TRANSIENT_NAMES or status in _TRANSIENT_STATUS or isinstance(current, ConnectionError):
+            return ErrorClass(TRANSIENT, retry_after, name)
+        if any(text in str(current).lower() for text in _THROTTLED_MESSAGES):
+            return ErrorClass(THROTTLED, retry_after, name)
+    return ErrorClass(FATAL, detail=type(exc).__name__)
+
+# ============================================
+# 5. SCHEDULER DE LLAMADAS AL PROVEEDOR
+# ============================================
+
+class ProviderUnavailable(Overloaded):
+    """
+    El proveedor siguió limitando o fallando después de todos los reintentos.
+    No es un error de la pregunta ni del SQL: conviene reintentar más tarde.
+    """
+
+    def __init__(self, provider: str, retry_after: int, error: ErrorClass):
+        super().__init__(retry_after, f"{provider} no disponible: {error.kind} ({error.detail})")
+        self.provider = provider
+        self.error = error
+
+
+class RetryScheduler:
+    """
+    Punto único por el que pasan las llamadas a un proveedor (OpenAI, BigQuery):
+
+    1. Espera turno en los token buckets de requests y de tokens por minuto.
+    2. Toma un cupo de la concurrencia adaptativa (que baja con el throttling):
+       es el único límite de llamadas simultáneas al proveedor.
+    3. Si la llamada falla con un error reintentable (ver `classify_error`),
+       reintenta con backoff exponencial con jitter ("full jitter"), respetando
+       el Retry-After del proveedor. Los errores fatales se propagan tal cual.
+    4. Si se agotan los reintentos, lanza `ProviderUnavailable`.
+
+    `sleep`, `asleep`, `clock` y `rng` se pueden reemplazar en pruebas.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        max_concurrency: int = 0,
+        max_attempts: int = RETRY_MAX_ATTEMPTS,
+        base_delay: float = RETRY_BASE_DELAY_SECONDS,
+        max_delay: float = RETRY_MAX_DELAY_SECONDS,
+        max_total: float = RETRY_MAX_TOTAL_SECONDS,
+        sleep=time.sleep,
+        asleep=asyncio.sleep,
+        clock=time.monotonic,
+        rng=random.random,
+    ):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute, clock) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute, clock) if tokens_per_minute > 0 else None
+        self.concurrency = (
+            AdaptiveConcurrency(max_concurrency, clock, name) if max_concurrency > 0 else None
+        )
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_total = max_total
+        self._sleep = sleep
+        self._asleep = asleep
+        self._clock = clock
+        self._rng = rng
+
+    def _reserve(self, tokens: float) -> float:
+        """Segundos a esperar por los token buckets antes del intento."""
+        wait = self.requests.reserve(1) if self.requests is not None else 0.0
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        if wait > 0:
+            metrics.observe(
+                "agent_ratelimit_wait_seconds", wait,
+                help="Espera por el límite de tasa del proveedor", provider=self.name,
+            )
+        return wait
+
+    def _settle(self, reserved: float, result, usage):
+        """Ajusta el bucket de tokens con el uso real de la respuesta."""
+        if self.tokens is None or usage is None or not reserved:
+            return
+        actual = usage(result)
+        if actual is not None:
+            self.tokens.adjust(reserved - actual)
+
+    def _release(self, error: ErrorClass = None, cancelled: bool = False):
+        if self.concurrency is not None:
+            self.concurrency.release(
+                throttled=error is not None and error.kind == THROTTLED, cancelled=cancelled
+            )
+
+    def _next_delay(self, exc: Exception, error: ErrorClass, attempt: int, started: float) -> float:
+        """
+        Espera antes del siguiente intento. Lanza la excepción original si no se
+        reintenta, o `ProviderUnavailable` si se agotaron los reintentos.
+        """
+        if not error.retryable:
+            raise exc
+        delay = self._rng() * min(self.max_delay, self.base_delay * 2 ** attempt)
+        if error.retry_after is not None:
+            delay = max(delay, error.retry_after)
+            # El Retry-After vale para todas las llamadas, no solo para esta
+            if self.requests is not None:
+                self.requests.pause(error.retry_after)
+        if attempt + 1 >= self.max_attempts or self._clock() - started + delay > self.max_total:
+            metrics.inc(
+                "agent_provider_unavailable_total",
+                help="Llamadas abandonadas tras agotar los reintentos",
+                provider=self.name, kind=error.kind,
+            )
+            raise ProviderUnavailable(self.name, max(1, round(delay)), error) from exc
+        metrics.inc(
+            "agent_provider_retries_total",
+            help="Reintentos por errores transitorios o throttling del proveedor",
+            provider=self.name, kind=error.kind,
+        )
+        return delay
+
+    def call(self, fn, tokens: float = 0, usage=None):
+        """
+        Ejecuta `fn()` con límites de tasa y reintentos (versión para hilos).
+
+        Args:
+            fn: La llamada al proveedor, sin argumentos.
+            tokens: Tokens estimados de la llamada (para el bucket de tokens por minuto).
+            usage: Función opcional resultado -> tokens reales, para corregir la estimación.
+        """
+        started = self._clock()
+        attempt = 0
+        while True:
+            wait = self._reserve(tokens)
+            if wait > 0:
+                self._sleep(wait)
+            if self.concurrency is not None:
+                self.concurrency.acquire()
+            try:
+                result = fn()
+            except Exception as e:
+                error = classify_error(e)
+                self._release(error)
+                self._sleep(self._next_delay(e, error, attempt, started))
+                attempt += 1
+                continue
+            except BaseException:
+                self._release(cancelled=True)
+                raise
+            self._release()
+            self._settle(tokens, result, usage)
+            return result
+
+    async def acall(self, afn, tokens: float = 0, usage=None):
+        """Igual que `call`, para corrutinas: `afn()` debe devolver un awaitable."""
+        started = self._clock()
+        attempt = 0
+        while True:
+            wait = self._reserve(tokens)
+            if wait > 0:
+                await self._asleep(wait)
+            if self.concurrency is not None:
+                await self.concurrency.aacquire()
+            try:
+                result = await afn()
+            except Exception as e:
+                error = classify_error(e)
+                self._release(error)
+                await self._asleep(self._next_delay(e, error, attempt, started))
+                attempt += 1
+                continue
+            except BaseException:
+                # Tarea cancelada (timeout, cliente desconectado): el cupo se devuelve
+                self._release(cancelled=True)
+                raise
+            self._release()
+            self._settle(tokens, result, usage)
+            return result
+
+    def stats(self) -> dict:
+        """Estado actual (límite de concurrencia adaptativo y llamadas en curso)."""
+        if self.concurrency is None:
+            return {"provider": self.name}
+        return {
+            "provider": self.name,
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "in_flight": self.concurrency.in_flight,
+        }
+
+
+llm_scheduler = RetryScheduler(
+    "llm", LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_MAX_CONCURRENT_CALLS
+)
+bigquery_scheduler = RetryScheduler(
+    "bigquery", BIGQUERY_REQUESTS_PER_MINUTE, 0, BIGQUERY_MAX_CONCURRENT_JOBS
+)
+
+# ============================================
+# 6. ENDPOINT FALSO DE OPENAI (PRUEBAS LOCALES)
+# ============================================
+
+def serve_fake_openai(
+    port: int = 8099, requests_per_minute: float = 60, error_rate: float = 0.0, latency_s: float = 0.2
+) -> ThreadingHTTPServer:
+    """
+    Levanta en un hilo un servidor compatible con /v1/chat/completions de OpenAI
+    que limita a `requests_per_minute` (429 con Retry-After, como OpenAI) y falla
+    con 503 en una fracción `error_rate` de las llamadas. Sirve para probar el
+    scheduler con el ChatOpenAI real: OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+    """
+    bucket = TokenBucket(requests_per_minute)
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, body: dict, headers: dict = None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            wait = bucket.reserve(1)
+            if wait > 0:
+                # El intento rechazado no consume cupo
+                bucket.adjust(1)
+                self._reply(
+                    429,
+                    {"error": {"message": "Rate limit reached for requests", "type": "requests",
+                               "code": "rate_limit_exceeded"}},
+                    {"Retry-After": f"{wait:.2f}"},
+                )
+                return
+            if random.random() < error_rate:
+                self._reply(503, {"error": {"message": "The server is overloaded", "type": "server_error"}})
+                return
+            time.sleep(latency_s)
+            prompt_tokens = sum(len(str(m.get("content", ""))) // 4 for m in request.get("messages", []))
+            self._reply(200, {
+                "id": f"chatcmpl-fake-{time.time_ns()}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "Respuesta de prueba."},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 4,
+                          "total_tokens": prompt_tokens + 4},
+            })
+
+        def log_message(self, *args):
+            # Sin logs por request en la consola
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Endpoint falso de OpenAI con límites de tasa.")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--rpm", type=float, default=60, help="Requests por minuto antes de responder 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de respuestas 503")
+    parser.add_argument("--latency-ms", type=float, default=200)
+    args = parser.parse_args()
+    serve_fake_openai(args.port, args.rpm, args.error_rate, args.latency_ms / 1000)
+    print(f"Endpoint falso en http://127.0.0.1:{args.port}/v1 (Ctrl+C para salir)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,236 @@
+# server.py - Servicio HTTP/SSE (ASGI) del agente con control de admisión
+#
+# Ejecutar con:
+#   uvicorn server:api --host 0.0.0.0 --port 8000
+#
+# Endpoints:
+#   POST   /ask                  {"question", "session_id"} -> {"answer"}
+#   POST   /ask/stream           mismo cuerpo -> eventos SSE de `astream_agent`
+#   DELETE /sessions/{id}        olvida la conversación de una sesión
+#   PUT    /sessions/{id}/approximate  {"enabled"} activa o desactiva el modo aproximado
+#   GET    /sessions/{id}/jobs   trabajos de consulta en segundo plano de la sesión
+#   GET    /jobs/{job_id}        estado y resultado de un trabajo
+#   DELETE /plan-cache           vacía la caché de planes
+#   GET    /health, GET /metrics
+
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+# Cargar variables de entorno antes de importar el agente (lee la configuración al importar)
+load_dotenv()
+
+from agent_langgraph import astream_agent
+from concurrency import AdmissionController, Overloaded
+from instrumentation import metrics
+from memory import forget_conversation
+from plan_cache import get_plan_cache
+from tools.approximate import approximate_mode, set_approximate_mode
+from tools.catalog import start_catalog_refresh
+from tools.query_jobs import get_job_store
+from tools.run_sql_query import start_rollup_refresh, start_warmup
+
+# Cola acotada compartida por /ask y /ask/stream
+admission = AdmissionController()
+
+# ============================================
+# 1. UTILIDADES
+# ============================================
+
+def _overloaded_response(error: Overloaded) -> JSONResponse:
+    return JSONResponse(
+        {"error": str(error), "reason": error.reason, "retry_after": error.retry_after},
+        status_code=429,
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
+async def _read_object(request):
+    """Lee el cuerpo JSON. Devuelve (diccionario, None) o (None, respuesta 400)."""
+    try:
+        body = await request.json()
+    except ValueError:
+        return None, JSONResponse({"error": "El cuerpo debe ser JSON."}, status_code=400)
+    if not isinstance(body, dict):
+        return None, JSONResponse({"error": "El cuerpo debe ser un objeto JSON."}, status_code=400)
+    return body, None
+
+
+async def _read_question(request):
+    """Lee y valida el cuerpo JSON. Devuelve (pregunta, sesión) o una respuesta 400."""
+    body, error = await _read_object(request)
+    if error is not None:
+        return None, error
+    question = str(body.get("question", "")).strip()
+    if not question:
+        return None, JSONResponse({"error": "Falta el campo 'question'."}, status_code=400)
+    return (question, str(body.get("session_id") or "default")), None
+
+
+class _AdmittedStream(StreamingResponse):
+    """
+    Respuesta SSE que libera el cupo de admisión al terminar de enviarse, pase
+    lo que pase: fin normal, error o cliente desconectado (incluso antes de que
+    se empiece a leer el generador, cuando su `finally` nunca llegaría a correr).
+    """
+
+    def __init__(self, content, started_at: float, **kwargs):
+        super().__init__(content, **kwargs)
+        self._started_at = started_at
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            admission.release(self._started_at)
+
+
+def _sse(event: dict) -> str:
+    """Un evento en formato Server-Sent Events (el tipo va en la línea `event:`)."""
+    data = json.dumps(event, ensure_ascii=False, default=str)
+    return f"event: {event['type']}\ndata: {data}\n\n"
+
+# ============================================
+# 2. ENDPOINTS
+# ============================================
+
+async def ask(request):
+    """Ejecuta una pregunta completa y devuelve la respuesta final en JSON."""
+    parsed, error = await _read_question(request)
+    if error is not None:
+        return error
+    question, session_id = parsed
+    try:
+        started_at = await admission.acquire()
+    except Overloaded as e:
+        return _overloaded_response(e)
+    try:
+        answer = ""
+        async for event in astream_agent(question, session_id):
+            if event["type"] == "final":
+                answer = event["content"]
+        return JSONResponse({"answer": answer, "session_id": session_id})
+    except Overloaded as e:
+        # OpenAI o BigQuery siguieron saturados después de los reintentos
+        return _overloaded_response(e)
+    finally:
+        admission.release(started_at)
+
+
+async def ask_stream(request):
+    """
+    Ejecuta una pregunta y entrega el progreso como eventos SSE (plan_hit, sql,
+    query_running, rows, token, final; o error). La admisión se decide antes de
+    empezar la respuesta, así un servicio saturado contesta 429 con Retry-After.
+    """
+    parsed, error = await _read_question(request)
+    if error is not None:
+        return error
+    question, session_id = parsed
+    try:
+        started_at = await admission.acquire()
+    except Overloaded as e:
+        return _overloaded_response(e)
+
+    async def events():
+        try:
+            async for event in astream_agent(question, session_id):
+                yield _sse(event)
+        except Overloaded as e:
+            yield _sse({"type": "error", "message": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            yield _sse({"type": "error", "message": str(e)})
+
+    return _AdmittedStream(
+        events(),
+        started_at,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Los endpoints siguientes usan SQLite (memoria, trabajos, caché de planes): las
+# llamadas bloqueantes se ejecutan en un hilo para no detener el event loop
+
+async def delete_session(request):
+    await asyncio.to_thread(forget_conversation, request.path_params["session_id"])
+    return JSONResponse({"ok": True})
+
+
+async def put_approximate_mode(request):
+    session_id = request.path_params["session_id"]
+    body, error = await _read_object(request)
+    if error is not None:
+        return error
+    set_approximate_mode(session_id, bool(body.get("enabled")))
+    return JSONResponse({"session_id": session_id, "approximate": approximate_mode(session_id)})
+
+
+async def list_session_jobs(request):
+    store = get_job_store()
+    jobs = []
+    if store is not None:
+        jobs = await asyncio.to_thread(store.list, request.path_params["session_id"])
+    return JSONResponse({"jobs": [job.to_dict() for job in jobs]})
+
+
+async def get_job(request):
+    store = get_job_store()
+    job = None
+    if store is not None:
+        job = await asyncio.to_thread(store.get, request.path_params["job_id"])
+    if job is None:
+        return JSONResponse({"error": "El trabajo no existe o ya expiró."}, status_code=404)
+    return JSONResponse(job.to_dict())
+
+
+async def delete_plan_cache(request):
+    plan_cache = get_plan_cache()
+    if plan_cache is not None:
+        await asyncio.to_thread(plan_cache.invalidate)
+    return JSONResponse({"ok": True})
+
+
+async def health(request):
+    return JSONResponse(
+        {"status": "ok", "running": admission.running, "waiting": admission.waiting}
+    )
+
+
+async def prometheus_metrics(request):
+    return PlainTextResponse(
+        metrics.render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+# ============================================
+# 3. APLICACIÓN ASGI
+# ============================================
+
+@asynccontextmanager
+async def lifespan(app):
+    # Crear el cliente de BigQuery y abrir conexiones del pool antes de la primera pregunta
+    start_warmup()
+    start_rollup_refresh()
+    start_catalog_refresh()
+    yield
+
+
+api = Starlette(
+    routes=[
+        Route("/ask", ask, methods=["POST"]),
+        Route("/ask/stream", ask_stream, methods=["POST"]),
+        Route("/sessions/{session_id}", delete_session, methods=["DELETE"]),
+        Route("/sessions/{session_id}/approximate", put_approximate_mode, methods=["PUT"]),
+        Route("/sessions/{session_id}/jobs", list_session_jobs),
+        Route("/jobs/{job_id}", get_job),
+        Route("/plan-cache", delete_plan_cache, methods=["DELETE"]),
+        Route("/health", health),
+        Route("/metrics", prometheus_metrics),
+    ],
+    lifespan=lifespan,
+)
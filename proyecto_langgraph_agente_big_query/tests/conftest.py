@@ -0,0 +1,10 @@
+# tests/conftest.py
+#
+# Pruebas de las piezas puras del agente (sin OpenAI ni BigQuery):
+#   python -m pytest tests
+
+import sys
+from pathlib import Path
+
+# Los módulos del proyecto se importan como en la aplicación (tools.*, plan_cache...)
+sys.path.insert(0, str(Path(__file__).parent.parent))
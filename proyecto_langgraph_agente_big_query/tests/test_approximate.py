@@ -0,0 +1,49 @@
+# tests/test_approximate.py
+
+from tools.approximate import ERROR_COLUMN_SUFFIX, rewrite_approximate
+
+TABLE = "`bigquery-public-data.new_york_citibike.citibike_trips`"
+
+
+def test_samples_and_scales_simple_aggregations():
+    rewrite = rewrite_approximate(
+        f"SELECT COUNT(*) AS viajes, AVG(tripduration) AS media FROM {TABLE}",
+        sample_percent=10,
+        z=1.96,
+        design_effect=4,
+    )
+    assert rewrite.sample_percent == 10
+    assert "TABLESAMPLE SYSTEM (10 PERCENT)" in rewrite.sql
+    assert "CAST(ROUND(COUNT(*) * 10) AS INT64) AS viajes" in rewrite.sql
+    assert rewrite.error_columns == ["viajes" + ERROR_COLUMN_SUFFIX, "media" + ERROR_COLUMN_SUFFIX]
+    # z * sqrt(efecto de diseño) = 1.96 * 2
+    assert "3.92" in rewrite.sql
+
+
+def test_without_block_sampling_the_error_uses_plain_z():
+    rewrite = rewrite_approximate(
+        f"SELECT COUNT(*) AS viajes FROM {TABLE}", sample_percent=10, z=1.96, design_effect=1
+    )
+    assert "1.96" in rewrite.sql
+    assert "3.92" not in rewrite.sql
+
+
+def test_count_distinct_uses_hyperloglog_without_sampling():
+    rewrite = rewrite_approximate(f"SELECT COUNT(DISTINCT bikeid) AS bicis FROM {TABLE}")
+    assert rewrite.approx_distinct
+    assert rewrite.sample_percent is None
+    assert "APPROX_COUNT_DISTINCT(bikeid)" in rewrite.sql
+    assert rewrite.reason
+
+
+def test_queries_without_a_known_error_bound_are_not_sampled():
+    for query in (
+        f"SELECT MAX(tripduration) FROM {TABLE}",
+        f"SELECT usertype FROM {TABLE}",
+        f"SELECT COUNT(*) FROM {TABLE} AS a JOIN {TABLE} AS b ON a.bikeid = b.bikeid",
+        "no es SQL",
+    ):
+        rewrite = rewrite_approximate(query)
+        assert not rewrite.changed, query
+        assert rewrite.sql == query
+        assert rewrite.reason
@@ -0,0 +1,47 @@
+# tests/test_cost_guard.py
+
+from tools.cost_guard import CostGuard, StaticBytesEstimator
+
+BIG = "SELECT * FROM viajes"
+SMALL = "SELECT COUNT(*) FROM viajes"
+
+
+def make_guard(per_query=100, per_session=150):
+    estimator = StaticBytesEstimator({BIG: 120, SMALL: 60})
+    return CostGuard(estimator, max_bytes_per_query=per_query, max_bytes_per_session=per_session)
+
+
+def test_rejects_a_query_over_the_per_query_limit():
+    decision = make_guard().check(BIG, "s1")
+    assert not decision.allowed
+    assert decision.estimated_bytes == 120
+    assert "por consulta" in decision.reason
+
+
+def test_estimator_compares_canonical_sql():
+    assert make_guard().check("select   count(*)  from viajes", "s1").estimated_bytes == 60
+
+
+def test_reservations_count_against_the_session_budget():
+    guard = make_guard()
+    assert guard.check(SMALL, "s1").allowed
+    assert guard.check(SMALL, "s1").allowed
+    # Las dos reservas en curso ya ocupan 120 de 150 bytes
+    decision = guard.check(SMALL, "s1")
+    assert not decision.allowed
+    assert decision.session_bytes_used == 120
+    # Otra sesión tiene su propio presupuesto
+    assert guard.check(SMALL, "s2").allowed
+
+
+def test_record_and_release_settle_the_reservation():
+    guard = make_guard()
+    guard.check(SMALL, "s1")
+    guard.record("s1", 60)
+    assert guard.session_usage("s1") == 60
+
+    guard.check(SMALL, "s1")
+    guard.release("s1", 60)
+    assert guard.session_usage("s1") == 60
+    # Lo devuelto con release vuelve a estar disponible
+    assert guard.check(SMALL, "s1").allowed
@@ -0,0 +1,47 @@
+# tests/test_plan_cache.py
+
+from plan_cache import PlanCache, normalize_question
+
+SQL = "SELECT COUNT(*) AS n FROM `bigquery-public-data.new_york_citibike.citibike_trips`"
+
+
+def make_cache(tmp_path, **kwargs):
+    cache = PlanCache(directory=str(tmp_path), **kwargs)
+    cache.store("¿Cuántos viajes hay en total?", [SQL], "Hay 10 viajes.")
+    cache.store("¿Cuál es la estación más popular?", ["SELECT 1"], "La estación A.")
+    cache.store("¿Cuántos viajes hicieron los hombres?", ["SELECT 2"], "5 viajes.")
+    return cache
+
+
+def test_normalize_question_ignores_case_accents_and_punctuation():
+    assert normalize_question("¿Cuántos VIAJES hay?") == normalize_question("cuantos viajes hay")
+
+
+def test_exact_match(tmp_path):
+    match = make_cache(tmp_path).lookup("cuantos viajes hay en total")
+    assert match.exact
+    assert match.entry.sql_queries == [SQL]
+
+
+def test_fuzzy_match_only_differs_in_function_words(tmp_path):
+    match = make_cache(tmp_path).lookup("¿Cuántos viajes hay en el total?")
+    assert match is not None
+    assert not match.exact
+    assert match.entry.answer == "Hay 10 viajes."
+
+
+def test_fuzzy_match_rejects_questions_with_other_content_words(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.lookup("¿Cuál es la estación menos popular?") is None
+    assert cache.lookup("¿Cuántos viajes hicieron las mujeres?") is None
+    assert cache.lookup("¿Cuántos viajes hay en 2016?") is None
+
+
+def test_fuzzy_matching_can_be_disabled(tmp_path):
+    cache = make_cache(tmp_path, fuzzy_threshold=0)
+    assert cache.lookup("¿Cuántos viajes hay en el total?") is None
+
+
+def test_plans_survive_a_restart(tmp_path):
+    make_cache(tmp_path)
+    assert PlanCache(directory=str(tmp_path)).lookup("¿Cuántos viajes hay en total?").exact
@@ -0,0 +1,55 @@
+# tests/test_result_stream.py
+
+import pyarrow as pa
+
+from tools.result_format import serialize_result
+from tools.result_stream import stream_batches
+
+
+def make_reader(num_rows: int, batch_size: int = 10):
+    schema = pa.schema([("id", pa.int64()), ("nombre", pa.string())])
+    batches = [
+        pa.RecordBatch.from_arrays(
+            [pa.array(range(start, min(start + batch_size, num_rows))),
+             pa.array([f"fila {i}" for i in range(start, min(start + batch_size, num_rows))])],
+            schema=schema,
+        )
+        for start in range(0, num_rows, batch_size)
+    ]
+    return pa.RecordBatchReader.from_batches(schema, batches)
+
+
+def test_small_result_is_kept_whole():
+    result = stream_batches(make_reader(5), max_rows=100)
+    assert result.total_rows == 5
+    assert not result.truncated
+    assert result.rows == [(i, f"fila {i}") for i in range(5)]
+    assert result.types == ["INT64", "STRING"]
+
+
+def test_large_result_keeps_head_tail_and_full_stats():
+    batches = []
+    result = stream_batches(make_reader(95), max_rows=20, tail_rows=5, on_batch=batches.append)
+    assert result.total_rows == 95
+    assert result.truncated
+    assert len(result.rows) == 20
+    assert [row[0] for row in result.tail_rows] == [90, 91, 92, 93, 94]
+    assert result.stats[0] == {"no_nulos": 95, "nulos": 0, "min": 0.0, "max": 94.0, "media": 47.0}
+    assert sum(batch.num_rows for batch in batches) == 95
+
+
+def test_serialize_result_fits_the_token_budget():
+    payload = stream_batches(make_reader(95), max_rows=20, tail_rows=5).to_payload()
+    text = serialize_result(payload, token_budget=120)
+    lines = text.splitlines()
+    assert lines[0].startswith("filas: 95 (se muestran")
+    assert lines[1] == "id:INT64,nombre:STRING"
+    assert any("filas omitidas" in line for line in lines)
+    assert "resumen (todas las filas):" in lines
+
+
+def test_serialize_small_and_empty_results():
+    payload = stream_batches(make_reader(2)).to_payload()
+    assert serialize_result(payload) == "filas: 2\nid:INT64,nombre:STRING\n0,fila 0\n1,fila 1"
+    empty = {"columns": ["id"], "rows": [], "total_rows": 0}
+    assert "no devolvió resultados" in serialize_result(empty)
@@ -0,0 +1,47 @@
+# tests/test_rollups.py
+
+from tools.rollups import ROLLUP_SPECS, route_query
+
+TABLE = "`bigquery-public-data.new_york_citibike.citibike_trips`"
+ROWS = {"rutas": 1000, "usuarios": 50, "tiempo": 5000}
+
+
+def test_routes_a_count_by_dimension_to_the_smallest_rollup():
+    routed = route_query(
+        f"SELECT usertype, COUNT(*) AS viajes FROM {TABLE} GROUP BY usertype", ROLLUP_SPECS, ROWS
+    )
+    assert routed is not None
+    assert routed.rollup == "usuarios"
+    assert routed.table_name in routed.sql
+    assert "CAST(COALESCE(SUM(viajes), 0) AS INT64)" in routed.sql
+
+
+def test_maps_time_expressions_to_rollup_dimensions():
+    routed = route_query(
+        f"SELECT EXTRACT(HOUR FROM starttime) AS h, AVG(tripduration) AS d FROM {TABLE} GROUP BY h",
+        ROLLUP_SPECS,
+        ROWS,
+    )
+    assert routed is not None
+    assert routed.rollup == "tiempo"
+    assert "hora" in routed.sql
+    assert "SAFE_DIVIDE(SUM(sum_tripduration), SUM(n_tripduration))" in routed.sql
+
+
+def test_does_not_route_queries_it_cannot_answer_exactly():
+    not_routable = [
+        # Columna que no es una dimensión de ningún rollup
+        f"SELECT bikeid, COUNT(*) FROM {TABLE} GROUP BY bikeid",
+        # Filas sin agregar
+        f"SELECT usertype FROM {TABLE}",
+        # Agregado que no se puede recalcular desde las medidas
+        f"SELECT AVG(birth_year) FROM {TABLE}",
+        # Subconsulta
+        f"SELECT COUNT(*) FROM (SELECT usertype FROM {TABLE})",
+        # Otra tabla
+        "SELECT usertype, COUNT(*) FROM `otro.dataset.tabla` GROUP BY usertype",
+        # SQL inválido
+        "SELECT FROM WHERE",
+    ]
+    for query in not_routable:
+        assert route_query(query, ROLLUP_SPECS, ROWS) is None, query
@@ -0,0 +1,70 @@
+# tests/test_single_flight.py
+
+import threading
+
+import pytest
+
+from tools.single_flight import SingleFlight
+
+
+class CountingFlight(SingleFlight):
+    """SingleFlight que avisa cuántas llamadas se unieron a una ejecución en curso."""
+
+    def __init__(self, expected_shared: int):
+        super().__init__("test")
+        self.expected_shared = expected_shared
+        self.shared = 0
+        self.all_joined = threading.Event()
+
+    def _record_shared(self):
+        super()._record_shared()
+        self.shared += 1
+        if self.shared == self.expected_shared:
+            self.all_joined.set()
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = CountingFlight(expected_shared=4)
+    started = threading.Event()
+    calls, results = [], []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        # La líder termina recién cuando las demás llamadas esperan su resultado
+        flight.all_joined.wait(timeout=5)
+        return "resultado"
+
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", slow)))
+    leader.start()
+    started.wait(timeout=5)
+    followers = [
+        threading.Thread(target=lambda: results.append(flight.do("k", slow))) for _ in range(4)
+    ]
+    for thread in followers:
+        thread.start()
+    for thread in [leader] + followers:
+        thread.join(timeout=5)
+
+    assert calls == [1]
+    assert sorted(results, key=lambda r: r[1]) == [("resultado", False)] + [("resultado", True)] * 4
+    assert flight.in_flight() == 0
+
+
+def test_errors_propagate_and_release_the_key():
+    flight = SingleFlight("test")
+
+    def fail():
+        raise ValueError("falló")
+
+    with pytest.raises(ValueError):
+        flight.do("k", fail)
+    assert flight.in_flight() == 0
+    # La clave se libera: no es una caché
+    assert flight.do("k", lambda: 1) == (1, False)
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight("test")
+    assert flight.do("a", lambda: 1) == (1, False)
+    assert flight.do("b", lambda: 2) == (2, False)
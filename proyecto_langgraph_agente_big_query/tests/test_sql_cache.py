@@ -0,0 +1,52 @@
+# tests/test_sql_cache.py
+
+from tools.sql_cache import SQLResultCache, canonicalize_sql
+
+TABLE = "`bigquery-public-data.new_york_citibike.citibike_trips`"
+
+
+def test_canonicalize_ignores_whitespace_case_and_comments():
+    a, _ = canonicalize_sql(f"SELECT COUNT(*) FROM {TABLE}")
+    b, _ = canonicalize_sql(f"select  count( * )\n-- total de viajes\nfrom {TABLE}")
+    assert a == b
+
+
+def test_canonicalize_renames_aliases_positionally():
+    a, aliases_a = canonicalize_sql(f"SELECT COUNT(*) AS total FROM {TABLE}")
+    b, aliases_b = canonicalize_sql(f"SELECT COUNT(*) viajes FROM {TABLE}")
+    assert a == b
+    assert aliases_a == {"_alias1": "total"}
+    assert aliases_b == {"_alias1": "viajes"}
+
+
+def test_canonicalize_keeps_literals():
+    a, _ = canonicalize_sql(f"SELECT COUNT(*) FROM {TABLE} WHERE usertype = 'Customer'")
+    b, _ = canonicalize_sql(f"SELECT COUNT(*) FROM {TABLE} WHERE usertype = 'customer'")
+    assert a != b
+
+
+def test_cache_round_trip_uses_the_aliases_of_each_query(tmp_path):
+    cache = SQLResultCache(directory=str(tmp_path))
+    cache.put(f"SELECT COUNT(*) AS total FROM {TABLE}", {"columns": ["total"], "rows": [(10,)]})
+
+    payload, level = cache.get(f"select count(*) as viajes from {TABLE}")
+    assert level == "memoria"
+    assert payload["columns"] == ["viajes"]
+    assert payload["rows"] == [(10,)]
+
+    # Una instancia nueva sobre el mismo directorio lee el nivel de disco
+    payload, level = SQLResultCache(directory=str(tmp_path)).get(f"SELECT COUNT(*) AS n FROM {TABLE}")
+    assert level == "disco"
+    assert payload["columns"] == ["n"]
+
+
+def test_cache_respects_ttl_and_invalidate(tmp_path):
+    query = f"SELECT COUNT(*) AS total FROM {TABLE}"
+    expired = SQLResultCache(directory=str(tmp_path / "ttl"), ttl_seconds=-1)
+    expired.put(query, {"columns": ["total"], "rows": [(1,)]})
+    assert expired.get(query) is None
+
+    cache = SQLResultCache(directory=str(tmp_path / "inv"))
+    cache.put(query, {"columns": ["total"], "rows": [(1,)]})
+    cache.invalidate(query)
+    assert cache.get(query) is None
@@ -0,0 +1,50 @@
+# tests/test_sql_validation.py
+
+from tools.sql_validation import format_validation_errors, parse_table_schema, validate_sql
+
+SCHEMA = parse_table_schema(
+    """
+    CREATE TABLE `bigquery-public-data.new_york_citibike.citibike_trips` (
+        tripduration INT64,
+        starttime DATETIME,
+        usertype STRING
+    )
+    """
+)
+TABLE = "`bigquery-public-data.new_york_citibike.citibike_trips`"
+
+
+def test_parse_table_schema():
+    assert SCHEMA == {
+        "bigquery-public-data.new_york_citibike.citibike_trips": {
+            "tripduration": "INT64",
+            "starttime": "DATETIME",
+            "usertype": "STRING",
+        }
+    }
+
+
+def test_valid_query_has_no_errors():
+    query = (
+        f"WITH t AS (SELECT usertype, COUNT(*) AS n FROM {TABLE} GROUP BY usertype) "
+        "SELECT usertype, n FROM t ORDER BY n DESC"
+    )
+    assert validate_sql(query, SCHEMA) == []
+
+
+def test_unknown_column_suggests_the_closest_name():
+    errors = validate_sql(f"SELECT user_type FROM {TABLE}", SCHEMA)
+    assert len(errors) == 1
+    assert "`usertype`" in errors[0]
+
+
+def test_rejects_writes_multiple_statements_and_syntax_errors():
+    assert validate_sql(f"DELETE FROM {TABLE} WHERE TRUE", SCHEMA)
+    assert validate_sql("SELECT 1; SELECT 2", SCHEMA) == ["Envía una sola sentencia SQL por llamada."]
+    assert validate_sql("SELECT (1", SCHEMA)[0].startswith("Error de sintaxis")
+
+
+def test_unknown_table():
+    errors = validate_sql("SELECT usertype FROM `otro.dataset.tabla`", SCHEMA)
+    assert errors
+    assert format_validation_errors(errors)
@@ -0,0 +1,289 @@
+# tools/approximate.py
+
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from tools.backends import BIGQUERY_TABLE
+
+if TYPE_CHECKING:
+    # Solo para las anotaciones: sqlglot se carga recién al reescribir la primera consulta
+    from sqlglot import exp
+
+# ============================================
+# 1. CONFIGURACIÓN DEL MODO APROXIMADO
+# ============================================
+
+# Todos los valores se pueden sobreescribir desde el archivo .env
+# Modo con el que empieza cada sesión (el usuario lo puede cambiar desde la interfaz)
+APPROX_MODE_DEFAULT = os.getenv("APPROX_MODE_DEFAULT", "false").lower() in ("1", "true", "yes")
+# Porcentaje de la tabla que se lee con TABLESAMPLE
+APPROX_SAMPLE_PERCENT = float(os.getenv("APPROX_SAMPLE_PERCENT", "10"))
+# Valor z de la cota de error (1.96 = intervalo de confianza del 95%)
+APPROX_CONFIDENCE_Z = float(os.getenv("APPROX_CONFIDENCE_Z", "1.96"))
+# Efecto de diseño del muestreo por bloques: TABLESAMPLE SYSTEM lee bloques enteros de
+# almacenamiento y la tabla de viajes está ordenada por tiempo, así que las filas de un
+# bloque se parecen entre sí y la varianza real es mayor que la de un muestreo fila por
+# fila. Las fórmulas de error se multiplican por sqrt(APPROX_DESIGN_EFFECT)
+APPROX_DESIGN_EFFECT = float(os.getenv("APPROX_DESIGN_EFFECT", "4"))
+
+# Error relativo típico de APPROX_COUNT_DISTINCT (HyperLogLog++ de BigQuery,
+# precisión 15: 1.04 / sqrt(2^15) ≈ 0.57%, ≈ 1.1% al 95%)
+APPROX_DISTINCT_RELATIVE_ERROR = 0.011
+
+# Sufijo de las columnas con el error relativo estimado (en %) de cada agregado
+ERROR_COLUMN_SUFFIX = "_error_pct"
+
+# ============================================
+# 2. MODO POR SESIÓN
+# ============================================
+
+# sesión -> modo aproximado activado (en memoria del proceso, como el presupuesto de bytes)
+_session_modes = {}
+_session_lock = threading.Lock()
+
+
+def set_approximate_mode(session_id: str, enabled: bool):
+    """Activa o desactiva el modo aproximado para las consultas de una sesión."""
+    with _session_lock:
+        _session_modes[session_id] = bool(enabled)
+
+
+def approximate_mode(session_id: str) -> bool:
+    """True si la sesión tiene activado el modo aproximado."""
+    with _session_lock:
+        return _session_modes.get(session_id, APPROX_MODE_DEFAULT)
+
+# ============================================
+# 3. REESCRITURA DE LA CONSULTA
+# ============================================
+
+@dataclass
+class ApproximateRewrite:
+    """
+    Resultado de reescribir una consulta en modo aproximado.
+
+    Attributes:
+        sql: La consulta que se ejecuta (igual a la original si no se pudo reescribir).
+        sample_percent: Porcentaje muestreado con TABLESAMPLE (None si se lee la tabla completa).
+        approx_distinct: True si COUNT(DISTINCT) se cambió por APPROX_COUNT_DISTINCT.
+        error_columns: Columnas agregadas con el error relativo estimado de cada agregado.
+        reason: Por qué no se muestreó la tabla (vacío si se muestreó).
+        design_effect: Efecto de diseño aplicado a las columnas de error.
+    """
+    sql: str
+    sample_percent: float = None
+    approx_distinct: bool = False
+    error_columns: list = field(default_factory=list)
+    reason: str = ""
+    design_effect: float = 1.0
+
+    @property
+    def changed(self) -> bool:
+        return self.sample_percent is not None or self.approx_distinct
+
+
+def _scaled_aggregates() -> tuple:
+    """Agregados que se escalan por 1/f cuando se lee una fracción f de la tabla."""
+    from sqlglot import exp
+
+    return (exp.Count, exp.CountIf, exp.Sum)
+
+
+def _estimable_aggregates() -> tuple:
+    """Agregados con una fórmula de error (los escalados y AVG)."""
+    from sqlglot import exp
+
+    return _scaled_aggregates() + (exp.Avg,)
+
+
+def _table_name(table: "exp.Table") -> str:
+    return ".".join(part for part in (table.catalog, table.db, table.name) if part)
+
+
+def _sampling_blocker(statement) -> str:
+    """
+    Motivo por el que la consulta no se puede muestrear con una cota de error
+    conocida (vacío si se puede). Solo se muestrean agregaciones simples (un
+    SELECT sobre la tabla de viajes, sin subconsultas ni JOIN), donde cada
+    agregado escalado tiene una fórmula de error.
+    """
+    from sqlglot import exp
+
+    if not isinstance(statement, exp.Select):
+        return "combina varias consultas"
+    if statement.args.get("with") or len(list(statement.find_all(exp.Select))) > 1:
+        return "usa subconsultas o CTEs"
+    if statement.args.get("joins"):
+        return "usa JOIN"
+    tables = list(statement.find_all(exp.Table))
+    if len(tables) != 1 or _table_name(tables[0]).lower() != BIGQUERY_TABLE:
+        return "no lee solo la tabla de viajes"
+    if tables[0].args.get("sample"):
+        return "ya usa TABLESAMPLE"
+    if statement.args.get("distinct"):
+        return "usa SELECT DISTINCT"
+    if statement.find(exp.Window):
+        return "usa funciones de ventana"
+    if statement.find(exp.Min, exp.Max):
+        return "usa MIN/MAX (no se pueden estimar con una muestra)"
+    if statement.find(exp.ApproxDistinct):
+        return "cuenta valores distintos (no se pueden escalar desde una muestra)"
+    if not statement.find(*_estimable_aggregates()):
+        return "no agrega filas con COUNT/SUM/AVG"
+    return ""
+
+
+def _error_sql(aggregate, fraction: float, z: float, design_effect: float = 1.0) -> str:
+    """
+    Error relativo (en %) de un agregado calculado sobre una muestra de una
+    fracción `fraction` de las filas, a partir de la propia muestra:
+
+    - COUNT / COUNTIF:  z * sqrt((1 - f) / n)
+    - AVG(x):           z * sd(x) / (sqrt(n) * |media(x)|)
+    - SUM(x):           z * sqrt((1 - f) / n * (1 + (sd(x) / media(x))²))
+
+    Las fórmulas suponen filas elegidas de forma independiente; con muestreo por
+    bloques se multiplican por sqrt(design_effect).
+    """
+    from sqlglot import exp
+
+    if isinstance(aggregate, exp.Avg):
+        x = aggregate.this.sql(dialect="bigquery")
+        relative = f"SAFE_DIVIDE(STDDEV_SAMP({x}), SQRT(COUNT({x})) * ABS(AVG({x})))"
+    elif isinstance(aggregate, exp.Sum):
+        x = aggregate.this.sql(dialect="bigquery")
+        relative = (
+            f"SQRT(SAFE_DIVIDE({1 - fraction:g}, COUNT({x})) "
+            f"* (1 + POW(SAFE_DIVIDE(STDDEV_SAMP({x}), AVG({x})), 2)))"
+        )
+    else:
+        relative = f"SQRT(SAFE_DIVIDE({1 - fraction:g}, {aggregate.sql(dialect='bigquery')}))"
+    return f"ROUND(100 * {z * design_effect ** 0.5:g} * {relative}, 2)"
+
+
+def _scaled_sql(aggregate, scale: float) -> str:
+    """El agregado de la muestra llevado al total de la tabla."""
+    from sqlglot import exp
+
+    sql = aggregate.sql(dialect="bigquery")
+    if isinstance(aggregate, exp.Sum):
+        return f"({sql} * {scale:g})"
+    return f"CAST(ROUND({sql} * {scale:g}) AS INT64)"
+
+
+def rewrite_approximate(
+    query: str,
+    sample_percent: float = APPROX_SAMPLE_PERCENT,
+    z: float = APPROX_CONFIDENCE_Z,
+    design_effect: float = APPROX_DESIGN_EFFECT,
+) -> ApproximateRewrite:
+    """
+    Reescribe una consulta de BigQuery para responderla de forma aproximada:
+
+    1. COUNT(DISTINCT x) -> APPROX_COUNT_DISTINCT(x) (HyperLogLog, sin muestrear).
+    2. Si es una agregación simple sobre la tabla de viajes, se lee solo una
+       muestra (`TABLESAMPLE SYSTEM (p PERCENT)`), COUNT/COUNTIF/SUM se escalan
+       por 100/p y, por cada columna con un solo agregado, se agrega otra columna
+       `<columna>_error_pct` con su error relativo estimado (en %), corregido por
+       `design_effect` (1 si el backend muestrea fila por fila).
+
+    Las consultas que no cumplen esas condiciones se ejecutan sin muestrear y
+    `reason` explica el motivo.
+    """
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.errors import ParseError
+
+    try:
+        statement = sqlglot.parse_one(query, read="bigquery")
+    except ParseError:
+        return ApproximateRewrite(sql=query, reason="no se pudo analizar la consulta")
+
+    approx_distinct = False
+    for count in list(statement.find_all(exp.Count)):
+        inner = count.this
+        if isinstance(inner, exp.Distinct) and len(inner.expressions) == 1:
+            count.replace(exp.ApproxDistinct(this=inner.expressions[0]))
+            approx_distinct = True
+
+    reason = _sampling_blocker(statement)
+    if reason or not 0 < sample_percent < 100:
+        return ApproximateRewrite(
+            sql=statement.sql(dialect="bigquery") if approx_distinct else query,
+            approx_distinct=approx_distinct,
+            reason=reason or "APPROX_SAMPLE_PERCENT fuera de rango",
+        )
+
+    fraction = sample_percent / 100
+    # Las columnas de error se calculan con los agregados originales (sin escalar)
+    error_columns = []
+    for index, expression in enumerate(statement.expressions):
+        aggregates = list(expression.find_all(*_estimable_aggregates()))
+        if len(aggregates) != 1 or isinstance(aggregates[0].this, exp.Distinct):
+            continue
+        name = expression.alias if isinstance(expression, exp.Alias) else f"col{index + 1}"
+        error_columns.append(
+            (name + ERROR_COLUMN_SUFFIX, _error_sql(aggregates[0], fraction, z, design_effect))
+        )
+
+    for aggregate in list(statement.find_all(*_scaled_aggregates())):
+        aggregate.replace(sqlglot.parse_one(_scaled_sql(aggregate, 1 / fraction), read="bigquery"))
+
+    table = statement.find(exp.Table)
+    table.set(
+        "sample",
+        exp.TableSample(method=exp.var("SYSTEM"), percent=exp.Literal.number(f"{sample_percent:g}")),
+    )
+    # Al final del SELECT, así no cambian los GROUP BY / ORDER BY por posición
+    for name, sql in error_columns:
+        statement.append(
+            "expressions", exp.alias_(sqlglot.parse_one(sql, read="bigquery"), name, quoted=False)
+        )
+
+    return ApproximateRewrite(
+        sql=statement.sql(dialect="bigquery"),
+        sample_percent=sample_percent,
+        approx_distinct=approx_distinct,
+        error_columns=[name for name, _ in error_columns],
+        design_effect=design_effect,
+    )
+
+# ============================================
+# 4. COTA DE ERROR PARA EL MODELO
+# ============================================
+
+def error_bound_note(rewrite: ApproximateRewrite, payload: dict) -> str:
+    """
+    Línea que acompaña al resultado aproximado: cómo se calculó y el error
+    máximo estimado (el peor de todas las filas, según las estadísticas del resultado).
+    """
+    z_text = f"z={APPROX_CONFIDENCE_Z:g}"
+    if rewrite.design_effect != 1:
+        z_text += f", efecto de diseño {rewrite.design_effect:g} por muestreo por bloques"
+    parts = []
+    if rewrite.sample_percent is not None:
+        parts.append(
+            f"muestra del {rewrite.sample_percent:g}% de la tabla, COUNT/SUM escalados "
+            f"×{100 / rewrite.sample_percent:g}"
+        )
+        worst = []
+        columns = list(payload.get("columns", []))
+        for name in rewrite.error_columns:
+            if name in columns:
+                stats = payload.get("stats", [])[columns.index(name)] if payload.get("stats") else {}
+                if stats.get("max") is not None:
+                    worst.append(f"{name[: -len(ERROR_COLUMN_SUFFIX)]} ±{stats['max']:.2f}%")
+        if worst:
+            parts.append("error relativo máximo (" + z_text + "): " + ", ".join(worst))
+        parts.append(f"columnas *{ERROR_COLUMN_SUFFIX} = error relativo de cada fila")
+    if rewrite.approx_distinct:
+        parts.append(
+            f"conteos de distintos con APPROX_COUNT_DISTINCT (±{APPROX_DISTINCT_RELATIVE_ERROR:.1%})"
+        )
+    if rewrite.sample_percent is None and rewrite.reason:
+        parts.append(f"tabla completa sin muestrear ({rewrite.reason})")
+    if not rewrite.changed:
+        return f"[Aproximado: no aplicado, resultado exacto ({rewrite.reason})]\n"
+    return "[Aproximado: " + "; ".join(parts) + "]\n"
@@ -0,0 +1,245 @@
+# tools/artifacts.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from tools.result_stream import type_name
+
+if TYPE_CHECKING:
+    # Solo para las anotaciones: pyarrow se carga recién al escribir un artefacto
+    import pyarrow as pa
+
+# ============================================
+# 1. CONFIGURACIÓN DE LOS ARTEFACTOS
+# ============================================
+
+# Todos los valores se pueden sobreescribir desde el archivo .env
+# ARTIFACTS_ENABLED=false desactiva el guardado de resultados en Parquet
+ARTIFACTS_ENABLED = os.getenv("ARTIFACTS_ENABLED", "true").lower() in ("1", "true", "yes")
+ARTIFACTS_DIR = os.getenv(
+    "ARTIFACTS_DIR", str(Path(__file__).parent.parent / ".cache" / "artifacts")
+)
+# Espacio máximo en disco; al superarlo se borran los artefactos usados hace más tiempo
+ARTIFACTS_MAX_BYTES = int(os.getenv("ARTIFACTS_MAX_BYTES", str(2 * 1024**3)))
+# Un resultado con más filas que esto no se guarda (evita copiar tablas enteras)
+ARTIFACT_MAX_ROWS = int(os.getenv("ARTIFACT_MAX_ROWS", "5000000"))
+# Guardar automáticamente los resultados que no caben completos en el mensaje al LLM
+ARTIFACTS_AUTO_SPILL = os.getenv("ARTIFACTS_AUTO_SPILL", "true").lower() in ("1", "true", "yes")
+
+# Prefijo de los identificadores: r_<12 hex>, un nombre de tabla válido en SQL
+HANDLE_PREFIX = "r_"
+
+
+def artifact_handle(namespace: str, canonical_query: str) -> str:
+    """Identificador estable de un resultado: mismo SQL (canónico) -> mismo artefacto."""
+    digest = hashlib.sha256(f"{namespace}\n{canonical_query}".encode("utf-8")).hexdigest()
+    return HANDLE_PREFIX + digest[:12]
+
+
+# ============================================
+# 2. ESCRITURA EN STREAMING
+# ============================================
+
+class ArtifactWriter:
+    """
+    Escribe en Parquet los lotes de Arrow a medida que llegan del backend (se usa
+    como `on_batch` de `stream_batches`). Escribe en un archivo temporal y solo lo
+    publica en `commit()`, así nunca queda un artefacto a medias.
+    Si el resultado supera `max_rows`, se descarta sin interrumpir la consulta.
+    """
+
+    def __init__(self, path: Path, schema: "pa.Schema", max_rows: int = ARTIFACT_MAX_ROWS):
+        import pyarrow.parquet as pq
+
+        self.path = path
+        self.max_rows = max_rows
+        self.rows = 0
+        self.discarded = False
+        self._tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        self._writer = pq.ParquetWriter(str(self._tmp_path), schema)
+
+    def write(self, batch: "pa.RecordBatch"):
+        if self.discarded:
+            return
+        if self.rows + batch.num_rows > self.max_rows:
+            self.abort()
+            return
+        self._writer.write_batch(batch)
+        self.rows += batch.num_rows
+
+    def commit(self) -> bool:
+        """Cierra el archivo y lo publica. Devuelve False si se descartó."""
+        if self.discarded:
+            return False
+        self._writer.close()
+        os.replace(self._tmp_path, self.path)
+        return True
+
+    def abort(self):
+        if self.discarded:
+            return
+        self.discarded = True
+        self._writer.close()
+        self._tmp_path.unlink(missing_ok=True)
+
+
+# ============================================
+# 3. ALMACÉN CON DESALOJO LRU
+# ============================================
+
+@dataclass
+class ArtifactInfo:
+    """Un resultado guardado en disco y consultable con SQL local"""
+    handle: str
+    path: str
+    query: str
+    session_id: str
+    rows: int
+    columns: dict
+    size_bytes: int
+    last_access: float
+
+    def describe(self) -> str:
+        """Resumen de una línea para el modelo: tabla, filas, columnas y SQL de origen."""
+        columns = ", ".join(f"{name} {type_}" for name, type_ in self.columns.items())
+        return f"`{self.handle}` ({self.rows} filas; columnas: {columns}) <- {self.query}"
+
+
+class ArtifactStore:
+    """
+    Guarda resultados de consultas como archivos Parquet y mantiene un índice en
+    SQLite (sesión, SQL de origen, filas, columnas, último acceso). Cuando el
+    total en disco supera `max_bytes`, borra los artefactos usados hace más tiempo.
+    """
+
+    def __init__(self, directory: str = ARTIFACTS_DIR, max_bytes: int = ARTIFACTS_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._db_path = str(self.directory / "artifacts.sqlite")
+        with self._connect() as db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    handle TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    rows INTEGER NOT NULL,
+                    columns TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self._db_path, timeout=30)
+
+    def path_for(self, handle: str) -> Path:
+        return self.directory / f"{handle}.parquet"
+
+    def open_writer(self, handle: str, schema: "pa.Schema") -> ArtifactWriter:
+        """Crea el escritor para un nuevo artefacto (se registra con `register`)."""
+        return ArtifactWriter(self.path_for(handle), schema)
+
+    def register(self, handle: str, writer: ArtifactWriter, query: str, session_id: str):
+        """Publica un artefacto ya escrito y aplica el límite de espacio en disco."""
+        if not writer.commit():
+            return None
+        info = ArtifactInfo(
+            handle=handle,
+            path=str(writer.path),
+            query=query,
+            session_id=session_id,
+            rows=writer.rows,
+            columns={field.name: type_name(field.type) for field in _read_schema(writer.path)},
+            size_bytes=writer.path.stat().st_size,
+            last_access=time.time(),
+        )
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    info.handle, info.path, info.query, info.session_id, info.rows,
+                    json.dumps(info.columns), info.size_bytes, info.last_access,
+                ),
+            )
+            self._evict(db, keep=handle)
+        return info
+
+    def get(self, handle: str):
+        """Busca un artefacto y marca su uso (None si no existe o fue borrado)."""
+        with self._lock, self._connect() as db:
+            row = db.execute("SELECT * FROM artifacts WHERE handle = ?", (handle,)).fetchone()
+            if row is None:
+                return None
+            info = _row_to_info(row)
+            if not Path(info.path).exists():
+                db.execute("DELETE FROM artifacts WHERE handle = ?", (handle,))
+                return None
+            info.last_access = time.time()
+            db.execute(
+                "UPDATE artifacts SET last_access = ? WHERE handle = ?", (info.last_access, handle)
+            )
+        return info
+
+    def recent(self, session_id: str, limit: int = 5) -> list:
+        """Los últimos artefactos creados o usados en una sesión (el más reciente primero)."""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT * FROM artifacts WHERE session_id = ? ORDER BY last_access DESC LIMIT ?",
+                (session_id, limit),
+            ).fetchall()
+        return [info for info in map(_row_to_info, rows) if Path(info.path).exists()]
+
+    def _evict(self, db, keep: str = None):
+        rows = db.execute(
+            "SELECT handle, path, size_bytes FROM artifacts ORDER BY last_access ASC"
+        ).fetchall()
+        total = sum(size for _, _, size in rows)
+        for handle, path, size in rows:
+            if total <= self.max_bytes:
+                break
+            if handle == keep:
+                continue
+            Path(path).unlink(missing_ok=True)
+            db.execute("DELETE FROM artifacts WHERE handle = ?", (handle,))
+            total -= size
+
+
+def _read_schema(path: Path) -> "pa.Schema":
+    import pyarrow.parquet as pq
+
+    return pq.read_schema(str(path))
+
+
+def _row_to_info(row) -> ArtifactInfo:
+    handle, path, query, session_id, rows, columns, size_bytes, last_access = row
+    return ArtifactInfo(
+        handle, path, query, session_id, rows, json.loads(columns), size_bytes, last_access
+    )
+
+
+# Instancia global (lazy loading)
+_artifact_store = None
+_store_lock = threading.Lock()
+
+
+def get_artifact_store():
+    """Obtiene el almacén global de artefactos, o None si está desactivado por configuración."""
+    global _artifact_store
+    if not ARTIFACTS_ENABLED:
+        return None
+    with _store_lock:
+        if _artifact_store is None:
+            _artifact_store = ArtifactStore()
+    return _artifact_store
@@ -0,0 +1,451 @@
+# tools/backends.py
+
+import os
+import re
+import threading
+import uuid
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from tools.cost_guard import BigQueryDryRunEstimator
+from tools.result_stream import type_name
+
+if TYPE_CHECKING:
+    # Solo para las anotaciones: pyarrow se carga recién al ejecutar una consulta
+    import pyarrow as pa
+
+# ============================================
+# 1. CONFIGURACIÓN DEL BACKEND
+# ============================================
+
+# "bigquery" (por defecto) o "duckdb" para trabajar con una copia local en Parquet
+SQL_BACKEND = os.getenv("SQL_BACKEND", "bigquery").lower()
+DUCKDB_PARQUET_PATH = os.getenv(
+    "DUCKDB_PARQUET_PATH",
+    str(Path(__file__).parent.parent / "data" / "citibike_trips.parquet"),
+)
+
+# Nombre completo de la tabla en BigQuery (en DuckDB se sirve como una vista local)
+BIGQUERY_TABLE = "bigquery-public-data.new_york_citibike.citibike_trips"
+
+
+def _arrow_type(type_code):
+    """Tipo de Arrow para un type_code de BigQuery (cursor DB-API); STRING si no se conoce."""
+    import pyarrow as pa
+
+    arrow_types = {
+        "INTEGER": pa.int64(),
+        "INT64": pa.int64(),
+        "FLOAT": pa.float64(),
+        "FLOAT64": pa.float64(),
+        "NUMERIC": pa.decimal128(38, 9),
+        "BOOLEAN": pa.bool_(),
+        "BOOL": pa.bool_(),
+        "STRING": pa.string(),
+        "BYTES": pa.binary(),
+        "DATE": pa.date32(),
+        "DATETIME": pa.timestamp("us"),
+        "TIME": pa.time64("us"),
+        "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+    }
+    return arrow_types.get(str(type_code).upper(), pa.string())
+
+
+# ============================================
+# 2. INTERFAZ COMÚN
+# ============================================
+
+class QueryCancelled(Exception):
+    """La consulta se canceló desde afuera (p. ej. el grafo superó su tiempo límite)."""
+
+
+class CancelScope:
+    """
+    Cancelación de las consultas que se ejecutan en nombre de una tool call.
+    El backend registra cómo cancelar su consulta en curso (cancelar el job de
+    BigQuery, interrumpir el cursor de DuckDB) y `cancel` lo ejecuta desde otro
+    hilo. Lo que se registre después de cancelar se cancela de inmediato.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def register(self, callback):
+        """Registra `callback()` para cancelar; devuelve la función que lo quita al terminar."""
+        with self._lock:
+            registered = not self.cancelled
+            if registered:
+                self._callbacks.append(callback)
+        if not registered:
+            callback()
+        return partial(self._unregister, callback)
+
+    def _unregister(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise QueryCancelled("La consulta fue cancelada.")
+
+    def cancel(self):
+        """Cancela las consultas en curso (bloquea hasta que el backend aceptó cada cancelación)."""
+        with self._lock:
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️ No se pudo cancelar la consulta: {e}")
+
+
+class QueryBackend:
+    """
+    Interfaz de los motores de ejecución: reciben SQL en dialecto BigQuery y
+    devuelven el resultado como un `pyarrow.RecordBatchReader` (lotes de Arrow),
+    que se consume en streaming sin cargar todo el resultado en memoria.
+    """
+
+    name = "base"
+    # TABLESAMPLE SYSTEM lee bloques enteros (no filas independientes): el modo
+    # aproximado corrige su cota de error con el efecto de diseño
+    block_sampling = True
+
+    def execute(
+        self, query: str, batch_size: int, timeout_seconds: float = None, cancel_scope: CancelScope = None
+    ) -> "pa.RecordBatchReader":
+        """
+        Ejecuta la consulta. Si se indica `timeout_seconds`, el propio motor cancela
+        la consulta cuando se supera ese tiempo (y la lectura lanza una excepción).
+        Con `cancel_scope`, la consulta también se puede cancelar desde otro hilo.
+        """
+        raise NotImplementedError
+
+    def create_estimator(self):
+        """Estimador de bytes escaneados para la guardia de costo (None si no aplica)."""
+        return None
+
+    def warmup(self, connections: int = 1):
+        """Prepara el backend (conexiones, credenciales) antes de la primera consulta."""
+
+    def describe_table(self, table: str) -> dict:
+        """
+        Columnas de una tabla sin leer sus datos: {"columns": [{"name", "type",
+        "description"}], "rows": filas o None si el motor no las informa}.
+        Por defecto se ejecuta `SELECT * ... LIMIT 0` y se lee el esquema de Arrow.
+        """
+        schema = self.execute(f"SELECT * FROM `{table}` LIMIT 0", 1).schema
+        return {
+            "columns": [
+                {"name": field.name, "type": type_name(field.type), "description": ""}
+                for field in schema
+            ],
+            "rows": None,
+        }
+
+    def cache_namespace(self) -> str:
+        """Identifica el origen de los datos para no mezclar entradas en la caché."""
+        return self.name
+
+
+# ============================================
+# 3. BACKEND DE BIGQUERY
+# ============================================
+
+class BigQueryBackend(QueryBackend):
+    """
+    Ejecuta las consultas en BigQuery a través del pool de conexiones de SQLAlchemy.
+    El cursor DB-API entrega tuplas de Python, así que cada página de `fetchmany`
+    se convierte una sola vez a un lote columnar de Arrow.
+    """
+
+    name = "bigquery"
+
+    def __init__(self, engine_factory, client_factory, db_uri: str = ""):
+        """
+        Args:
+            engine_factory: Función que devuelve el engine de SQLAlchemy (ver `get_engine`).
+            client_factory: Función que devuelve un `bigquery.Client` (para el dry run).
+            db_uri: URI de conexión, se usa como namespace de la caché.
+        """
+        self._engine_factory = engine_factory
+        self._client_factory = client_factory
+        self.db_uri = db_uri
+
+    def execute(
+        self, query: str, batch_size: int, timeout_seconds: float = None, cancel_scope: CancelScope = None
+    ) -> "pa.RecordBatchReader":
+        import pyarrow as pa
+        from google.cloud import bigquery
+
+        # BigQuery cancela el job en el servidor si supera job_timeout_ms
+        job_config = bigquery.QueryJobConfig()
+        if timeout_seconds:
+            job_config.job_timeout_ms = int(timeout_seconds * 1000)
+        # El ID del job se elige aquí para poder cancelarlo mientras el cursor espera
+        job_id = f"agent_{uuid.uuid4().hex}"
+        unregister = None
+
+        connection = self._engine_factory().raw_connection()
+        try:
+            if cancel_scope is not None:
+                unregister = cancel_scope.register(partial(self._cancel_job, job_id))
+            cursor = connection.cursor()
+            cursor.arraysize = batch_size
+            cursor.execute(query, job_id=job_id, job_config=job_config)
+            schema = pa.schema(
+                (description[0], _arrow_type(description[1]))
+                for description in cursor.description or []
+            )
+        except Exception:
+            if unregister is not None:
+                unregister()
+            connection.close()
+            raise
+
+        def batches():
+            # La conexión vuelve al pool cuando se termina (o abandona) la lectura
+            try:
+                while True:
+                    page = cursor.fetchmany(batch_size)
+                    if not page:
+                        break
+                    yield _page_to_batch(page, schema)
+            finally:
+                if unregister is not None:
+                    unregister()
+                connection.close()
+
+        return pa.RecordBatchReader.from_batches(schema, batches())
+
+    def _cancel_job(self, job_id: str):
+        # Pide la cancelación en el servidor; el cursor que espera el job recibe el error
+        self._client_factory().cancel_job(job_id)
+
+    def create_estimator(self):
+        return BigQueryDryRunEstimator(self._client_factory)
+
+    def warmup(self, connections: int = 1):
+        # El cliente compartido resuelve credenciales una vez; luego se abren
+        # varias conexiones a la vez para que queden disponibles en el pool
+        self._client_factory()
+        engine = self._engine_factory()
+        checked_out = [engine.raw_connection() for _ in range(max(connections, 1))]
+        for connection in checked_out:
+            connection.close()
+
+    def describe_table(self, table: str) -> dict:
+        # Metadatos de la API de tablas: no ejecuta un job ni factura bytes
+        metadata = self._client_factory().get_table(table)
+        return {
+            "columns": [
+                {
+                    "name": field.name,
+                    "type": _standard_type(field),
+                    "description": field.description or "",
+                }
+                for field in metadata.schema
+            ],
+            "rows": metadata.num_rows,
+        }
+
+    def cache_namespace(self) -> str:
+        return f"{self.name}:{self.db_uri}"
+
+
+# Nombres heredados de la API de tablas -> nombres de SQL estándar
+_LEGACY_TYPES = {"INTEGER": "INT64", "FLOAT": "FLOAT64", "BOOLEAN": "BOOL", "RECORD": "STRUCT"}
+
+
+def _standard_type(field) -> str:
+    standard = _LEGACY_TYPES.get(field.field_type, field.field_type)
+    return f"ARRAY<{standard}>" if field.mode == "REPEATED" else standard
+
+
+def _page_to_batch(page, schema: "pa.Schema") -> "pa.RecordBatch":
+    """Convierte una página de tuplas DB-API en un RecordBatch con el esquema indicado."""
+    import pyarrow as pa
+
+    arrays = []
+    for field, values in zip(schema, zip(*page)):
+        if pa.types.is_string(field.type):
+            values = [None if value is None else str(value) for value in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+# ============================================
+# 4. BACKEND LOCAL DE DUCKDB + PARQUET
+# ============================================
+
+_PART = r"(?:`[^`]*`|[A-Za-z_][\w-]*)"
+_SQL_NAME_RE = re.compile(
+    rf"""('(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*")"""
+    # Índices de arreglos: arr[OFFSET(n)] (desde 0) y arr[ORDINAL(n)] (desde 1)
+    r"""|(?i:\[\s*(?:SAFE_)?(OFFSET|ORDINAL)\s*\(\s*(\d+)\s*\)\s*\])"""
+    r"""|(?i:(TABLESAMPLE\s+SYSTEM)\b)"""
+    rf"""|({_PART}(?:\.{_PART})*)"""
+)
+
+
+def translate_bigquery_sql(query: str, table_map: dict) -> str:
+    """
+    Adapta el SQL de BigQuery al dialecto de DuckDB: reemplaza los nombres
+    completos de tabla (con o sin backticks) por las vistas locales y cambia el
+    resto de identificadores entre backticks por comillas dobles.
+    Los literales de texto se conservan, con comillas simples al estilo de DuckDB.
+    También traduce los índices `[OFFSET(n)]` / `[ORDINAL(n)]` y el muestreo
+    `TABLESAMPLE SYSTEM` (modo aproximado).
+    """
+    def replace(match):
+        literal = match.group(1)
+        if literal is not None:
+            # En DuckDB las comillas dobles son identificadores: los textos van entre simples
+            body = literal[1:-1].replace("\\'", "'").replace('\\"', '"')
+            return "'" + body.replace("'", "''") + "'"
+        if match.group(2) is not None:
+            # Las listas de DuckDB empiezan en 1
+            index = int(match.group(3))
+            return f"[{index + 1 if match.group(2).upper() == 'OFFSET' else index}]"
+        if match.group(4) is not None:
+            # BigQuery muestrea bloques grandes; en DuckDB los bloques son de ~2048
+            # filas, así que en la copia local se muestrea fila por fila
+            return "TABLESAMPLE BERNOULLI"
+        text = match.group(5)
+        parts = re.findall(_PART, text)
+        full_name = ".".join(part.strip("`") for part in parts)
+        if full_name in table_map:
+            return table_map[full_name]
+        if "`" not in text:
+            return text
+        return ".".join(
+            f'"{name}"' for part in parts for name in part.strip("`").split(".")
+        )
+
+    return _SQL_NAME_RE.sub(replace, query)
+
+
+# Funciones de BigQuery que no existen en DuckDB, definidas como macros
+_DUCKDB_MACROS = [
+    "CREATE OR REPLACE MACRO safe_divide(a, b) AS CASE WHEN b = 0 THEN NULL ELSE a / b END",
+    "CREATE OR REPLACE MACRO ifnull(a, b) AS coalesce(a, b)",
+    # El HyperLogLog de DuckDB es menos preciso que el HLL++ de BigQuery (±1% aprox.):
+    # en la copia local el conteo es exacto, que queda dentro de la cota de BigQuery
+    "CREATE OR REPLACE MACRO approx_count_distinct(x) AS count(DISTINCT x)",
+    # APPROX_QUANTILES(x, n): los n + 1 cuantiles de x (valores de la columna)
+    "CREATE OR REPLACE MACRO approx_quantiles(x, n) AS quantile_disc(x, [i / n for i in range(n + 1)])",
+]
+
+
+class DuckDBBackend(QueryBackend):
+    """
+    Ejecuta las consultas en una base DuckDB embebida sobre una copia local de la
+    tabla en Parquet. Sirve para desarrollo sin conexión, CI y benchmarks.
+    DuckDB produce lotes de Arrow de forma nativa (sin pasar por tuplas de Python).
+    """
+
+    name = "duckdb"
+    # TABLESAMPLE se traduce a BERNOULLI: muestreo fila por fila
+    block_sampling = False
+
+    def __init__(self, parquet_path: str = DUCKDB_PARQUET_PATH, table_map: dict = None):
+        """
+        Args:
+            parquet_path: Archivo (o patrón glob) Parquet con la copia local de la tabla.
+            table_map: Nombre completo en BigQuery -> ruta Parquet, para servir varias tablas.
+        """
+        import duckdb
+
+        self.parquet_path = parquet_path
+        sources = table_map or {BIGQUERY_TABLE: parquet_path}
+        self._table_map = {}
+        self._connection = duckdb.connect(database=":memory:")
+        for bigquery_name, path in sources.items():
+            view_name = bigquery_name.split(".")[-1]
+            escaped_path = str(path).replace("'", "''")
+            self._connection.execute(
+                f"CREATE OR REPLACE VIEW {view_name} AS SELECT * FROM read_parquet('{escaped_path}')"
+            )
+            self._table_map[bigquery_name] = view_name
+        for macro in _DUCKDB_MACROS:
+            self._connection.execute(macro)
+
+    def execute(
+        self, query: str, batch_size: int, timeout_seconds: float = None, cancel_scope: CancelScope = None
+    ) -> "pa.RecordBatchReader":
+        import pyarrow as pa
+
+        # Cada consulta usa su propio cursor para poder ejecutar en varios hilos
+        cursor = self._connection.cursor()
+        timer = None
+        if timeout_seconds:
+            # interrupt() cancela la consulta en curso desde otro hilo
+            timer = threading.Timer(timeout_seconds, cursor.interrupt)
+            timer.daemon = True
+            timer.start()
+        unregister = cancel_scope.register(cursor.interrupt) if cancel_scope is not None else None
+
+        def done():
+            if timer is not None:
+                timer.cancel()
+            if unregister is not None:
+                unregister()
+
+        try:
+            result = cursor.execute(translate_bigquery_sql(query, self._table_map))
+            if hasattr(result, "to_arrow_reader"):
+                reader = result.to_arrow_reader(batch_size)
+            else:
+                reader = result.fetch_record_batch(batch_size)
+        except Exception:
+            done()
+            raise
+        if timer is None and unregister is None:
+            return reader
+
+        def batches():
+            try:
+                yield from reader
+            finally:
+                done()
+
+        return pa.RecordBatchReader.from_batches(reader.schema, batches())
+
+    def describe_table(self, table: str) -> dict:
+        described = super().describe_table(table)
+        # En Parquet el conteo sale de los metadatos de cada archivo (no lee los datos)
+        count = self.execute(f"SELECT COUNT(*) FROM `{table}`", 1).read_all()
+        described["rows"] = count.column(0)[0].as_py()
+        return described
+
+    def cache_namespace(self) -> str:
+        return f"{self.name}:{self.parquet_path}"
+
+
+# ============================================
+# 5. EXPORTAR UNA COPIA LOCAL DESDE BIGQUERY
+# ============================================
+
+def export_to_parquet(backend: QueryBackend, query: str, path: str, batch_size: int = 10_000):
+    """
+    Escribe el resultado de una consulta en un archivo Parquet, lote por lote.
+    Se usa para crear la copia local que sirve `DuckDBBackend`.
+
+    Returns:
+        El número de filas escritas.
+    """
+    import pyarrow.parquet as pq
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    reader = backend.execute(query, batch_size)
+    rows = 0
+    with pq.ParquetWriter(path, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    return rows
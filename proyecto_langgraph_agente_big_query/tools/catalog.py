@@ -0,0 +1,584 @@
+# tools/catalog.py
+
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from tools.backends import BIGQUERY_TABLE, SQL_BACKEND
+from tools.result_format import estimate_tokens, format_value
+from tools.sql_validation import parse_table_schema
+
+# ============================================
+# 1. CONFIGURACIÓN DEL CATÁLOGO
+# ============================================
+
+# Todos los valores se pueden sobreescribir desde el archivo .env
+# CATALOG_ENABLED=false vuelve a poner el esquema completo (TABLE_SCHEMA) en cada prompt
+CATALOG_ENABLED = os.getenv("CATALOG_ENABLED", "true").lower() in ("1", "true", "yes")
+CATALOG_PATH = os.getenv("CATALOG_PATH", str(Path(__file__).parent.parent / ".cache" / "catalog.json"))
+# Tablas extra (nombres completos de BigQuery, separadas por comas) además de la de viajes
+CATALOG_TABLES = [name.strip() for name in os.getenv("CATALOG_TABLES", "").split(",") if name.strip()]
+# Actualizar el catálogo al arrancar si no existe o tiene más de CATALOG_MAX_AGE_HOURS horas
+CATALOG_REFRESH_ON_STARTUP = os.getenv("CATALOG_REFRESH_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+CATALOG_MAX_AGE_HOURS = float(os.getenv("CATALOG_MAX_AGE_HOURS", "24"))
+# Porcentaje de la tabla que leen las estadísticas (100 = tabla completa); las tablas
+# con menos de CATALOG_FULL_SCAN_MAX_ROWS filas se leen siempre completas
+CATALOG_STATS_SAMPLE_PERCENT = float(os.getenv("CATALOG_STATS_SAMPLE_PERCENT", "10"))
+CATALOG_FULL_SCAN_MAX_ROWS = int(os.getenv("CATALOG_FULL_SCAN_MAX_ROWS", "1000000"))
+# Columnas de texto con hasta N valores distintos se tratan como categóricas (se guardan sus valores)
+CATALOG_CATEGORICAL_MAX_DISTINCT = int(os.getenv("CATALOG_CATEGORICAL_MAX_DISTINCT", "30"))
+CATALOG_MAX_VALUES = int(os.getenv("CATALOG_MAX_VALUES", "8"))
+# Tamaño del contexto por pregunta: tablas, columnas con estadísticas y nombres del resto
+CATALOG_PROMPT_MAX_TABLES = int(os.getenv("CATALOG_PROMPT_MAX_TABLES", "2"))
+CATALOG_PROMPT_MAX_COLUMNS = int(os.getenv("CATALOG_PROMPT_MAX_COLUMNS", "8"))
+CATALOG_PROMPT_OTHER_COLUMNS = int(os.getenv("CATALOG_PROMPT_OTHER_COLUMNS", "40"))
+
+# ============================================
+# 2. ESQUEMA BASE Y DESCRIPCIONES
+# ============================================
+
+# Esquema de la tabla de viajes: se usa mientras no exista un catálogo introspectado
+# (y con CATALOG_ENABLED=false, completo en el prompt)
+TABLE_SCHEMA = """
+CREATE TABLE `bigquery-public-data.new_york_citibike.citibike_trips` (
+    tripduration INTEGER,
+    starttime TIMESTAMP,
+    stoptime TIMESTAMP,
+    start_station_id INTEGER,
+    start_station_name STRING,
+    start_station_latitude FLOAT64,
+    start_station_longitude FLOAT64,
+    end_station_id INTEGER,
+    end_station_name STRING,
+    end_station_latitude FLOAT64,
+    end_station_longitude FLOAT64,
+    bikeid INTEGER,
+    usertype STRING,
+    birth_year INTEGER,
+    gender STRING,
+    customer_plan STRING
+)
+"""
+
+# Descripción y palabras clave (en español) de cada tabla conocida: las palabras clave
+# relacionan las preguntas con la tabla aunque no nombren sus columnas
+TABLE_NOTES = {
+    BIGQUERY_TABLE: (
+        "viajes de CitiBike en Nueva York, un registro por viaje",
+        "viaje viajes recorrido recorridos bicicleta bici citibike",
+    ),
+}
+
+_START_STATION = "estación origen salida inicio partida sale salen ruta rutas"
+_END_STATION = "estación destino llegada fin termina terminan ruta rutas"
+_LOCATION = "ubicación coordenadas latitud longitud distancia mapa cerca lejos"
+
+COLUMN_NOTES = {
+    BIGQUERY_TABLE: {
+        "tripduration": ("duración del viaje en segundos", "duración dura tiempo minutos horas largo corto"),
+        "starttime": ("inicio del viaje", "fecha día días mes meses año años hora horas semana cuándo inicio temporada"),
+        "stoptime": ("fin del viaje", "fecha fin término llegada termina"),
+        "start_station_id": ("ID de la estación de origen", _START_STATION),
+        "start_station_name": ("nombre de la estación de origen", _START_STATION),
+        "start_station_latitude": ("latitud de la estación de origen", _LOCATION),
+        "start_station_longitude": ("longitud de la estación de origen", _LOCATION),
+        "end_station_id": ("ID de la estación de destino", _END_STATION),
+        "end_station_name": ("nombre de la estación de destino", _END_STATION),
+        "end_station_latitude": ("latitud de la estación de destino", _LOCATION),
+        "end_station_longitude": ("longitud de la estación de destino", _LOCATION),
+        "bikeid": ("ID de la bicicleta", "bicicleta bicicletas bici bicis"),
+        "usertype": ("tipo de usuario", "tipo usuario usuarios suscriptor suscriptores cliente clientes ocasional miembro"),
+        "birth_year": ("año de nacimiento del usuario", "nacimiento nacido nacidos edad edades joven jóvenes mayores generación"),
+        "gender": ("género del usuario", "género hombre hombres mujer mujeres sexo masculino femenino"),
+        "customer_plan": ("plan del cliente", "plan planes tarifa"),
+    },
+}
+
+_NUMERIC_TYPES = {"INTEGER", "INT64", "FLOAT", "FLOAT64", "NUMERIC", "BIGNUMERIC"}
+_TEMPORAL_TYPES = {"DATE", "DATETIME", "TIMESTAMP", "TIME"}
+_CATEGORICAL_TYPES = {"STRING", "BOOL", "BOOLEAN"}
+# Tipos en los que no se cuentan valores distintos (no agrupables o sin utilidad para el modelo)
+_NO_DISTINCT_TYPES = {"FLOAT", "FLOAT64", "BYTES", "GEOGRAPHY", "JSON", "STRUCT", "RECORD"}
+
+
+@dataclass
+class ColumnInfo:
+    """Una columna del catálogo con sus estadísticas (None = no calculada)."""
+    name: str
+    type: str
+    description: str = ""
+    keywords: str = ""
+    distinct: int = None
+    null_pct: float = None
+    min: str = None
+    max: str = None
+    # Valores más frecuentes de las columnas categóricas: [[valor, % de filas], ...]
+    values: list = field(default_factory=list)
+
+    def describe(self) -> str:
+        """Línea del prompt: tipo, descripción y estadísticas que ayudan a filtrar."""
+        line = f"- `{self.name}` {self.type}"
+        if self.description:
+            line += f": {self.description}"
+        stats = []
+        if self.values:
+            shown = ", ".join(f"{_literal(value)} {pct:g}%" for value, pct in self.values)
+            more = ", …" if self.distinct is not None and self.distinct > len(self.values) else ""
+            stats.append(f"valores: {shown}{more}")
+        elif self.min is not None:
+            stats.append(f"rango {_short(self.min, self.type)} a {_short(self.max, self.type)}")
+        if self.distinct is not None and not self.values:
+            stats.append(f"≈{self.distinct:,} distintos")
+        if self.null_pct:
+            stats.append(f"{self.null_pct:g}% nulos")
+        return line + (f" ({'; '.join(stats)})" if stats else "")
+
+
+@dataclass
+class TableInfo:
+    """Una tabla del catálogo: columnas, filas y de dónde salieron las estadísticas."""
+    name: str
+    columns: list
+    description: str = ""
+    keywords: str = ""
+    rows: int = None
+    # Porcentaje muestreado al calcular las estadísticas (None = sin estadísticas)
+    sample_percent: float = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TableInfo":
+        columns = [ColumnInfo(**column) for column in data.get("columns", [])]
+        return cls(**{**data, "columns": columns})
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def header(self) -> str:
+        line = f"### `{self.name}`"
+        if self.description:
+            line += f": {self.description}"
+        if self.rows is not None:
+            line += f" ({self.rows:,} filas)"
+        return line
+
+
+def _literal(value) -> str:
+    return f"'{value}'" if isinstance(value, str) else format_value(value)
+
+
+def _short(value, column_type: str) -> str:
+    """Los rangos de fechas se muestran sin la hora (basta para acotar un filtro)."""
+    if column_type in ("TIMESTAMP", "DATETIME") and isinstance(value, str):
+        return value[:10]
+    return format_value(value)
+
+
+def _with_notes(table: str, columns: list) -> list:
+    """Agrega la descripción y las palabras clave de COLUMN_NOTES (si las hay)."""
+    notes = COLUMN_NOTES.get(table, {})
+    for column in columns:
+        description, keywords = notes.get(column.name.lower(), (column.description, ""))
+        column.description = description or column.description
+        column.keywords = keywords
+    return columns
+
+
+def builtin_tables() -> dict:
+    """Tablas de TABLE_SCHEMA, sin estadísticas: el catálogo antes de la primera actualización."""
+    tables = {}
+    for name, columns in parse_table_schema(TABLE_SCHEMA).items():
+        description, keywords = TABLE_NOTES.get(name, ("", ""))
+        tables[name] = TableInfo(
+            name=name,
+            columns=_with_notes(name, [ColumnInfo(column, column_type) for column, column_type in columns.items()]),
+            description=description,
+            keywords=keywords,
+        )
+    return tables
+
+# ============================================
+# 3. INTROSPECCIÓN Y ESTADÍSTICAS
+# ============================================
+
+def _stats_sql(table: str, columns: list, sample_percent: float) -> str:
+    """Una sola consulta con filas, nulos, distintos y rango de todas las columnas."""
+    selects = ["COUNT(*) AS filas"]
+    for i, column in enumerate(columns):
+        name = f"`{column.name}`"
+        if column.type.startswith(("ARRAY", "STRUCT")):
+            continue
+        selects.append(f"COUNTIF({name} IS NULL) AS c{i}_nulos")
+        if column.type not in _NO_DISTINCT_TYPES:
+            selects.append(f"APPROX_COUNT_DISTINCT({name}) AS c{i}_distintos")
+        if column.type in _NUMERIC_TYPES or column.type in _TEMPORAL_TYPES:
+            selects.append(f"MIN({name}) AS c{i}_min, MAX({name}) AS c{i}_max")
+    return f"SELECT {', '.join(selects)} FROM `{table}`{_sample_clause(sample_percent)}"
+
+
+def _values_sql(table: str, columns: list, sample_percent: float) -> str:
+    """Frecuencia de cada valor de las columnas categóricas (una consulta para todas)."""
+    parts = [
+        f"SELECT '{column.name}' AS columna, CAST(`{column.name}` AS STRING) AS valor, COUNT(*) AS n "
+        f"FROM `{table}`{_sample_clause(sample_percent)} WHERE `{column.name}` IS NOT NULL GROUP BY 2"
+        for column in columns
+    ]
+    return " UNION ALL ".join(parts)
+
+
+def _sample_clause(sample_percent: float) -> str:
+    return f" TABLESAMPLE SYSTEM ({sample_percent:g} PERCENT)" if sample_percent < 100 else ""
+
+
+def _read_rows(backend, query: str) -> list:
+    return backend.execute(query, 10_000).read_all().to_pylist()
+
+
+def introspect_table(backend, name: str, sample_percent: float = CATALOG_STATS_SAMPLE_PERCENT) -> TableInfo:
+    """
+    Lee el esquema de una tabla (sin escanear datos) y calcula sus estadísticas
+    con dos consultas: una de agregados por columna (nulos, distintos, rango) y
+    otra con los valores más frecuentes de las columnas categóricas.
+
+    Las tablas grandes se muestrean (`sample_percent`): los rangos y los conteos
+    de distintos son entonces aproximados, lo que basta para orientar al modelo.
+    """
+    described = backend.describe_table(name)
+    columns = _with_notes(name, [
+        ColumnInfo(column["name"], column["type"], column.get("description") or "")
+        for column in described["columns"]
+    ])
+    rows = described.get("rows")
+    if rows is not None and rows <= CATALOG_FULL_SCAN_MAX_ROWS:
+        sample_percent = 100
+    stats = _read_rows(backend, _stats_sql(name, columns, sample_percent))[0]
+    if not stats["filas"] and sample_percent < 100:
+        # Una muestra vacía (tablas de pocos bloques en BigQuery): se lee completa
+        sample_percent = 100
+        stats = _read_rows(backend, _stats_sql(name, columns, sample_percent))[0]
+    scanned = int(stats["filas"])
+
+    for i, column in enumerate(columns):
+        # Los conteos pueden llegar como Decimal (HUGEINT en DuckDB): se guardan como números de JSON
+        nulls = stats.get(f"c{i}_nulos")
+        if nulls is not None and scanned:
+            column.null_pct = round(100 * int(nulls) / scanned, 2)
+        distinct = stats.get(f"c{i}_distintos")
+        column.distinct = int(distinct) if distinct is not None else None
+        for bound in ("min", "max"):
+            value = stats.get(f"c{i}_{bound}")
+            setattr(column, bound, format_value(value) if value is not None else None)
+
+    categorical = [
+        column for column in columns
+        if column.type in _CATEGORICAL_TYPES
+        and column.distinct is not None
+        and column.distinct <= CATALOG_CATEGORICAL_MAX_DISTINCT
+    ]
+    if categorical and scanned:
+        counts = {}
+        for row in _read_rows(backend, _values_sql(name, categorical, sample_percent)):
+            counts.setdefault(row["columna"], []).append((row["valor"], row["n"]))
+        for column in categorical:
+            top = sorted(counts.get(column.name, []), key=lambda item: -item[1])[:CATALOG_MAX_VALUES]
+            column.values = [[value, round(100 * int(n) / scanned, 1)] for value, n in top]
+
+    description, keywords = TABLE_NOTES.get(name, ("", ""))
+    return TableInfo(
+        name=name,
+        columns=columns,
+        description=description,
+        keywords=keywords,
+        rows=rows if rows is not None else round(scanned * 100 / sample_percent),
+        sample_percent=sample_percent,
+    )
+
+# ============================================
+# 4. RELEVANCIA: PREGUNTA -> TABLAS Y COLUMNAS
+# ============================================
+
+# Prefijo con el que se comparan las palabras ("estaciones" y "estación" -> "estac")
+_STEM_CHARS = 5
+_STOPWORDS = {
+    "los", "las", "del", "que", "por", "con", "para", "una", "uno", "unos", "como", "cual",
+    "cuales", "cuanto", "cuantos", "cuanta", "cuantas", "mas", "menos", "entre", "sus", "hay",
+    "son", "fue", "fueron", "este", "esta", "esos", "esas", "cada", "todo", "todos", "dame",
+    "muestra", "quiero", "saber", "the", "and", "of", "from",
+}
+_YEAR_RE = re.compile(r"^(19|20)\d\d$")
+
+
+def _normalize(text: str) -> str:
+    """Minúsculas y sin tildes ("Duración" -> "duracion")."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def _stems(text: str) -> set:
+    stems = set()
+    for word in re.findall(r"[a-z0-9]+", _normalize(text)):
+        if _YEAR_RE.match(word):
+            # Un año en la pregunta apunta a las columnas de fecha
+            stems.add("fecha")
+        elif len(word) > 2 and word not in _STOPWORDS:
+            stems.add(word[:_STEM_CHARS])
+    return stems
+
+
+@dataclass
+class _IndexedTable:
+    table: TableInfo
+    stems: set
+    # (columna, palabras de su nombre, palabras clave / descripción / valores)
+    columns: list
+
+
+def _index_table(table: TableInfo) -> _IndexedTable:
+    columns = []
+    for column in table.columns:
+        extra = column.keywords or column.description
+        values = " ".join(str(value) for value, _ in column.values)
+        columns.append((column, _stems(column.name), _stems(f"{extra} {values}")))
+    return _IndexedTable(table, _stems(f"{table.name.split('.')[-1]} {table.keywords or table.description}"), columns)
+
+
+def _rank_columns(indexed: _IndexedTable, question: set) -> list:
+    """Columnas con alguna coincidencia, de la más a la menos relevante (el nombre pesa el doble)."""
+    scored = []
+    for position, (column, name_stems, keyword_stems) in enumerate(indexed.columns):
+        score = 2 * len(question & name_stems) + len(question & keyword_stems)
+        if score:
+            scored.append((-score, position, column))
+    return [(-score, column) for score, _, column in sorted(scored, key=lambda item: item[:2])]
+
+
+def _columns_by_type(columns: list) -> str:
+    """Nombres agrupados por tipo ("INT64: a, b; STRING: c"): el tipo no se repite en cada columna."""
+    by_type = {}
+    for column in columns:
+        by_type.setdefault(column.type, []).append(column.name)
+    return "; ".join(f"{column_type}: {', '.join(names)}" for column_type, names in by_type.items())
+
+# ============================================
+# 5. CATÁLOGO PERSISTENTE
+# ============================================
+
+class SchemaCatalog:
+    """
+    Catálogo de tablas y columnas con estadísticas, guardado en un JSON local.
+
+    - `schema()`: todas las tablas y columnas, para validar el SQL.
+    - `context(pregunta)`: solo lo relevante para la pregunta, para el prompt; su
+      tamaño lo acotan CATALOG_PROMPT_* aunque el catálogo crezca.
+    - `refresh(backend)`: vuelve a introspectar las tablas y calcular las estadísticas.
+
+    Las estadísticas guardadas se usan solo si salieron del mismo tipo de backend
+    (SQL_BACKEND): la copia local de DuckDB no describe los datos de BigQuery.
+    Mientras no haya un catálogo actualizado se usa TABLE_SCHEMA, sin estadísticas.
+    """
+
+    def __init__(self, path: str = CATALOG_PATH, extra_tables=CATALOG_TABLES):
+        self.path = Path(path)
+        self.table_names = list(dict.fromkeys([BIGQUERY_TABLE, *extra_tables]))
+        self._refresh_lock = threading.Lock()
+        self._manifest = self._load_manifest()
+        self._set_tables(self._manifest.get("tables", {}))
+
+    # --- persistencia ---
+
+    def _load_manifest(self) -> dict:
+        try:
+            manifest = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        return manifest if manifest.get("backend") == SQL_BACKEND else {}
+
+    def _save_manifest(self, manifest: dict):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=2, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+        self._manifest = manifest
+
+    def _set_tables(self, stored: dict):
+        tables = builtin_tables()
+        for name, data in stored.items():
+            tables[name] = TableInfo.from_dict(data)
+        # Primero la tabla de viajes y las de CATALOG_TABLES, en ese orden
+        ordered = {name: tables[name] for name in self.table_names if name in tables}
+        ordered.update(tables)
+        self._tables = ordered
+        self._schema = {
+            name: {column.name.lower(): column.type for column in table.columns}
+            for name, table in ordered.items()
+        }
+        self._index = [_index_table(table) for table in ordered.values()]
+
+    def describe(self) -> dict:
+        """Estado del catálogo (backend, fecha de actualización, tablas y errores)."""
+        return {
+            "backend": self._manifest.get("backend"),
+            "refreshed_at": self._manifest.get("refreshed_at"),
+            "tables": {name: table.rows for name, table in self._tables.items()},
+            "errors": self._manifest.get("errors", {}),
+        }
+
+    def is_stale(self) -> bool:
+        refreshed_at = self._manifest.get("refreshed_at")
+        if refreshed_at is None or set(self.table_names) - set(self._manifest.get("tables", {})):
+            return True
+        return time.time() - refreshed_at > CATALOG_MAX_AGE_HOURS * 3600
+
+    # --- actualización ---
+
+    def refresh(self, backend) -> dict:
+        """
+        Introspecta las tablas del catálogo y calcula sus estadísticas en `backend`.
+        Si una tabla falla se conserva su versión anterior y el error queda en el manifiesto.
+
+        Returns:
+            El resumen de `describe()` tras la actualización.
+        """
+        with self._refresh_lock:
+            previous = self._manifest.get("tables", {})
+            tables, errors = {}, {}
+            for name in self.table_names:
+                try:
+                    tables[name] = introspect_table(backend, name).to_dict()
+                except Exception as e:
+                    errors[name] = str(e)
+                    if name in previous:
+                        tables[name] = previous[name]
+            self._save_manifest({
+                "backend": backend.name,
+                "namespace": backend.cache_namespace(),
+                "refreshed_at": time.time(),
+                "tables": tables,
+                "errors": errors,
+            })
+            self._set_tables(tables if backend.name == SQL_BACKEND else {})
+            return self.describe()
+
+    # --- uso ---
+
+    def schema(self) -> dict:
+        """Esquema completo {tabla: {columna: tipo}} para `validate_sql`."""
+        return self._schema
+
+    def context(self, question: str) -> str:
+        """
+        Sección del prompt con las tablas y columnas relevantes para `question`:
+        las columnas que coinciden con la pregunta van con su descripción y
+        estadísticas; el resto de columnas de esas tablas, solo con nombre y tipo
+        (hasta CATALOG_PROMPT_OTHER_COLUMNS);
+        las demás tablas, solo con su nombre. Sin coincidencias, se muestra la
+        tabla de viajes.
+        """
+        question_stems = _stems(question)
+        ranked = []
+        for position, indexed in enumerate(self._index):
+            columns = _rank_columns(indexed, question_stems)
+            table_score = len(question_stems & indexed.stems) + sum(score for score, _ in columns[:3])
+            ranked.append((table_score, -position, indexed, columns))
+        ranked.sort(key=lambda item: item[:2], reverse=True)
+        chosen = [item for item in ranked if item[0] > 0][:CATALOG_PROMPT_MAX_TABLES] or ranked[:1]
+
+        lines = [
+            "\n## Catálogo de datos (tablas y columnas relevantes para esta pregunta)",
+        ]
+        for _, _, indexed, columns in chosen:
+            lines.append(indexed.table.header())
+            detailed = [column for _, column in columns[:CATALOG_PROMPT_MAX_COLUMNS]]
+            lines.extend(column.describe() for column in detailed)
+            others = [column for column in indexed.table.columns if column not in detailed]
+            if others:
+                hidden = len(others) - CATALOG_PROMPT_OTHER_COLUMNS
+                lines.append(
+                    ("Columnas: " if not detailed else "Otras columnas: ")
+                    + _columns_by_type(others[:CATALOG_PROMPT_OTHER_COLUMNS])
+                    + (f"; y {hidden} más" if hidden > 0 else "")
+                )
+        chosen_tables = {id(item[2]) for item in chosen}
+        rest = [item[2].table for item in ranked if id(item[2]) not in chosen_tables]
+        if rest:
+            shown = rest[:CATALOG_PROMPT_MAX_TABLES * 2]
+            lines.append(
+                "Otras tablas: "
+                + ", ".join(f"`{table.name}`" + (f" ({table.description})" if table.description else "") for table in shown)
+                + (f" y {len(rest) - len(shown)} más" if len(rest) > len(shown) else "")
+            )
+        return "\n".join(lines)
+
+    def context_tokens(self, question: str) -> int:
+        """Tokens estimados del contexto de una pregunta (para el benchmark y la CLI)."""
+        return estimate_tokens(self.context(question))
+
+
+# Instancia global (lazy loading)
+_catalog = None
+_catalog_lock = threading.Lock()
+_refresh_thread = None
+
+
+def get_catalog():
+    """Obtiene el catálogo global, o None si está desactivado (CATALOG_ENABLED=false)."""
+    global _catalog
+    if not CATALOG_ENABLED:
+        return None
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = SchemaCatalog()
+    return _catalog
+
+
+def start_catalog_refresh():
+    """
+    Actualiza el catálogo en un hilo en segundo plano (una sola vez por proceso) si
+    CATALOG_REFRESH_ON_STARTUP=true y el catálogo no existe o está desactualizado.
+    """
+    global _refresh_thread
+    catalog = get_catalog()
+    with _catalog_lock:
+        if _refresh_thread is not None or not CATALOG_REFRESH_ON_STARTUP or catalog is None or not catalog.is_stale():
+            return _refresh_thread
+        _refresh_thread = threading.Thread(target=_refresh_silently, daemon=True)
+        _refresh_thread.start()
+    return _refresh_thread
+
+
+def _refresh_silently():
+    # Sin catálogo actualizado el agente sigue funcionando con TABLE_SCHEMA
+    from tools.run_sql_query import get_backend
+
+    try:
+        get_catalog().refresh(get_backend())
+    except Exception as e:
+        print(f"⚠️ No se pudo actualizar el catálogo: {e}")
+
+# ============================================
+# 6. LÍNEA DE COMANDOS
+# ============================================
+
+if __name__ == "__main__":
+    # python -m tools.catalog --refresh        introspecta las tablas y guarda las estadísticas
+    # python -m tools.catalog "¿pregunta?"     muestra el contexto que recibiría el modelo
+    import sys
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    # La configuración del módulo se leyó antes de load_dotenv
+    extra_tables = [name.strip() for name in os.getenv("CATALOG_TABLES", "").split(",") if name.strip()]
+    catalog = SchemaCatalog(os.getenv("CATALOG_PATH", CATALOG_PATH), extra_tables)
+    arguments = [argument for argument in sys.argv[1:] if argument != "--refresh"]
+    if "--refresh" in sys.argv:
+        from tools.run_sql_query import get_backend
+
+        print(json.dumps(catalog.refresh(get_backend()), indent=2, ensure_ascii=False))
+    for question in arguments:
+        print(catalog.context(question))
+        print(f"\n(≈{catalog.context_tokens(question)} tokens)\n")
@@ -0,0 +1,206 @@
+# tools/cost_guard.py
+
+import json
+import os
+import threading
+from dataclasses import dataclass
+
+from tools.sql_cache import canonicalize_sql
+
+# ============================================
+# 1. CONFIGURACIÓN DEL PRESUPUESTO
+# ============================================
+
+# Todos los valores se pueden sobreescribir desde el archivo .env
+COST_GUARD_ENABLED = os.getenv("COST_GUARD_ENABLED", "true").lower() in ("1", "true", "yes")
+MAX_BYTES_PER_QUERY = int(os.getenv("MAX_BYTES_PER_QUERY", str(2 * 1024 ** 3)))
+MAX_BYTES_PER_SESSION = int(os.getenv("MAX_BYTES_PER_SESSION", str(10 * 1024 ** 3)))
+
+
+def format_bytes(num_bytes: int) -> str:
+    """Devuelve un tamaño en bytes legible para personas (ej. '1.5 GB')."""
+    size = float(num_bytes)
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+# ============================================
+# 2. ESTIMADORES DE BYTES ESCANEADOS
+# ============================================
+
+class BytesEstimator:
+    """
+    Interfaz de los estimadores: reciben una consulta SQL y devuelven cuántos
+    bytes escanearía sin llegar a ejecutarla.
+    """
+
+    def estimate_bytes(self, query: str) -> int:
+        raise NotImplementedError
+
+
+class BigQueryDryRunEstimator(BytesEstimator):
+    """
+    Estima el costo con un dry run de BigQuery: la consulta se valida y se
+    calcula `total_bytes_processed`, pero no se ejecuta ni se factura.
+    Si el SQL es inválido, el dry run lanza la excepción de BigQuery.
+    """
+
+    def __init__(self, client_factory):
+        """
+        Args:
+            client_factory: Función sin argumentos que devuelve un `bigquery.Client`.
+        """
+        self._client_factory = client_factory
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def _get_client(self):
+        """El cliente se crea una sola vez, aunque varios hilos estimen a la vez."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._client_factory()
+        return self._client
+
+    def estimate_bytes(self, query: str) -> int:
+        from google.cloud import bigquery
+
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        job = self._get_client().query(query, job_config=job_config)
+        return int(job.total_bytes_processed or 0)
+
+
+class StaticBytesEstimator(BytesEstimator):
+    """
+    Estimador local para desarrollo y pruebas: devuelve valores fijos por
+    consulta (comparando el SQL canonicalizado) o un valor por defecto.
+    """
+
+    def __init__(self, bytes_by_query: dict = None, default_bytes: int = 0):
+        self.default_bytes = default_bytes
+        self._bytes_by_query = {
+            canonicalize_sql(query)[0]: num_bytes
+            for query, num_bytes in (bytes_by_query or {}).items()
+        }
+
+    def estimate_bytes(self, query: str) -> int:
+        return self._bytes_by_query.get(canonicalize_sql(query)[0], self.default_bytes)
+
+
+# ============================================
+# 3. GUARDIA DE COSTO
+# ============================================
+
+@dataclass
+class CostDecision:
+    """Resultado de revisar una consulta contra el presupuesto"""
+    allowed: bool
+    estimated_bytes: int
+    session_bytes_used: int
+    reason: str = ""
+
+    def to_rejection_message(self, guard: "CostGuard") -> str:
+        """Rechazo estructurado (JSON) que el agente puede usar para reescribir la consulta."""
+        rejection = {
+            "estado": "rechazada_por_presupuesto",
+            "motivo": self.reason,
+            "bytes_estimados": self.estimated_bytes,
+            "bytes_estimados_legible": format_bytes(self.estimated_bytes),
+            "limite_por_consulta": format_bytes(guard.max_bytes_per_query),
+            "presupuesto_restante_sesion": format_bytes(
+                max(guard.max_bytes_per_session - self.session_bytes_used, 0)
+            ),
+            "sugerencias": [
+                "Selecciona solo las columnas necesarias (evita SELECT *).",
+                "Agrega filtros en WHERE, por ejemplo un rango de fechas sobre starttime.",
+                "Agrega agregaciones (COUNT, AVG, GROUP BY) en lugar de traer filas crudas.",
+            ],
+        }
+        return json.dumps(rejection, ensure_ascii=False, indent=2)
+
+
+class CostGuard:
+    """
+    Revisa cada consulta antes de ejecutarla y aplica dos límites:
+    bytes escaneados por consulta y bytes acumulados por sesión.
+
+    Una consulta aceptada reserva sus bytes estimados en el mismo bloqueo en
+    que se revisa el presupuesto, así las consultas simultáneas de una sesión
+    (tool calls en paralelo, trabajos en segundo plano) no lo pueden superar
+    entre todas. Después de ejecutarla, la reserva se confirma con `record` o
+    se devuelve con `release`.
+    """
+
+    def __init__(
+        self,
+        estimator: BytesEstimator,
+        max_bytes_per_query: int = MAX_BYTES_PER_QUERY,
+        max_bytes_per_session: int = MAX_BYTES_PER_SESSION,
+    ):
+        self.estimator = estimator
+        self.max_bytes_per_query = max_bytes_per_query
+        self.max_bytes_per_session = max_bytes_per_session
+        self._usage = {}
+        # Bytes de las consultas aceptadas que todavía se están ejecutando
+        self._reserved = {}
+        self._lock = threading.Lock()
+
+    def _committed(self, session_id: str) -> int:
+        """Bytes usados más reservados de la sesión (llamar con el bloqueo tomado)."""
+        return self._usage.get(session_id, 0) + self._reserved.get(session_id, 0)
+
+    def check(self, query: str, session_id: str = "default") -> CostDecision:
+        """
+        Estima los bytes de la consulta y decide si se puede ejecutar. Si se
+        acepta, sus bytes estimados quedan reservados: hay que llamar a `record`
+        (se ejecutó) o a `release` (falló o no escaneó nada) con ese valor.
+        """
+        # El dry run es lento: se hace fuera del bloqueo
+        estimated = self.estimator.estimate_bytes(query)
+
+        with self._lock:
+            used = self._committed(session_id)
+            if estimated > self.max_bytes_per_query:
+                reason = (
+                    f"La consulta escanearía {format_bytes(estimated)}, más que el límite "
+                    f"de {format_bytes(self.max_bytes_per_query)} por consulta."
+                )
+                return CostDecision(False, estimated, used, reason)
+            if used + estimated > self.max_bytes_per_session:
+                reason = (
+                    f"La consulta escanearía {format_bytes(estimated)} y la sesión ya usó "
+                    f"(o tiene en curso) {format_bytes(used)} de {format_bytes(self.max_bytes_per_session)}."
+                )
+                return CostDecision(False, estimated, used, reason)
+            self._reserved[session_id] = self._reserved.get(session_id, 0) + estimated
+            return CostDecision(True, estimated, used)
+
+    def _unreserve(self, session_id: str, num_bytes: int):
+        reserved = self._reserved.get(session_id, 0) - num_bytes
+        if reserved > 0:
+            self._reserved[session_id] = reserved
+        else:
+            self._reserved.pop(session_id, None)
+
+    def record(self, session_id: str, num_bytes: int):
+        """Confirma la reserva de una consulta ejecutada: sus bytes pasan al acumulado de la sesión."""
+        with self._lock:
+            self._unreserve(session_id, num_bytes)
+            self._usage[session_id] = self._usage.get(session_id, 0) + num_bytes
+
+    def release(self, session_id: str, num_bytes: int):
+        """Devuelve la reserva de una consulta que falló o no escaneó bytes nuevos."""
+        with self._lock:
+            self._unreserve(session_id, num_bytes)
+
+    def session_usage(self, session_id: str) -> int:
+        with self._lock:
+            return self._usage.get(session_id, 0)
+
+    def reset_session(self, session_id: str):
+        with self._lock:
+            self._usage.pop(session_id, None)
+            self._reserved.pop(session_id, None)
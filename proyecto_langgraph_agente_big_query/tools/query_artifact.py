@@ -0,0 +1,102 @@
+# tools/query_artifact.py
+
+import re
+
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import tool
+
+from tools.artifacts import HANDLE_PREFIX, get_artifact_store
+from tools.backends import DuckDBBackend
+from tools.result_format import serialize_result
+from tools.result_stream import RESULT_PAGE_SIZE, stream_batches
+from tools.run_sql_query import cancel_scope_from_config, session_id_from_config, tool_metadata
+from tools.sql_validation import format_validation_errors, validate_sql
+from instrumentation import record_query, span
+
+# Nombres de artefactos que aparecen en el SQL (r_ seguido de 12 dígitos hexadecimales)
+_HANDLE_RE = re.compile(rf"\b{HANDLE_PREFIX}[0-9a-f]{{12}}\b")
+
+# Las consultas sobre artefactos son locales: un tiempo límite corto basta
+LOCAL_QUERY_TIMEOUT_SECONDS = 30
+
+
+def _artefactos_disponibles(store, session_id: str) -> str:
+    recent = store.recent(session_id)
+    if not recent:
+        return "No hay resultados guardados en esta sesión."
+    return "Resultados guardados disponibles:\n" + "\n".join(
+        f"- {info.describe()}" for info in recent
+    )
+
+
+# Tool para LangChain - Consultas locales (DuckDB) sobre resultados guardados en Parquet
+@tool(response_format="content_and_artifact")
+def query_result_artifact(query: str, config: RunnableConfig):
+    """
+    Ejecuta una consulta SQL localmente sobre resultados guardados por `run_sql_query`
+    (tablas con nombres como `r_0123456789ab`), sin volver a BigQuery ni escanear bytes.
+    Úsala para preguntas de seguimiento: filtrar, ordenar o agregar un resultado anterior.
+
+    Args:
+        query: Una consulta SELECT que usa los artefactos como tablas, por ejemplo
+            `SELECT * FROM r_0123456789ab WHERE usertype = 'Subscriber' ORDER BY 2 DESC`.
+
+    Returns:
+        El resultado en el mismo formato que `run_sql_query` o un mensaje de error
+        (incluye la lista de artefactos disponibles si el nombre no existe).
+    """
+    with span("tool:query_result_artifact", query=query) as attributes:
+        contenido, metadatos = _query_result_artifact(
+            query, session_id_from_config(config), cancel_scope_from_config(config)
+        )
+        attributes.update(metadatos)
+    record_query(attributes["duration_s"], metadatos, tool="query_result_artifact")
+    return contenido, metadatos
+
+
+def _query_result_artifact(query: str, session_id: str, cancel_scope=None):
+    store = get_artifact_store()
+    if store is None:
+        contenido = "Los resultados guardados están desactivados (ARTIFACTS_ENABLED=false)."
+        return contenido, tool_metadata(estado="error")
+
+    handles = list(dict.fromkeys(_HANDLE_RE.findall(query)))
+    if not handles:
+        return (
+            "La consulta no usa ningún resultado guardado. "
+            + _artefactos_disponibles(store, session_id),
+            tool_metadata(estado="invalida"),
+        )
+
+    artifacts = {}
+    for handle in handles:
+        info = store.get(handle)
+        if info is None:
+            return (
+                f"El resultado `{handle}` no existe o se borró para liberar espacio. "
+                "Vuelve a ejecutar la consulta original con run_sql_query y save_result=true. "
+                + _artefactos_disponibles(store, session_id),
+                tool_metadata(estado="invalida"),
+            )
+        artifacts[handle] = info
+
+    # Misma validación local que el SQL de BigQuery, con el esquema de los artefactos
+    schema = {
+        handle: {column.lower(): type_ for column, type_ in info.columns.items()}
+        for handle, info in artifacts.items()
+    }
+    errors = validate_sql(query, schema)
+    if errors:
+        return format_validation_errors(errors), tool_metadata(estado="invalida", errores=errors)
+
+    try:
+        backend = DuckDBBackend(table_map={handle: info.path for handle, info in artifacts.items()})
+        reader = backend.execute(
+            query, RESULT_PAGE_SIZE, timeout_seconds=LOCAL_QUERY_TIMEOUT_SECONDS, cancel_scope=cancel_scope
+        )
+        payload = stream_batches(reader).to_payload()
+    except Exception as e:
+        return f"Error al ejecutar la consulta local: {e}", tool_metadata(estado="error")
+
+    contenido = f"[Local: {', '.join(handles)}]\n" + serialize_result(payload)
+    return contenido, tool_metadata(payload, artefacto=handles[0])
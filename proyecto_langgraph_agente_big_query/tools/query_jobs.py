@@ -0,0 +1,481 @@
+# tools/query_jobs.py
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional
+
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import tool
+
+from tools.run_sql_query import execute_sql_query, session_id_from_config, tool_metadata
+from instrumentation import metrics, record_query, span
+
+# ============================================
+# 1. CONFIGURACIÓN DE LOS TRABAJOS EN SEGUNDO PLANO
+# ============================================
+
+# Todos los valores se pueden sobreescribir desde el archivo .env
+# QUERY_JOBS_ENABLED=false quita las tools submit_query_job / get_query_job
+QUERY_JOBS_ENABLED = os.getenv("QUERY_JOBS_ENABLED", "true").lower() in ("1", "true", "yes")
+QUERY_JOBS_DB_PATH = os.getenv(
+    "QUERY_JOBS_DB_PATH", str(Path(__file__).parent.parent / ".cache" / "query_jobs.sqlite")
+)
+# Consultas en segundo plano que se ejecutan a la vez en este proceso
+QUERY_JOBS_WORKERS = int(os.getenv("QUERY_JOBS_WORKERS", "2"))
+# Los trabajos terminados se borran después de este tiempo
+QUERY_JOBS_TTL_HOURS = float(os.getenv("QUERY_JOBS_TTL_HOURS", "24"))
+# Tiempo máximo de una consulta en segundo plano (BigQuery la cancela al superarlo);
+# es más largo que QUERY_TIMEOUT_SECONDS porque este camino existe para las consultas pesadas
+QUERY_JOBS_TIMEOUT_SECONDS = float(os.getenv("QUERY_JOBS_TIMEOUT_SECONDS", "3600"))
+# Cuánto espera get_query_job a que termine el trabajo antes de responder "en curso"
+QUERY_JOB_POLL_WAIT_SECONDS = float(os.getenv("QUERY_JOB_POLL_WAIT_SECONDS", "15"))
+
+# El proceso que tiene un trabajo (en su cola o ejecutándose) renueva `updated_at`
+# cada JOB_HEARTBEAT_SECONDS; sin latido durante ORPHAN_AFTER_SECONDS, ese proceso
+# murió y el trabajo se reencola
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "15"))
+ORPHAN_AFTER_SECONDS = 4 * JOB_HEARTBEAT_SECONDS
+
+# Prefijo de los identificadores: j_<12 hex>
+JOB_PREFIX = "j_"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# ============================================
+# 2. ALMACÉN PERSISTENTE Y POOL DE WORKERS
+# ============================================
+
+@dataclass
+class QueryJob:
+    """
+    Una consulta enviada a segundo plano.
+
+    Attributes:
+        id: Identificador (`j_...`). Cualquier sesión que lo conozca puede leer el resultado.
+        session_id: Sesión que envió el trabajo (para listarlo en su interfaz).
+        status: "queued", "running", "done" (hay resultado, aunque sea un error del SQL) o "failed".
+        content: El texto que devuelve `run_sql_query` para el modelo (None hasta terminar).
+        metadata: Los metadatos de la ejecución (filas, caché, artefacto...).
+    """
+    id: str
+    session_id: str
+    query: str
+    save_result: bool
+    approximate: Optional[bool]
+    status: str
+    submitted_at: float
+    updated_at: float
+    started_at: float = None
+    finished_at: float = None
+    content: str = None
+    metadata: dict = None
+    error: str = None
+    # Dueño actual: "<pid>-<proceso>:<reclamo>" del proceso que lo tiene en cola o lo ejecuta
+    owner: str = None
+
+    @property
+    def elapsed(self) -> float:
+        """Segundos desde que se envió (o que tardó, si ya terminó)."""
+        return (self.finished_at or time.time()) - self.submitted_at
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "elapsed": round(self.elapsed, 1)}
+
+
+_COLUMNS = (
+    "id", "session_id", "query", "save_result", "approximate", "status", "submitted_at",
+    "updated_at", "started_at", "finished_at", "content", "metadata", "error", "owner",
+)
+
+
+def _row_to_job(row) -> QueryJob:
+    values = dict(zip(_COLUMNS, row))
+    values["save_result"] = bool(values["save_result"])
+    values["approximate"] = None if values["approximate"] is None else bool(values["approximate"])
+    values["metadata"] = json.loads(values["metadata"]) if values["metadata"] else None
+    return QueryJob(**values)
+
+
+class QueryJobStore:
+    """
+    Trabajos de consulta guardados en SQLite y ejecutados por un pool de hilos
+    (daemon) del proceso. Como el estado y el resultado quedan en disco, un
+    rerun de Streamlit, otra sesión u otro proceso que comparta el archivo
+    pueden consultar el trabajo.
+
+    Cada trabajo tiene un dueño (`owner`): el proceso que lo tiene en su cola
+    o lo ejecuta, con un token nuevo por cada reclamo. Mientras lo tiene, un
+    hilo de latido renueva `updated_at`; solo los trabajos sin latido se
+    reencolan. Reclamar, reencolar y guardar el resultado son UPDATE
+    condicionales al dueño, así un trabajo recuperado y el original nunca
+    escriben los dos.
+    """
+
+    def __init__(self, db_path: str = QUERY_JOBS_DB_PATH, workers: int = QUERY_JOBS_WORKERS):
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._finished = threading.Condition()
+        # Identifica a este almacén en este proceso (el pid solo podría reutilizarse)
+        self._process = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # Trabajos que este proceso tiene en cola o ejecutándose: {job_id: owner}
+        self._held = {}
+        self._heartbeat = None
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    save_result INTEGER NOT NULL,
+                    approximate INTEGER,
+                    status TEXT NOT NULL,
+                    submitted_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    content TEXT,
+                    metadata TEXT,
+                    error TEXT
+                )
+                """
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_session ON jobs (session_id, submitted_at)")
+            # Archivos creados antes de que existiera la columna del dueño
+            if "owner" not in {row[1] for row in db.execute("PRAGMA table_info(jobs)")}:
+                db.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _new_owner(self) -> str:
+        return f"{self._process}:{uuid.uuid4().hex[:8]}"
+
+    def _start_workers(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                worker = threading.Thread(target=self._work, daemon=True, name="query-job-worker")
+                worker.start()
+                self._threads.append(worker)
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._beat, daemon=True, name="query-job-heartbeat")
+                self._heartbeat.start()
+
+    def _work(self):
+        while True:
+            self._run(*self._queue.get())
+
+    def _beat(self):
+        """Renueva `updated_at` de los trabajos de este proceso (en cola o ejecutándose)."""
+        while True:
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+            with self._lock:
+                held = list(self._held.items())
+            if not held:
+                continue
+            try:
+                with self._connect() as db:
+                    db.executemany(
+                        "UPDATE jobs SET updated_at = ? WHERE id = ? AND owner = ? AND status IN (?, ?)",
+                        [(time.time(), job_id, owner, QUEUED, RUNNING) for job_id, owner in held],
+                    )
+            except sqlite3.Error as e:
+                print(f"⚠️ No se pudo renovar el latido de los trabajos: {e}")
+
+    def submit(
+        self, query: str, session_id: str, save_result: bool = False, approximate: bool = None
+    ) -> QueryJob:
+        """Guarda el trabajo como "queued" y lo pone en la cola de los workers."""
+        now = time.time()
+        job = QueryJob(
+            id=JOB_PREFIX + uuid.uuid4().hex[:12],
+            session_id=session_id,
+            query=query,
+            save_result=save_result,
+            approximate=approximate,
+            status=QUEUED,
+            submitted_at=now,
+            updated_at=now,
+            owner=self._new_owner(),
+        )
+        with self._connect() as db:
+            db.execute(
+                f"INSERT INTO jobs ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                (
+                    job.id, job.session_id, job.query, int(save_result),
+                    None if approximate is None else int(approximate),
+                    job.status, job.submitted_at, job.updated_at, None, None, None, None, None,
+                    job.owner,
+                ),
+            )
+            db.execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                (now - QUERY_JOBS_TTL_HOURS * 3600,),
+            )
+        self._enqueue(job.id, job.owner)
+        metrics.inc("agent_query_jobs_total", help="Trabajos de consulta enviados a segundo plano")
+        return job
+
+    def _enqueue(self, job_id: str, owner: str) -> bool:
+        """Pone el trabajo en la cola de este proceso (False si ya lo tenía)."""
+        self._start_workers()
+        with self._lock:
+            if job_id in self._held:
+                return False
+            self._held[job_id] = owner
+        self._queue.put((job_id, owner))
+        return True
+
+    def _release(self, job_id: str, owner: str):
+        with self._lock:
+            if self._held.get(job_id) == owner:
+                del self._held[job_id]
+
+    def _claim(self, job_id: str, queued_by: str):
+        """
+        Marca el trabajo como "running" con un token de reclamo nuevo, si sigue en
+        cola y a nombre de esta entrada de la cola (None si otro proceso lo recuperó).
+        """
+        now = time.time()
+        owner = self._new_owner()
+        with self._connect() as db:
+            claimed = db.execute(
+                "UPDATE jobs SET status = ?, owner = ?, started_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = ? AND owner = ?",
+                (RUNNING, owner, now, now, job_id, QUEUED, queued_by),
+            ).rowcount
+            row = db.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if not claimed or row is None:
+            return None
+        with self._lock:
+            self._held[job_id] = owner
+        return _row_to_job(row)
+
+    def _run(self, job_id: str, queued_by: str):
+        try:
+            job = self._claim(job_id, queued_by)
+        finally:
+            self._release(job_id, queued_by)
+        if job is None:
+            return
+        try:
+            self._execute(job)
+        finally:
+            self._release(job.id, job.owner)
+        with self._finished:
+            self._finished.notify_all()
+
+    def _execute(self, job: QueryJob):
+        """Ejecuta la consulta y guarda el resultado (solo si el trabajo sigue siendo de este reclamo)."""
+        config = {"configurable": {"thread_id": job.session_id}}
+        status, content, metadata, error = DONE, None, None, None
+        try:
+            with span("job:query", job=job.id, query=job.query) as attributes:
+                content, metadata = execute_sql_query(
+                    job.query, config, job.save_result, job.approximate,
+                    timeout_seconds=QUERY_JOBS_TIMEOUT_SECONDS,
+                )
+                attributes.update(metadata)
+            record_query(attributes["duration_s"], metadata, tool="query_job")
+        except Exception as e:
+            status, error = FAILED, str(e)
+        now = time.time()
+        with self._connect() as db:
+            # Solo el dueño del reclamo guarda el resultado: si el trabajo se recuperó
+            # en otro proceso mientras tanto, este resultado se descarta
+            db.execute(
+                "UPDATE jobs SET status = ?, content = ?, metadata = ?, error = ?, "
+                "finished_at = ?, updated_at = ? WHERE id = ? AND owner = ?",
+                (status, content, json.dumps(metadata, default=str) if metadata else None,
+                 error, now, now, job.id, job.owner),
+            )
+
+    def _recover_orphans(self):
+        """
+        Reencola los trabajos (en cola o "en curso") cuyo dueño dejó de renovar el
+        latido: el proceso que los tenía ya no existe. Los que tiene este proceso
+        no se tocan.
+        """
+        limit = time.time() - ORPHAN_AFTER_SECONDS
+        with self._lock:
+            held = set(self._held)
+        with self._connect() as db:
+            stale = [
+                row for row in db.execute(
+                    "SELECT id, owner FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                    (QUEUED, RUNNING, limit),
+                )
+                if row[0] not in held
+            ]
+            recovered = []
+            for job_id, previous_owner in stale:
+                owner = self._new_owner()
+                if db.execute(
+                    "UPDATE jobs SET status = ?, owner = ?, updated_at = ? "
+                    "WHERE id = ? AND updated_at < ? AND owner IS ?",
+                    (QUEUED, owner, time.time(), job_id, limit, previous_owner),
+                ).rowcount:
+                    recovered.append((job_id, owner))
+        for job_id, owner in recovered:
+            self._enqueue(job_id, owner)
+
+    def get(self, job_id: str):
+        """El trabajo con ese ID (None si no existe o ya expiró)."""
+        self._recover_orphans()
+        with self._connect() as db:
+            row = db.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row_to_job(row) if row is not None else None
+
+    def wait(self, job_id: str, timeout: float = QUERY_JOB_POLL_WAIT_SECONDS):
+        """
+        Espera hasta `timeout` segundos a que el trabajo termine y lo devuelve
+        (terminado o no). Revisa el archivo cada medio segundo, así también ve
+        trabajos que ejecuta otro proceso.
+        """
+        deadline = time.monotonic() + timeout
+        job = self.get(job_id)
+        while job is not None and job.status in (QUEUED, RUNNING):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            with self._finished:
+                self._finished.wait(min(0.5, remaining))
+            job = self.get(job_id)
+        return job
+
+    def queue_position(self, job: QueryJob) -> int:
+        """Trabajos en cola enviados antes que `job` (0 si ya está corriendo o terminó)."""
+        if job.status != QUEUED:
+            return 0
+        with self._connect() as db:
+            return db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND submitted_at < ?",
+                (QUEUED, job.submitted_at),
+            ).fetchone()[0]
+
+    def list(self, session_id: str, limit: int = 10) -> list:
+        """Los últimos trabajos de una sesión (el más reciente primero)."""
+        self._recover_orphans()
+        with self._connect() as db:
+            rows = db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE session_id = ? "
+                "ORDER BY submitted_at DESC LIMIT ?",
+                (session_id, limit),
+            ).fetchall()
+        return [_row_to_job(row) for row in rows]
+
+
+# Instancia global (lazy loading)
+_job_store = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store():
+    """Obtiene el almacén global de trabajos, o None si está desactivado por configuración."""
+    global _job_store
+    if not QUERY_JOBS_ENABLED:
+        return None
+    with _job_store_lock:
+        if _job_store is None:
+            _job_store = QueryJobStore()
+    return _job_store
+
+# ============================================
+# 3. TOOLS PARA EL AGENTE
+# ============================================
+
+def describe_job(job: QueryJob, store: QueryJobStore) -> str:
+    """Estado de un trabajo en una línea (para el modelo y la interfaz)."""
+    if job.status == QUEUED:
+        return f"[Trabajo {job.id}: en cola, {store.queue_position(job)} antes; enviado hace {job.elapsed:.0f} s]"
+    if job.status == RUNNING:
+        return f"[Trabajo {job.id}: ejecutándose hace {time.time() - job.started_at:.0f} s]"
+    if job.status == FAILED:
+        return f"[Trabajo {job.id}: falló después de {job.elapsed:.0f} s: {job.error}]"
+    return f"[Trabajo {job.id}: listo en {job.elapsed:.0f} s]"
+
+
+# Tool para LangChain - Envía una consulta pesada a segundo plano
+@tool(response_format="content_and_artifact")
+def submit_query_job(
+    query: str,
+    config: RunnableConfig,
+    save_result: bool = False,
+    approximate: Optional[bool] = None,
+):
+    """
+    Envía una consulta SQL de BigQuery para ejecutarla en segundo plano y devuelve
+    enseguida un ID de trabajo (`j_...`). Úsala para consultas pesadas (toda la tabla
+    con muchos grupos, JOINs o funciones de ventana) o cuando el usuario pide un
+    análisis largo: la conversación no queda bloqueada mientras BigQuery trabaja.
+    Después usa `get_query_job` con el ID para obtener el resultado.
+
+    Args:
+        query: La consulta SQL completa (mismo formato que en `run_sql_query`).
+        save_result: Igual que en `run_sql_query`: guarda el resultado como tabla local.
+        approximate: Igual que en `run_sql_query`.
+
+    Returns:
+        El ID del trabajo y su estado.
+    """
+    with span("tool:submit_query_job", query=query) as attributes:
+        store = get_job_store()
+        if store is None:
+            contenido = "Los trabajos en segundo plano están desactivados; usa run_sql_query."
+            return contenido, tool_metadata(estado="error")
+        job = store.submit(query, session_id_from_config(config), save_result, approximate)
+        attributes["job"] = job.id
+    contenido = (
+        f"{describe_job(job, store)}\nLa consulta se está ejecutando en segundo plano. "
+        f"Usa get_query_job con job_id=\"{job.id}\" para obtener el resultado."
+    )
+    return contenido, tool_metadata(estado="enviada", trabajo=job.id)
+
+
+# Tool para LangChain - Estado o resultado de un trabajo en segundo plano
+@tool(response_format="content_and_artifact")
+def get_query_job(job_id: str, config: RunnableConfig):
+    """
+    Devuelve el resultado de un trabajo enviado con `submit_query_job` (en el mismo
+    formato que `run_sql_query`) o, si todavía no terminó, su estado. Espera unos
+    segundos a que termine antes de responder.
+
+    Args:
+        job_id: El ID del trabajo (`j_...`), de esta conversación o de otra.
+
+    Returns:
+        El resultado de la consulta o el estado del trabajo. Si sigue en curso, dile
+        al usuario que el resultado estará listo pronto y que puede pedirlo más tarde
+        con ese ID; no vuelvas a consultar en el mismo turno.
+    """
+    with span("tool:get_query_job", job=job_id):
+        store = get_job_store()
+        job = store.wait(job_id.strip()) if store is not None else None
+    if job is None:
+        return f"No existe el trabajo {job_id} (o ya expiró).", tool_metadata(estado="invalida")
+    if job.status == DONE:
+        return (
+            describe_job(job, store) + "\n" + job.content,
+            {**(job.metadata or {}), "trabajo": job.id},
+        )
+    if job.status == FAILED:
+        return describe_job(job, store), tool_metadata(estado="error", trabajo=job.id)
+    return (
+        describe_job(job, store) + "\nTodavía no terminó. No vuelvas a consultar en este turno: "
+        f"avisa al usuario que el resultado estará listo pronto (trabajo {job.id}).",
+        tool_metadata(estado="en_curso", trabajo=job.id),
+    )
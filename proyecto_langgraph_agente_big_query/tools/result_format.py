@@ -0,0 +1,169 @@
+# tools/result_format.py
+
+import csv
+import datetime
+import decimal
+import io
+import os
+
+# ============================================
+# 1. CONFIGURACIÓN DEL FORMATO
+# ============================================
+
+# Todos los valores se pueden sobreescribir desde el archivo .env
+# Presupuesto (aproximado) de tokens del resultado que recibe el LLM
+RESULT_TOKEN_BUDGET = int(os.getenv("RESULT_TOKEN_BUDGET", "1500"))
+# Dígitos significativos de los números decimales
+RESULT_FLOAT_DIGITS = int(os.getenv("RESULT_FLOAT_DIGITS", "6"))
+# Máximo de caracteres por celda de texto (las más largas se recortan con "…")
+RESULT_MAX_CELL_CHARS = int(os.getenv("RESULT_MAX_CELL_CHARS", "80"))
+
+# Aproximación habitual para texto mixto en los tokenizadores de OpenAI
+CHARS_PER_TOKEN = 4
+
+# ============================================
+# 2. FORMATO COMPACTO DE VALORES
+# ============================================
+
+def estimate_tokens(text: str) -> int:
+    """Estimación barata del número de tokens de un texto (sin cargar un tokenizador)."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def format_value(value, float_digits: int = RESULT_FLOAT_DIGITS, max_chars: int = RESULT_MAX_CELL_CHARS) -> str:
+    """
+    Convierte un valor en texto corto: floats redondeados a `float_digits` cifras
+    significativas, fechas sin microsegundos ni hora 00:00:00 y textos recortados.
+    Los decimales son exactos (SUM y COUNT de DuckDB llegan como decimal128(38,0)):
+    los enteros se muestran completos y el resto sin notación científica.
+    Los nulos quedan como celda vacía.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, decimal.Decimal) and value.is_finite():
+        if value == value.to_integral_value():
+            return str(int(value))
+        return format(value.normalize(), "f")
+    if isinstance(value, (float, decimal.Decimal)):
+        text = f"{float(value):.{float_digits}g}"
+        return text[:-2] if text.endswith(".0") else text
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        if value.time() == datetime.time():
+            return value.date().isoformat()
+        return value.isoformat(sep=" ", timespec="seconds")
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    text = str(value)
+    if len(text) > max_chars:
+        text = text[: max_chars - 1] + "…"
+    return text
+
+
+def _csv_line(values) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="").writerow(values)
+    return buffer.getvalue()
+
+
+def _row_line(row) -> str:
+    return _csv_line(format_value(value) for value in row)
+
+
+def _summary_lines(columns: list, stats: list) -> list:
+    """Una línea por columna con las estadísticas del resultado completo."""
+    lines = []
+    for column, column_stats in zip(columns, stats):
+        parts = [f"no_nulos={column_stats.get('no_nulos')}"]
+        if column_stats.get("nulos"):
+            parts.append(f"nulos={column_stats['nulos']}")
+        for key in ("min", "max", "media"):
+            if column_stats.get(key) is not None:
+                parts.append(f"{key}={format_value(column_stats[key])}")
+        lines.append(f"{column}: " + " ".join(parts))
+    return lines
+
+
+# ============================================
+# 3. SERIALIZACIÓN CON PRESUPUESTO DE TOKENS
+# ============================================
+
+def serialize_result(payload: dict, token_budget: int = RESULT_TOKEN_BUDGET) -> str:
+    """
+    Convierte el resultado de una consulta en texto compacto para el LLM sin pasar
+    de `token_budget` tokens (aproximados).
+
+    El formato es CSV con un encabezado tipado (`columna:TIPO`). Si no caben todas
+    las filas, se muestran las primeras y las últimas, una línea que indica cuántas
+    se omitieron y un resumen por columna calculado sobre todas las filas.
+
+    Args:
+        payload: Resultado devuelto por `StreamedResult.to_payload()` (o la caché).
+        token_budget: Máximo aproximado de tokens del texto devuelto.
+    """
+    columns = payload["columns"]
+    head = payload["rows"]
+    total_rows = payload.get("total_rows", len(head))
+    if total_rows == 0:
+        return "La consulta se ejecutó correctamente, pero no devolvió resultados."
+
+    types = payload.get("types") or []
+    tail = payload.get("tail_rows") or []
+    header = _csv_line(
+        f"{column}:{types[i]}" if i < len(types) else column for i, column in enumerate(columns)
+    )
+
+    # Caso simple: todas las filas caben en el presupuesto
+    if not payload.get("truncated") and len(head) == total_rows:
+        lines = [header] + [_row_line(row) for row in head]
+        text = "\n".join(lines)
+        if estimate_tokens(text) <= token_budget:
+            return f"filas: {total_rows}\n{text}"
+
+    # El resumen se calcula primero: sin él el LLM no sabe nada de lo omitido
+    summary = ["resumen (todas las filas):"] + _summary_lines(columns, payload.get("stats") or [])
+    used = estimate_tokens(header) + estimate_tokens("\n".join(summary)) + 30
+
+    # Filas conocidas en orden (las primeras y, sin repetir, las últimas). Se toman
+    # alternando desde el principio y desde el final mientras quepan en el presupuesto
+    known = list(head) + list(tail)
+    head_lines, tail_lines = [], []
+    front, back = 0, len(known) - 1
+    front_open = True
+    # Sin cola (p. ej. resultados antiguos de la caché) el final es desconocido
+    back_open = bool(tail) or len(head) == total_rows
+    while front <= back and (front_open or back_open):
+        for from_front in (True, False):
+            if front > back or not (front_open if from_front else back_open):
+                continue
+            line = _row_line(known[front] if from_front else known[back])
+            cost = estimate_tokens(line) + 1
+            if used + cost > token_budget:
+                if from_front:
+                    front_open = False
+                else:
+                    back_open = False
+                continue
+            used += cost
+            if from_front:
+                head_lines.append(line)
+                front += 1
+            else:
+                tail_lines.append(line)
+                back -= 1
+    tail_lines.reverse()
+
+    shown = len(head_lines) + len(tail_lines)
+    omitted = total_rows - shown
+    lines = [f"filas: {total_rows} (se muestran {shown}, se omiten {omitted})", header]
+    lines += head_lines
+    if omitted:
+        if tail_lines:
+            lines.append(f"… {omitted} filas omitidas (las siguientes son las últimas) …")
+        else:
+            lines.append(f"… {omitted} filas omitidas …")
+    lines += tail_lines
+    return "\n".join(lines + summary)
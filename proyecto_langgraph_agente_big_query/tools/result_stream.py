@@ -0,0 +1,197 @@
+# tools/result_stream.py
+
+import os
+from collections import deque
+from dataclasses import dataclass, field
+
+# pyarrow se importa dentro de cada función: importar el agente no debe cargarlo
+
+# ============================================
+# 1. CONFIGURACIÓN DEL STREAMING
+# ============================================
+
+# Todos los valores se pueden sobreescribir desde el archivo .env
+# RESULT_PAGE_SIZE es el tamaño de cada lote (filas por página del backend)
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "1000"))
+RESULT_MAX_ROWS = int(os.getenv("RESULT_MAX_ROWS", "200"))
+RESULT_MAX_BYTES = int(os.getenv("RESULT_MAX_BYTES", str(64 * 1024)))
+# Últimas filas del resultado que se conservan además de las primeras (head/tail)
+RESULT_TAIL_ROWS = int(os.getenv("RESULT_TAIL_ROWS", "20"))
+
+# ============================================
+# 2. ESTADÍSTICAS INCREMENTALES
+# ============================================
+
+def _is_numeric_type(arrow_type) -> bool:
+    import pyarrow as pa
+
+    return (
+        pa.types.is_integer(arrow_type)
+        or pa.types.is_floating(arrow_type)
+        or pa.types.is_decimal(arrow_type)
+    )
+
+
+class ColumnStats:
+    """
+    Estadísticas de una columna calculadas lote por lote (memoria constante):
+    valores no nulos, y mínimo / máximo / media si la columna es numérica.
+    """
+
+    def __init__(self, arrow_type):
+        self.is_numeric = _is_numeric_type(arrow_type)
+        self.count = 0
+        self.nulls = 0
+        self.minimum = None
+        self.maximum = None
+        self._sum = 0.0
+
+    def update(self, array):
+        """Actualiza las estadísticas con una columna (pyarrow.Array) de un lote."""
+        nulls = array.null_count
+        self.nulls += nulls
+        self.count += len(array) - nulls
+        if not self.is_numeric or len(array) == nulls:
+            return
+        import pyarrow.compute as pc
+
+        # Los cálculos se hacen en Arrow (vectorizados), sin convertir a Python
+        min_max = pc.min_max(array)
+        minimum = float(min_max["min"].as_py())
+        maximum = float(min_max["max"].as_py())
+        self._sum += float(pc.sum(array).as_py())
+        self.minimum = minimum if self.minimum is None else min(self.minimum, minimum)
+        self.maximum = maximum if self.maximum is None else max(self.maximum, maximum)
+
+    @property
+    def mean(self):
+        return self._sum / self.count if self.count else None
+
+    def to_dict(self) -> dict:
+        stats = {"no_nulos": self.count, "nulos": self.nulls}
+        if self.is_numeric:
+            stats.update(min=self.minimum, max=self.maximum, media=self.mean)
+        return stats
+
+
+def type_name(arrow_type) -> str:
+    """Nombre corto (estilo BigQuery) de un tipo de Arrow, para los encabezados."""
+    import pyarrow as pa
+
+    if pa.types.is_integer(arrow_type):
+        return "INT64"
+    if pa.types.is_floating(arrow_type):
+        return "FLOAT64"
+    if pa.types.is_decimal(arrow_type):
+        return "NUMERIC"
+    if pa.types.is_boolean(arrow_type):
+        return "BOOL"
+    if pa.types.is_timestamp(arrow_type):
+        return "TIMESTAMP"
+    if pa.types.is_date(arrow_type):
+        return "DATE"
+    if pa.types.is_time(arrow_type):
+        return "TIME"
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return "STRING"
+    return str(arrow_type).upper()
+
+
+# ============================================
+# 3. LECTURA POR LOTES DE ARROW
+# ============================================
+
+@dataclass
+class StreamedResult:
+    """
+    Resultado de una consulta leída en streaming: solo se conservan las primeras
+    filas (hasta los límites de filas y bytes) y las últimas (`tail_rows`, sin
+    repetir las primeras), pero `total_rows` y `stats` cubren el resultado completo.
+    """
+    columns: list
+    rows: list = field(default_factory=list)
+    total_rows: int = 0
+    truncated: bool = False
+    stats: list = field(default_factory=list)
+    types: list = field(default_factory=list)
+    tail_rows: list = field(default_factory=list)
+
+    def to_payload(self) -> dict:
+        """Diccionario serializable (el formato que guarda la caché de resultados)."""
+        return {
+            "columns": self.columns,
+            "rows": self.rows,
+            "total_rows": self.total_rows,
+            "truncated": self.truncated,
+            "stats": self.stats,
+            "types": self.types,
+            "tail_rows": self.tail_rows,
+        }
+
+
+def _row_size(row) -> int:
+    """Tamaño aproximado de una fila una vez convertida a texto."""
+    return sum(len(str(value)) for value in row) + len(row)
+
+
+def stream_batches(
+    reader,
+    max_rows: int = RESULT_MAX_ROWS,
+    max_bytes: int = RESULT_MAX_BYTES,
+    tail_rows: int = RESULT_TAIL_ROWS,
+    on_batch=None,
+) -> StreamedResult:
+    """
+    Consume un `pyarrow.RecordBatchReader` lote por lote.
+
+    Guarda como máximo `max_rows` filas (o `max_bytes` de texto) para mostrar al
+    LLM, y sigue consumiendo el resto solo para actualizar el conteo y las
+    estadísticas, así que la memoria usada no depende del tamaño del resultado.
+
+    Args:
+        reader: Lector de lotes devuelto por un backend (ver `tools/backends.py`).
+        max_rows: Máximo de filas que se conservan.
+        max_bytes: Máximo de bytes (aproximados, como texto) que se conservan.
+        tail_rows: Cuántas de las últimas filas se conservan además de las primeras.
+        on_batch: Función opcional que recibe cada lote completo (p. ej. para
+            guardar el resultado entero en Parquet mientras se lee).
+    """
+    schema = reader.schema
+    column_stats = [ColumnStats(field.type) for field in schema]
+    result = StreamedResult(
+        columns=list(schema.names), types=[type_name(field.type) for field in schema]
+    )
+    kept_bytes = 0
+    tail = deque(maxlen=tail_rows)
+
+    for batch in reader:
+        result.total_rows += batch.num_rows
+        if on_batch is not None:
+            on_batch(batch)
+        for stats, array in zip(column_stats, batch.columns):
+            stats.update(array)
+        if tail_rows > 0:
+            # Solo las últimas filas de cada lote pueden terminar en la cola
+            last = batch.slice(max(batch.num_rows - tail_rows, 0))
+            tail.extend(zip(*(array.to_pylist() for array in last.columns)))
+        if result.truncated:
+            continue
+
+        # Solo se convierten a Python las filas que todavía caben en la vista previa
+        candidates = batch.slice(0, max_rows - len(result.rows))
+        for row in zip(*(array.to_pylist() for array in candidates.columns)):
+            size = _row_size(row)
+            if kept_bytes + size > max_bytes:
+                result.truncated = True
+                break
+            result.rows.append(row)
+            kept_bytes += size
+        if len(result.rows) < result.total_rows:
+            result.truncated = True
+
+    result.stats = [stats.to_dict() for stats in column_stats]
+    # La cola no debe repetir filas que ya están entre las primeras
+    first_tail_index = result.total_rows - len(tail)
+    overlap = max(len(result.rows) - first_tail_index, 0)
+    result.tail_rows = list(tail)[overlap:]
+    return result
@@ -0,0 +1,454 @@
+# tools/rollups.py
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+from tools.backends import BIGQUERY_TABLE, DuckDBBackend, export_to_parquet
+
+# ============================================
+# 1. CONFIGURACIÓN DE LOS ROLLUPS
+# ============================================
+
+# Todos los valores se pueden sobreescribir desde el archivo .env
+# ROLLUPS_ENABLED=false desactiva el enrutamiento (todas las consultas van al backend)
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "true").lower() in ("1", "true", "yes")
+ROLLUPS_DIR = os.getenv("ROLLUPS_DIR", str(Path(__file__).parent.parent / ".cache" / "rollups"))
+# Construir / actualizar los rollups al arrancar y cada cuántos segundos (0 = nunca)
+ROLLUPS_REFRESH_ON_STARTUP = os.getenv("ROLLUPS_REFRESH_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+ROLLUPS_REFRESH_INTERVAL_SECONDS = float(os.getenv("ROLLUPS_REFRESH_INTERVAL_SECONDS", "0"))
+
+# Columna de tiempo que marca hasta dónde está cubierta la tabla (actualización incremental)
+WATERMARK_COLUMN = "starttime"
+
+# Nombre (estilo BigQuery) con el que las consultas reescritas leen cada rollup
+ROLLUP_DATASET = "rollups"
+
+
+@dataclass(frozen=True)
+class RollupSpec:
+    """
+    Un rollup: la tabla de viajes agregada por `dimensions` (nombre -> expresión
+    SQL sobre la tabla original) con las medidas de MEASURES.
+    """
+    name: str
+    dimensions: tuple
+
+    @property
+    def dimension_names(self) -> set:
+        return {name for name, _ in self.dimensions}
+
+    @property
+    def table_name(self) -> str:
+        return f"{ROLLUP_DATASET}.rollup_{self.name}"
+
+
+# Dimensiones de las preguntas más frecuentes (ruta más popular, tipo de usuario,
+# género, año de nacimiento, día y hora de inicio)
+ROLLUP_SPECS = (
+    RollupSpec("rutas", (
+        ("start_station_name", "start_station_name"),
+        ("end_station_name", "end_station_name"),
+    )),
+    RollupSpec("usuarios", (
+        ("usertype", "usertype"),
+        ("gender", "gender"),
+        ("birth_year", "birth_year"),
+    )),
+    RollupSpec("tiempo", (
+        ("fecha", f"DATE({WATERMARK_COLUMN})"),
+        ("hora", f"EXTRACT(HOUR FROM {WATERMARK_COLUMN})"),
+        ("dia_semana", f"EXTRACT(DAYOFWEEK FROM {WATERMARK_COLUMN})"),
+        ("usertype", "usertype"),
+    )),
+)
+
+# Medidas de cada rollup: todas se pueden volver a agregar sin perder exactitud
+# (conteos y sumas se suman; mínimos y máximos se combinan)
+MEASURES = (
+    ("viajes", "COUNT(*)", "SUM"),
+    ("n_tripduration", "COUNT(tripduration)", "SUM"),
+    ("sum_tripduration", "SUM(tripduration)", "SUM"),
+    ("min_tripduration", "MIN(tripduration)", "MIN"),
+    ("max_tripduration", "MAX(tripduration)", "MAX"),
+)
+MEASURE_NAMES = {name for name, _, _ in MEASURES}
+
+# ============================================
+# 2. ENRUTADOR: CONSULTA -> ROLLUP
+# ============================================
+
+# Partes de EXTRACT(... FROM starttime) que se calculan igual desde la fecha
+_DATE_PARTS = {"YEAR", "MONTH", "DAY", "QUARTER"}
+# Partes que tienen su propia dimensión en el rollup de tiempo
+_TIME_DIMENSIONS = {"HOUR": "hora", "DAYOFWEEK": "dia_semana"}
+
+
+@dataclass
+class RoutedQuery:
+    """Consulta reescrita para responderse desde un rollup local."""
+    sql: str
+    rollup: str
+    table_name: str
+
+
+# sqlglot se importa dentro de cada función: importar el agente no debe cargarlo
+
+def _is_column(node, name: str) -> bool:
+    from sqlglot import exp
+
+    return isinstance(node, exp.Column) and node.name.lower() == name
+
+
+def _map_time_expressions(statement):
+    """DATE(starttime) -> fecha; EXTRACT(HOUR / DAYOFWEEK / YEAR... FROM starttime) -> dimensiones."""
+    from sqlglot import exp
+
+    for node in list(statement.find_all(exp.Date, exp.Extract)):
+        if isinstance(node, exp.Date) and _is_column(node.this, WATERMARK_COLUMN) and not node.expressions:
+            node.replace(exp.column("fecha"))
+        elif isinstance(node, exp.Extract) and _is_column(node.expression, WATERMARK_COLUMN):
+            part = node.name.upper()
+            if part in _TIME_DIMENSIONS:
+                node.replace(exp.column(_TIME_DIMENSIONS[part]))
+            elif part in _DATE_PARTS:
+                node.set("expression", exp.column("fecha"))
+
+
+def _integer(sql: str) -> str:
+    # En DuckDB, SUM de un BIGINT devuelve HUGEINT (decimal128 en Arrow): los conteos
+    # y sumas se devuelven como INT64, igual que en BigQuery
+    return f"CAST({sql} AS INT64)"
+
+
+def _aggregate_sql(aggregate, dimensions: set):
+    """
+    SQL equivalente de un agregado sobre las filas de un rollup (None si no se
+    puede calcular de forma exacta).
+    """
+    from sqlglot import exp
+
+    argument = aggregate.this
+    is_dimension = isinstance(argument, exp.Column) and argument.name.lower() in dimensions
+    is_duration = _is_column(argument, "tripduration")
+
+    if isinstance(aggregate, exp.Count):
+        if isinstance(argument, exp.Star) or (isinstance(argument, exp.Literal) and not argument.is_string):
+            return _integer("COALESCE(SUM(viajes), 0)")
+        if is_duration:
+            return _integer("COALESCE(SUM(n_tripduration), 0)")
+        if is_dimension:
+            return _integer(f"COALESCE(SUM(IF({argument.name} IS NOT NULL, viajes, 0)), 0)")
+        if isinstance(argument, exp.Distinct) and len(argument.expressions) == 1:
+            inner = argument.expressions[0]
+            if isinstance(inner, exp.Column) and inner.name.lower() in dimensions:
+                return aggregate.sql(dialect="bigquery")
+        return None
+    if isinstance(aggregate, exp.CountIf):
+        # La condición solo puede usar dimensiones (se revisa junto con el resto de columnas)
+        return _integer(f"COALESCE(SUM(IF({argument.sql(dialect='bigquery')}, viajes, 0)), 0)")
+    if isinstance(aggregate, exp.ApproxDistinct) and is_dimension:
+        return aggregate.sql(dialect="bigquery")
+    if isinstance(aggregate, (exp.Min, exp.Max)):
+        if is_dimension:
+            return aggregate.sql(dialect="bigquery")
+        if is_duration:
+            function = "MIN" if isinstance(aggregate, exp.Min) else "MAX"
+            return f"{function}({function.lower()}_tripduration)"
+        return None
+    if isinstance(aggregate, exp.Sum) and is_duration:
+        return _integer("SUM(sum_tripduration)")
+    if isinstance(aggregate, exp.Avg) and is_duration:
+        return "SAFE_DIVIDE(SUM(sum_tripduration), SUM(n_tripduration))"
+    return None
+
+
+def route_query(query: str, specs, rows_by_rollup: dict) -> RoutedQuery:
+    """
+    Decide si la consulta se puede responder de forma exacta desde un rollup y,
+    si es así, la reescribe para leerlo. Devuelve None si no se puede.
+
+    Se enrutan las agregaciones de un solo SELECT sobre la tabla de viajes (sin
+    JOIN, subconsultas ni funciones de ventana) cuyas columnas son todas
+    dimensiones de un rollup y cuyos agregados (COUNT, COUNTIF, SUM/AVG/MIN/MAX
+    de tripduration, conteos de distintos de una dimensión) se pueden recalcular
+    desde sus medidas. Se elige el rollup más pequeño que sirva.
+
+    Args:
+        query: Consulta en el dialecto de BigQuery.
+        specs: Rollups disponibles (RollupSpec).
+        rows_by_rollup: Filas de cada rollup, para elegir el más pequeño.
+    """
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.errors import ParseError
+
+    try:
+        statement = sqlglot.parse_one(query, read="bigquery")
+    except ParseError:
+        return None
+    if not isinstance(statement, exp.Select) or statement.args.get("with"):
+        return None
+    if len(list(statement.find_all(exp.Select))) > 1 or statement.args.get("joins"):
+        return None
+    tables = list(statement.find_all(exp.Table))
+    if len(tables) != 1 or tables[0].args.get("sample"):
+        return None
+    table_name = ".".join(p for p in (tables[0].catalog, tables[0].db, tables[0].name) if p)
+    if table_name.lower() != BIGQUERY_TABLE or statement.find(exp.Window):
+        return None
+    # Solo agregaciones: una consulta fila por fila no se puede responder desde un rollup
+    aggregates = list(statement.find_all(exp.AggFunc))
+    if not aggregates and not statement.args.get("group"):
+        return None
+    if any(not isinstance(star.parent, exp.Count) for star in statement.find_all(exp.Star)):
+        return None
+
+    _map_time_expressions(statement)
+    all_dimensions = set().union(*(spec.dimension_names for spec in specs))
+    for aggregate in aggregates:
+        sql = _aggregate_sql(aggregate, all_dimensions)
+        if sql is None:
+            return None
+        aggregate.replace(sqlglot.parse_one(sql, read="bigquery"))
+
+    aliases = {alias.alias.lower() for alias in statement.find_all(exp.Alias)}
+    needed = set()
+    for column in statement.find_all(exp.Column):
+        name = column.name.lower()
+        # Una sola tabla: se quitan los calificadores (t.usertype -> usertype)
+        column.set("table", None)
+        if name in all_dimensions:
+            needed.add(name)
+        elif name not in MEASURE_NAMES and name not in aliases:
+            return None
+
+    candidates = [spec for spec in specs if needed <= spec.dimension_names]
+    if not candidates:
+        return None
+    spec = min(candidates, key=lambda s: rows_by_rollup.get(s.name, float("inf")))
+    alias = tables[0].alias
+    tables[0].replace(exp.to_table(spec.table_name, alias=alias or None))
+    return RoutedQuery(sql=statement.sql(dialect="bigquery"), rollup=spec.name, table_name=spec.table_name)
+
+# ============================================
+# 3. CONSTRUCCIÓN Y ACTUALIZACIÓN INCREMENTAL
+# ============================================
+
+def _timestamp_text(value) -> str:
+    """Instante en UTC y sin zona ("2016-12-13 05:16:28"), como se guarda en el manifiesto."""
+    if getattr(value, "tzinfo", None) is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(sep=" ")
+
+
+def _timestamp_literal(value) -> str:
+    """Literal TIMESTAMP (UTC) válido en BigQuery y en DuckDB."""
+    return f"TIMESTAMP '{_timestamp_text(value)}'"
+
+
+def _parse_ts(value):
+    """Marca de agua guardada en el manifiesto -> datetime (o None)."""
+    return datetime.fromisoformat(value) if value else None
+
+
+def _delta_sql(spec: RollupSpec, low, high) -> str:
+    """Agregación de las filas nuevas (low < starttime <= high) en el backend de origen."""
+    dimensions = ", ".join(f"{expression} AS {name}" for name, expression in spec.dimensions)
+    measures = ", ".join(f"{expression} AS {name}" for name, expression, _ in MEASURES)
+    upper = f"{WATERMARK_COLUMN} <= {_timestamp_literal(high)}"
+    if low is None:
+        # La primera construcción incluye también las filas sin fecha de inicio
+        where = f"({upper} OR {WATERMARK_COLUMN} IS NULL)"
+    else:
+        where = f"{WATERMARK_COLUMN} > {_timestamp_literal(low)} AND {upper}"
+    group_by = ", ".join(str(i) for i in range(1, len(spec.dimensions) + 1))
+    return (
+        f"SELECT {dimensions}, {measures} FROM `{BIGQUERY_TABLE}` "
+        f"WHERE {where} GROUP BY {group_by}"
+    )
+
+
+def _merge_sql(spec: RollupSpec, sources: list, target: str) -> str:
+    """COPY de DuckDB que combina el rollup actual con las filas nuevas."""
+    dimensions = ", ".join(name for name, _ in spec.dimensions)
+    measures = ", ".join(
+        f"CAST({function}({name}) AS BIGINT) AS {name}" for name, _, function in MEASURES
+    )
+    union = " UNION ALL BY NAME ".join(f"SELECT * FROM read_parquet('{path}')" for path in sources)
+    return (
+        f"COPY (SELECT {dimensions}, {measures} FROM ({union}) GROUP BY {dimensions}) "
+        f"TO '{target}' (FORMAT parquet)"
+    )
+
+
+class RollupStore:
+    """
+    Rollups locales en Parquet (uno por RollupSpec) y un manifiesto JSON con el
+    origen de los datos (namespace del backend), la marca de agua (`starttime`
+    más reciente incluido) y las filas de cada rollup.
+
+    `refresh` agrega en el backend de origen solo las filas posteriores a la marca
+    de agua y las combina con el rollup local; `route` reescribe las consultas
+    que se pueden responder desde un rollup para ejecutarlas en DuckDB.
+    """
+
+    def __init__(self, directory: str = ROLLUPS_DIR, specs=ROLLUP_SPECS):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.specs = specs
+        self._manifest_path = self.directory / "manifest.json"
+        self._refresh_lock = threading.Lock()
+        self._backend_lock = threading.Lock()
+        self._backend = None
+        self._manifest = self._load_manifest()
+
+    # --- manifiesto ---
+
+    def _load_manifest(self) -> dict:
+        try:
+            return json.loads(self._manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, manifest: dict):
+        tmp_path = self._manifest_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=2, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self._manifest_path)
+        self._manifest = manifest
+
+    def _path(self, spec: RollupSpec) -> Path:
+        return self.directory / f"{spec.name}.parquet"
+
+    def describe(self) -> dict:
+        """Estado de los rollups (namespace, marca de agua, filas y fecha de cada uno)."""
+        return dict(self._manifest)
+
+    # --- actualización ---
+
+    def refresh(self, backend, full: bool = False) -> dict:
+        """
+        Construye o actualiza los rollups desde `backend` (una consulta de agregación
+        por rollup, solo sobre las filas nuevas). Con `full=True`, o si cambió el
+        origen de los datos, los reconstruye desde cero.
+
+        Las filas nuevas con una fecha de inicio anterior a la marca de agua (o
+        sin fecha) solo se incorporan con una reconstrucción completa.
+
+        Returns:
+            El manifiesto actualizado.
+        """
+        with self._refresh_lock:
+            manifest = self._load_manifest()
+            namespace = backend.cache_namespace()
+            if full or manifest.get("namespace") != namespace:
+                manifest = {"namespace": namespace, "watermark": None, "rollups": {}}
+            low = manifest.get("watermark")
+
+            where = f" WHERE {WATERMARK_COLUMN} > {_timestamp_literal(_parse_ts(low))}" if low else ""
+            high_query = f"SELECT MAX({WATERMARK_COLUMN}) AS high FROM `{BIGQUERY_TABLE}`{where}"
+            high = backend.execute(high_query, 1).read_all().column(0)[0].as_py()
+            if high is None:
+                return manifest
+
+            import duckdb
+
+            connection = duckdb.connect(database=":memory:")
+            for spec in self.specs:
+                started = time.perf_counter()
+                path = self._path(spec)
+                delta_path = self.directory / f"{spec.name}.delta.parquet"
+                tmp_path = self.directory / f"{spec.name}.tmp.parquet"
+                export_to_parquet(backend, _delta_sql(spec, _parse_ts(low), high), str(delta_path))
+                sources = [str(delta_path)]
+                if low is not None and path.exists():
+                    sources.insert(0, str(path))
+                connection.execute(_merge_sql(spec, sources, str(tmp_path)))
+                os.replace(tmp_path, path)
+                delta_path.unlink(missing_ok=True)
+                rows = connection.execute(
+                    f"SELECT COUNT(*) FROM read_parquet('{path}')"
+                ).fetchone()[0]
+                manifest["rollups"][spec.name] = {
+                    "rows": rows,
+                    "refreshed_at": time.time(),
+                    "seconds": round(time.perf_counter() - started, 3),
+                }
+            connection.close()
+            manifest["watermark"] = _timestamp_text(high)
+            self._save_manifest(manifest)
+            with self._backend_lock:
+                self._backend = None
+            return manifest
+
+    # --- enrutamiento ---
+
+    def _available_specs(self, namespace: str) -> list:
+        manifest = self._manifest
+        if manifest.get("namespace") != namespace:
+            return []
+        built = manifest.get("rollups", {})
+        return [spec for spec in self.specs if spec.name in built and self._path(spec).exists()]
+
+    def route(self, query: str, namespace: str) -> RoutedQuery:
+        """Consulta reescrita sobre un rollup construido para `namespace` (None si no aplica)."""
+        specs = self._available_specs(namespace)
+        if not specs:
+            return None
+        rows = {name: info.get("rows", 0) for name, info in self._manifest["rollups"].items()}
+        return route_query(query, specs, rows)
+
+    def backend(self) -> DuckDBBackend:
+        """Backend DuckDB con una vista por rollup (se vuelve a crear tras cada actualización)."""
+        with self._backend_lock:
+            if self._backend is None:
+                specs = self._available_specs(self._manifest.get("namespace"))
+                self._backend = DuckDBBackend(
+                    table_map={spec.table_name: str(self._path(spec)) for spec in specs}
+                )
+            return self._backend
+
+    def note(self, routed: RoutedQuery) -> str:
+        """Línea para el modelo: de qué rollup salió el resultado y hasta qué fecha cubre."""
+        return (
+            f"[Rollup local: {routed.rollup} (exacto, sin consultar BigQuery; datos hasta "
+            f"{self._manifest.get('watermark')})]\n"
+        )
+
+
+# Instancia global (lazy loading)
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_rollup_store():
+    """Obtiene el almacén global de rollups, o None si están desactivados (ROLLUPS_ENABLED=false)."""
+    global _store
+    if not ROLLUPS_ENABLED:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = RollupStore()
+    return _store
+
+# ============================================
+# 4. LÍNEA DE COMANDOS
+# ============================================
+
+if __name__ == "__main__":
+    # python -m tools.rollups [--full]
+    import sys
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    from tools.run_sql_query import get_backend
+
+    # La configuración del módulo se leyó antes de load_dotenv
+    store = RollupStore(os.getenv("ROLLUPS_DIR", ROLLUPS_DIR))
+    summary = store.refresh(get_backend(), full="--full" in sys.argv)
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
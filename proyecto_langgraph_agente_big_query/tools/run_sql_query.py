@@ -1,11 +1,40 @@
 # tools/run_sql_query.py
 
-from sqlalchemy import create_engine, text
-from google.cloud import bigquery
-from google.cloud.bigquery import dbapi
-import pandas as pd
+import os
+import threading
+import time
+from typing import Optional
+
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
 
+from tools.backends import (
+    DUCKDB_PARQUET_PATH,
+    SQL_BACKEND,
+    BigQueryBackend,
+    CancelScope,
+    DuckDBBackend,
+)
+from tools.approximate import (
+    APPROX_DESIGN_EFFECT,
+    approximate_mode,
+    error_bound_note,
+    rewrite_approximate,
+)
+from tools.artifacts import ARTIFACTS_AUTO_SPILL, artifact_handle, get_artifact_store
+from tools.cost_guard import COST_GUARD_ENABLED, CostGuard
+from tools.result_format import serialize_result
+from tools.result_stream import RESULT_PAGE_SIZE, stream_batches
+from tools.rollups import (
+    ROLLUPS_REFRESH_INTERVAL_SECONDS,
+    ROLLUPS_REFRESH_ON_STARTUP,
+    get_rollup_store,
+)
+from tools.single_flight import SingleFlight
+from tools.sql_cache import canonicalize_sql, get_sql_cache, rename_columns
+from instrumentation import record_query, span
+from rate_limit import ProviderUnavailable, bigquery_scheduler
+
 # --- Configuración de conexión a BigQuery ---
 # Reemplaza con tu propio ID de proyecto de Google Cloud
 TU_PROYECTO_GCP_ID = "project-ai-487701" #****************************************************************************************
@@ -13,10 +42,38 @@ TU_PROYECTO_GCP_ID = "project-ai-487701" #**************************************
 # bigquery://<dataset>/<table>
 db_uri = "bigquery://bigquery-public-data/new_york_citibike"
 
-# Variable global para el engine (lazy loading)
+# Tiempo máximo de ejecución de una consulta (el backend la cancela al superarlo)
+QUERY_TIMEOUT_SECONDS = float(os.getenv("QUERY_TIMEOUT_SECONDS", "120"))
+
+# Pool de conexiones de SQLAlchemy (configurable desde el .env)
+BQ_POOL_SIZE = int(os.getenv("BQ_POOL_SIZE", "5"))
+BQ_MAX_OVERFLOW = int(os.getenv("BQ_MAX_OVERFLOW", "10"))
+BQ_POOL_RECYCLE_SECONDS = int(os.getenv("BQ_POOL_RECYCLE_SECONDS", "1800"))
+BQ_POOL_TIMEOUT_SECONDS = float(os.getenv("BQ_POOL_TIMEOUT_SECONDS", "30"))
+# pool_pre_ping ejecuta un SELECT 1 (un job de BigQuery) en cada checkout: desactivado por defecto
+BQ_POOL_PRE_PING = os.getenv("BQ_POOL_PRE_PING", "false").lower() in ("1", "true", "yes")
+# Calentamiento al arrancar: crea el cliente y abre N conexiones antes del primer usuario
+BQ_WARMUP_ON_STARTUP = os.getenv("BQ_WARMUP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+BQ_WARMUP_CONNECTIONS = int(os.getenv("BQ_WARMUP_CONNECTIONS", "2"))
+# Single-flight: consultas idénticas (mismo SQL canónico) en curso al mismo tiempo
+# comparten una sola ejecución en el backend
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Clave de `configurable` con el CancelScope de la tool call (lo pone el grafo asíncrono
+# para cancelar la consulta en el backend si se supera el tiempo límite)
+CANCEL_SCOPE_KEY = "cancel_scope"
+
+# Variables globales para el cliente, el engine, el backend y la guardia de costo (lazy loading)
+_client = None
 _engine = None
+_backend = None
+_cost_guard = None
+_init_lock = threading.RLock()
+_warmup_thread = None
+_rollup_thread = None
+_in_flight = SingleFlight("sql")
 
-def get_bigquery_connection():
+def create_bigquery_client():
     """
     Inicializa el cliente de BigQuery con nuestro proyecto.
     Soporta autenticación via:
@@ -25,6 +82,9 @@ def get_bigquery_connection():
     """
     import os
     from pathlib import Path
+    # El SDK de Google Cloud (y pandas, que trae con él) se importa solo al crear
+    # el cliente: importar este módulo no debe pagar ese costo
+    from google.cloud import bigquery
     
     # Si hay un archivo de credenciales especificado
     credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
@@ -48,7 +108,28 @@ def get_bigquery_connection():
             )
     
     # Crear cliente de BigQuery (usará las credenciales configuradas)
-    client = bigquery.Client(project=TU_PROYECTO_GCP_ID)
+    return bigquery.Client(project=TU_PROYECTO_GCP_ID)
+
+def get_bigquery_client():
+    """
+    Obtiene el cliente de BigQuery compartido por todo el proceso. Crearlo implica
+    resolver credenciales y abrir la sesión HTTP, así que se hace una sola vez y
+    lo reutilizan todas las conexiones del pool y el dry run.
+    """
+    global _client
+    if _client is None:
+        with _init_lock:
+            if _client is None:
+                _client = create_bigquery_client()
+    return _client
+
+def get_bigquery_connection():
+    """
+    Crea una conexión DB-API de BigQuery para el pool de SQLAlchemy.
+    """
+    from google.cloud.bigquery import dbapi
+
+    client = get_bigquery_client()
     
     # Creamos y devolvemos la conexión DB-API compatible con SQLAlchemy
     connection = dbapi.connect(client=client)
@@ -61,42 +142,450 @@ def get_engine():
     """
     global _engine
     if _engine is None:
-        _engine = create_engine(db_uri, creator=get_bigquery_connection)
+        from sqlalchemy import create_engine, event
+
+        with _init_lock:
+            if _engine is None:
+                engine = create_engine(
+                    db_uri,
+                    creator=get_bigquery_connection,
+                    pool_size=BQ_POOL_SIZE,
+                    max_overflow=BQ_MAX_OVERFLOW,
+                    pool_recycle=BQ_POOL_RECYCLE_SECONDS,
+                    pool_timeout=BQ_POOL_TIMEOUT_SECONDS,
+                    pool_pre_ping=BQ_POOL_PRE_PING,
+                )
+                event.listen(engine, "checkout", _check_pooled_connection)
+                _engine = engine
     return _engine
+
+def _check_pooled_connection(dbapi_connection, connection_record, connection_proxy):
+    """
+    Revisión barata de cada conexión que sale del pool (sin ejecutar consultas):
+    si la conexión DB-API ya está cerrada, el pool la descarta y abre otra.
+    """
+    if getattr(dbapi_connection, "_closed", False):
+        from sqlalchemy import exc
+
+        raise exc.DisconnectionError("Conexión de BigQuery cerrada; se reemplaza.")
+
+def warmup_backend(connections: int = BQ_WARMUP_CONNECTIONS):
+    """
+    Calienta el backend antes de la primera pregunta: crea el cliente compartido
+    (credenciales + sesión HTTP) y deja `connections` conexiones abiertas en el pool.
+    """
+    get_backend().warmup(connections)
+
+def start_warmup():
+    """
+    Lanza `warmup_backend` en un hilo en segundo plano (una sola vez por proceso)
+    para no bloquear el arranque de la interfaz. No hace nada si BQ_WARMUP_ON_STARTUP=false.
+    """
+    global _warmup_thread
+    with _init_lock:
+        if _warmup_thread is not None or not BQ_WARMUP_ON_STARTUP:
+            return _warmup_thread
+        _warmup_thread = threading.Thread(target=_warmup_silently, daemon=True)
+        _warmup_thread.start()
+    return _warmup_thread
+
+def _warmup_silently():
+    # Un fallo al calentar (credenciales, red) no debe tumbar la app: la primera
+    # consulta volverá a intentarlo y mostrará el error al usuario
+    try:
+        warmup_backend()
+    except Exception as e:
+        print(f"⚠️ No se pudo calentar el backend: {e}")
+
+def start_rollup_refresh():
+    """
+    Construye / actualiza los rollups locales en un hilo en segundo plano (una sola
+    vez por proceso) si ROLLUPS_REFRESH_ON_STARTUP=true, y luego cada
+    ROLLUPS_REFRESH_INTERVAL_SECONDS segundos si se configuró.
+    """
+    global _rollup_thread
+    with _init_lock:
+        if _rollup_thread is not None or not ROLLUPS_REFRESH_ON_STARTUP or get_rollup_store() is None:
+            return _rollup_thread
+        _rollup_thread = threading.Thread(target=_refresh_rollups_forever, daemon=True)
+        _rollup_thread.start()
+    return _rollup_thread
+
+def _refresh_rollups_forever():
+    while True:
+        try:
+            get_rollup_store().refresh(get_backend())
+        except Exception as e:
+            print(f"⚠️ No se pudieron actualizar los rollups: {e}")
+        if ROLLUPS_REFRESH_INTERVAL_SECONDS <= 0:
+            return
+        time.sleep(ROLLUPS_REFRESH_INTERVAL_SECONDS)
+
+def get_backend():
+    """
+    Obtiene el motor de ejecución configurado con SQL_BACKEND:
+    - "bigquery" (por defecto): BigQuery a través del engine de SQLAlchemy.
+    - "duckdb": copia local de la tabla en Parquet (DUCKDB_PARQUET_PATH).
+    """
+    global _backend
+    if _backend is None:
+        with _init_lock:
+            if _backend is None and SQL_BACKEND == "duckdb":
+                _backend = DuckDBBackend(DUCKDB_PARQUET_PATH)
+            elif _backend is None:
+                _backend = BigQueryBackend(get_engine, get_bigquery_client, db_uri)
+    return _backend
+
+def get_cost_guard():
+    """
+    Obtiene la guardia de costo (dry run + presupuesto de bytes), o None si está
+    desactivada con COST_GUARD_ENABLED=false o si el backend no tiene costo (local).
+    """
+    global _cost_guard
+    if not COST_GUARD_ENABLED:
+        return None
+    if _cost_guard is None:
+        with _init_lock:
+            estimator = get_backend().create_estimator() if _cost_guard is None else None
+            if estimator is not None:
+                _cost_guard = CostGuard(estimator)
+    return _cost_guard
+
+def session_id_from_config(config: RunnableConfig) -> str:
+    """Identificador de la sesión del usuario, tomado del `thread_id` de la ejecución."""
+    configurable = (config or {}).get("configurable", {})
+    return str(configurable.get("thread_id", "default"))
+
+def cancel_scope_from_config(config: RunnableConfig) -> Optional[CancelScope]:
+    """CancelScope de la tool call (None si quien la llama no puede cancelarla)."""
+    return (config or {}).get("configurable", {}).get(CANCEL_SCOPE_KEY)
 # -----------------------------------------------------------
 
 
-# Tool para LangChain - Ejecuta consultas SQL en BigQuery
-@tool
-def run_sql_query_langchain(query: str) -> str:
+def _ejecutar_consulta(
+    query: str,
+    artifact: dict = None,
+    backend=None,
+    timeout_seconds: float = QUERY_TIMEOUT_SECONDS,
+    cancel_scope: CancelScope = None,
+):
+    """
+    Ejecuta la consulta en el backend configurado y consume el resultado en lotes
+    de Arrow, con memoria acotada. Devuelve un diccionario serializable para poder
+    guardarlo en la caché y, si se pidió `artifact`, la información del artefacto
+    Parquet con el resultado completo (o None si no se guardó).
+
+    Args:
+        query: La consulta SQL.
+        artifact: {"handle", "session_id", "save"} para escribir el resultado en
+            Parquet mientras se lee. Con "save" en False solo se conserva si el
+            resultado no cupo completo en el mensaje (ARTIFACTS_AUTO_SPILL).
+        backend: Backend local alternativo (p. ej. los rollups); por defecto, `get_backend()`.
+        timeout_seconds: Tiempo máximo de la consulta en el backend.
+        cancel_scope: Permite cancelar la consulta desde otro hilo (ver `CancelScope`).
+    """
+    # Las consultas locales (rollups) no ocupan cupo ni pasan por los límites del proveedor
+    if backend is not None:
+        return _leer_consulta(backend, query, artifact, timeout_seconds, cancel_scope)
+
+    # Límite de jobs por minuto, de jobs simultáneos (BIGQUERY_MAX_CONCURRENT_JOBS: el cupo
+    # se mantiene mientras se leen los lotes, que es cuando corre el job) y reintentos de
+    # errores pasajeros de BigQuery (rateLimitExceeded, backendError, 5xx); los errores
+    # del SQL se propagan sin reintentar
+    return bigquery_scheduler.call(
+        lambda: _leer_consulta(get_backend(), query, artifact, timeout_seconds, cancel_scope)
+    )
+
+
+def _leer_consulta(
+    backend,
+    query: str,
+    artifact: dict = None,
+    timeout_seconds: float = QUERY_TIMEOUT_SECONDS,
+    cancel_scope: CancelScope = None,
+):
+    """Un intento de `_ejecutar_consulta` en `backend`."""
+    # Una tool call ya cancelada no lanza otro intento (p. ej. un reintento del scheduler)
+    if cancel_scope is not None:
+        cancel_scope.raise_if_cancelled()
+    reader = backend.execute(
+        query, RESULT_PAGE_SIZE, timeout_seconds=timeout_seconds, cancel_scope=cancel_scope
+    )
+    if artifact is None:
+        return stream_batches(reader).to_payload(), None
+
+    store = get_artifact_store()
+    writer = store.open_writer(artifact["handle"], reader.schema)
+    try:
+        result = stream_batches(reader, on_batch=writer.write)
+    except Exception:
+        writer.abort()
+        raise
+    if artifact["save"] or result.truncated:
+        info = store.register(artifact["handle"], writer, query, artifact["session_id"])
+    else:
+        writer.abort()
+        info = None
+    return result.to_payload(), info
+
+
+def _ejecutar_compartida(
+    query: str,
+    artifact: dict = None,
+    timeout_seconds: float = QUERY_TIMEOUT_SECONDS,
+    cancel_scope: CancelScope = None,
+):
+    """
+    `_ejecutar_consulta` con single-flight: si ya hay una ejecución en curso del
+    mismo SQL canónico (p. ej. varios usuarios con la misma pregunta de ejemplo),
+    se espera su resultado en lugar de lanzar otro job. Si esa ejecución falla,
+    el error se propaga a todas las que la esperaban (también si se cancela: la
+    cancelación de la líder llega a las que esperaban, con el mismo tiempo límite).
+
+    Returns:
+        Tupla (payload, info del artefacto, compartida).
+    """
+    if not SINGLE_FLIGHT_ENABLED:
+        payload, info = _ejecutar_consulta(
+            query, artifact, timeout_seconds=timeout_seconds, cancel_scope=cancel_scope
+        )
+        return payload, info, False
+
+    canonical, aliases = canonicalize_sql(query)
+    # Pedir el artefacto explícitamente cambia el resultado (siempre se registra),
+    # así que no se mezcla con ejecuciones que no lo piden. Tampoco se mezclan tiempos
+    # límite distintos: un trabajo en segundo plano no hereda el límite de una consulta inline
+    save = bool(artifact and artifact["save"])
+    key = (get_backend().cache_namespace(), canonical, artifact is not None, save, timeout_seconds)
+
+    def ejecutar():
+        payload, info = _ejecutar_consulta(
+            query, artifact, timeout_seconds=timeout_seconds, cancel_scope=cancel_scope
+        )
+        return payload, info, aliases
+
+    (payload, info, leader_aliases), compartida = _in_flight.do(key, ejecutar)
+    if compartida:
+        # Mismo SQL canónico con otros alias: se renombran las columnas como en la caché
+        payload = rename_columns(dict(payload, aliases=leader_aliases), aliases)
+        payload.pop("aliases", None)
+    return payload, info, compartida
+
+
+def _consultar_rollup(query: str, save_result: bool, session_id: str):
+    """
+    Si la consulta se puede responder de forma exacta desde un rollup local, la
+    ejecuta ahí (milisegundos, sin BigQuery). Devuelve (contenido, metadatos), o
+    None para seguir por el camino normal (también si el rollup falla).
+    """
+    store = get_rollup_store()
+    if store is None:
+        return None
+    routed = store.route(query, get_backend().cache_namespace())
+    if routed is None:
+        return None
+    artifact, _ = _artifact_request(query, save_result, session_id)
+    try:
+        payload, info = _ejecutar_consulta(routed.sql, artifact, backend=store.backend())
+    except Exception as e:
+        print(f"⚠️ Falló la consulta sobre el rollup {routed.rollup}, se usa el backend: {e}")
+        return None
+    contenido = store.note(routed) + _formatear_resultado(payload)
+    if info is not None:
+        contenido += _nota_artefacto(info)
+    return contenido, tool_metadata(
+        payload, rollup=routed.rollup, artefacto=info.handle if info is not None else None
+    )
+
+
+def _artifact_request(query: str, save_result: bool, session_id: str):
+    """
+    Decide si el resultado se guarda como artefacto Parquet. Devuelve el pedido
+    para `_ejecutar_consulta` (None si no se guarda) y el artefacto ya existente
+    para el mismo SQL, si lo hay.
+    """
+    store = get_artifact_store()
+    if store is None or not (save_result or ARTIFACTS_AUTO_SPILL):
+        return None, None
+    canonical, _ = canonicalize_sql(query)
+    handle = artifact_handle(get_backend().cache_namespace(), canonical)
+    request = {"handle": handle, "session_id": session_id, "save": save_result}
+    return request, store.get(handle)
+
+
+def _nota_artefacto(info) -> str:
+    """Línea para el modelo con el nombre del artefacto y cómo consultarlo."""
+    return (
+        f"\n[Resultado completo guardado como tabla local `{info.handle}` ({info.rows} filas). "
+        "Para filtrarlo, ordenarlo o agregarlo sin volver a BigQuery usa la herramienta "
+        f"query_result_artifact con `FROM {info.handle}`.]"
+    )
+
+
+def _formatear_resultado(payload: dict) -> str:
+    """
+    Convierte el resultado en texto compacto (CSV con tipos) que cabe en el
+    presupuesto de tokens RESULT_TOKEN_BUDGET. Si se recorta, muestra las primeras
+    y últimas filas, cuántas se omitieron y un resumen de todas las columnas.
+    """
+    return serialize_result(payload)
+
+
+def _nota_aproximada(rewrite, payload: dict) -> str:
+    """Línea con la muestra y la cota de error si la consulta se ejecutó en modo aproximado."""
+    return error_bound_note(rewrite, payload) if rewrite is not None else ""
+
+
+def _metadatos_aproximados(rewrite) -> dict:
+    """Metadatos del modo aproximado (vacío si la consulta es exacta)."""
+    if rewrite is None or not rewrite.changed:
+        return {}
+    return {"aproximada": True, "muestra_pct": rewrite.sample_percent}
+
+
+def tool_metadata(payload: dict = None, estado: str = "ok", cache: str = None, **extra) -> dict:
+    """Metadatos estructurados de la ejecución (artifact del ToolMessage, no los ve el LLM)."""
+    metadatos = {"estado": estado, "cache": cache, "filas": None}
+    if payload is not None:
+        metadatos["filas"] = payload.get("total_rows", len(payload["rows"]))
+    metadatos.update(extra)
+    return metadatos
+
+
+# Tool para LangChain - Ejecuta consultas SQL en BigQuery (o en el backend local)
+@tool(response_format="content_and_artifact")
+def run_sql_query_langchain(
+    query: str,
+    config: RunnableConfig,
+    save_result: bool = False,
+    approximate: Optional[bool] = None,
+):
     """
     Ejecuta una consulta SQL en una base de datos de BigQuery que contiene datos de viajes de CitiBike en Nueva York
-    y devuelve el resultado como una tabla formateada. La consulta debe ser compatible
+    y devuelve el resultado como texto compacto (CSV con el tipo de cada columna). La consulta debe ser compatible
     con el dialecto SQL de Google BigQuery.
 
     Args:
         query: La consulta SQL completa a ejecutar en BigQuery.
+        save_result: Si es True, guarda el resultado completo como tabla local (Parquet)
+            para hacer preguntas de seguimiento con `query_result_artifact` sin volver
+            a BigQuery. Los resultados que no caben en la respuesta se guardan siempre.
+        approximate: Si es True, responde de forma aproximada y mucho más rápida: lee una
+            muestra de la tabla (COUNT/SUM escalados al total) y usa APPROX_COUNT_DISTINCT,
+            e informa el error relativo estimado. False fuerza el resultado exacto. Si no
+            se indica, se usa el modo de la sesión.
 
     Returns:
-        El resultado de la consulta como una tabla de texto (Markdown) o un mensaje de error.
+        El resultado como CSV con encabezado `columna:TIPO` o un mensaje de error. Si es
+        muy grande, se muestran las primeras y últimas filas y un resumen por columna.
+        La primera línea indica si el resultado salió de la caché (HIT) o de BigQuery (MISS).
+        Si la consulta supera el presupuesto de bytes escaneados, devuelve un rechazo
+        en JSON con sugerencias para reescribirla. Si el resultado se guardó como
+        artefacto, la última línea indica el nombre de la tabla local. En modo aproximado,
+        una línea `[Aproximado: ...]` indica la muestra y la cota de error.
+    """
+    with span("tool:run_sql_query", query=query) as attributes:
+        contenido, metadatos = execute_sql_query(query, config, save_result, approximate)
+        attributes.update(metadatos)
+    record_query(attributes["duration_s"], metadatos)
+    return contenido, metadatos
+
+
+def execute_sql_query(
+    query: str,
+    config: RunnableConfig,
+    save_result: bool = False,
+    approximate: bool = None,
+    timeout_seconds: float = QUERY_TIMEOUT_SECONDS,
+):
+    """
+    Rollup local -> modo aproximado -> caché -> guardia de costo -> backend (guardando
+    el artefacto Parquet si hace falta). Devuelve (contenido para el LLM, metadatos).
+    La usan la tool `run_sql_query` y los trabajos en segundo plano, que pasan su
+    propio `timeout_seconds` (más largo) para que el backend no cancele la consulta.
     """
     try:
-        # Obtener el engine (lazy loading)
-        engine = get_engine()
-        with engine.connect() as connection:
-            # Usamos text() para asegurar que SQLAlchemy trate el string como SQL literal
-            result_proxy = connection.execute(text(query))
-            
-            # Convertimos el resultado a un DataFrame de Pandas para un formato bonito
-            df = pd.DataFrame(result_proxy.fetchall(), columns=result_proxy.keys())
-            
-            # Si el DataFrame está vacío, devuelve un mensaje
-            if df.empty:
-                return "La consulta se ejecutó correctamente, pero no devolvió resultados."
-            
-            # Convertimos el DataFrame a un string (Markdown) para que el LLM lo pueda leer
-            return df.to_markdown(index=False)
+        session_id = session_id_from_config(config)
+        # Las agregaciones sobre las dimensiones frecuentes se responden desde un
+        # rollup local: son exactas, así que tienen prioridad sobre el modo aproximado
+        routed = _consultar_rollup(query, save_result, session_id)
+        if routed is not None:
+            return routed
+
+        # En modo aproximado se ejecuta (y se cachea) la consulta reescrita
+        rewrite = None
+        if approximate if approximate is not None else approximate_mode(session_id):
+            design_effect = APPROX_DESIGN_EFFECT if get_backend().block_sampling else 1.0
+            rewrite = rewrite_approximate(query, design_effect=design_effect)
+            query = rewrite.sql
+        metadatos_aprox = _metadatos_aproximados(rewrite)
+        artifact, existing = _artifact_request(query, save_result, session_id)
+
+        # Primero buscamos el resultado en la caché (memoria -> disco). Si se pidió
+        # guardarlo y el artefacto ya no existe, hay que volver a ejecutar la consulta
+        cache = get_sql_cache(namespace=get_backend().cache_namespace())
+        cached = cache.get(query) if cache is not None else None
+        if cached is not None and (existing is not None or not save_result):
+            payload, nivel = cached
+            contenido = f"[Caché: HIT ({nivel})]\n" + _nota_aproximada(rewrite, payload)
+            contenido += _formatear_resultado(payload)
+            if existing is not None:
+                contenido += _nota_artefacto(existing)
+            return contenido, tool_metadata(
+                payload,
+                cache=f"HIT ({nivel})",
+                artefacto=existing.handle if existing is not None else None,
+                **metadatos_aprox,
+            )
+
+        # Antes de ejecutar, estimamos los bytes escaneados con un dry run
+        guard = get_cost_guard()
+        bytes_estimados = None
+        if guard is not None:
+            decision = guard.check(query, session_id)
+            bytes_estimados = decision.estimated_bytes
+            if not decision.allowed:
+                return (
+                    decision.to_rejection_message(guard),
+                    tool_metadata(estado="rechazada", bytes_estimados=bytes_estimados, **metadatos_aprox),
+                )
+
+        try:
+            payload, info, compartida = _ejecutar_compartida(
+                query, artifact, timeout_seconds, cancel_scope_from_config(config)
+            )
+        except BaseException:
+            if guard is not None:
+                guard.release(session_id, decision.estimated_bytes)
+            raise
+        # Una ejecución compartida no escaneó bytes nuevos y la líder ya la guardó en la caché
+        if guard is not None:
+            if compartida:
+                guard.release(session_id, decision.estimated_bytes)
+            else:
+                guard.record(session_id, decision.estimated_bytes)
+        if cache is not None and not compartida:
+            cache.put(query, payload)
+        estado = "[Caché: MISS]\n" if cache is not None else ""
+        contenido = estado + _nota_aproximada(rewrite, payload) + _formatear_resultado(payload)
+        if info is not None:
+            contenido += _nota_artefacto(info)
+        return contenido, tool_metadata(
+            payload,
+            cache="MISS" if cache is not None else None,
+            bytes_estimados=bytes_estimados,
+            artefacto=info.handle if info is not None else None,
+            compartida=compartida,
+            **metadatos_aprox,
+        )
 
+    except ProviderUnavailable as e:
+        # No es un error del SQL: el modelo no debe reescribir la consulta
+        return (
+            f"BigQuery no está disponible en este momento ({e.error.kind}), aunque la consulta es "
+            f"válida. No la reescribas: dile al usuario que reintente en unos {e.retry_after} segundos.",
+            tool_metadata(estado="no_disponible"),
+        )
     except Exception as e:
         # Si hay un error de SQL, devuélvelo para que el agente pueda intentar corregirlo.
-        return f"Error al ejecutar la consulta: {e}"
\ No newline at end of file
+        return f"Error al ejecutar la consulta: {e}", tool_metadata(estado="error")
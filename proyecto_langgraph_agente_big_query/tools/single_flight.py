@@ -0,0 +1,78 @@
+# tools/single_flight.py
+
+import threading
+from concurrent.futures import Future
+
+from instrumentation import metrics
+
+# ============================================
+# SINGLE-FLIGHT: UNA EJECUCIÓN POR CLAVE EN CURSO
+# ============================================
+
+class SingleFlight:
+    """
+    Agrupa llamadas idénticas que están en curso al mismo tiempo: la primera
+    (la "líder") ejecuta la función y las demás esperan su resultado en lugar
+    de repetir el trabajo. Si la líder falla, todas reciben la misma excepción.
+
+    El resultado se comparte con un `concurrent.futures.Future` entre hilos.
+    El grafo asíncrono también pasa por aquí: `run_sql_query` no tiene versión
+    asíncrona, así que LangChain ejecuta la tool síncrona en un hilo del
+    executor y cada tool call llama a `do` desde ese hilo.
+    Cuando la ejecución termina, la clave se libera: no es una caché.
+    """
+
+    def __init__(self, name: str = "default"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def _join(self, key):
+        """Devuelve (future, es_líder) para la clave."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            return future, True
+
+    def _finish(self, key, future: Future, result=None, error: BaseException = None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _record_shared(self):
+        metrics.inc(
+            "agent_singleflight_shared_total",
+            help="Ejecuciones evitadas por esperar una idéntica en curso",
+            group=self.name,
+        )
+
+    def do(self, key, fn):
+        """
+        Ejecuta `fn()` una sola vez por clave en curso (versión para hilos).
+
+        Returns:
+            Tupla (resultado, compartido). `compartido` es True si el resultado
+            vino de otra ejecución en curso.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            self._record_shared()
+            return future.result(), True
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result, False
+
+    def in_flight(self) -> int:
+        """Número de claves que se están ejecutando ahora."""
+        with self._lock:
+            return len(self._calls)
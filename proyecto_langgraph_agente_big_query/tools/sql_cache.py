@@ -0,0 +1,374 @@
+# tools/sql_cache.py
+
+import hashlib
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+# ============================================
+# 1. CONFIGURACIÓN DE LA CACHÉ
+# ============================================
+
+# Todos los valores se pueden sobreescribir desde el archivo .env
+SQL_CACHE_ENABLED = os.getenv("SQL_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+SQL_CACHE_TTL_SECONDS = float(os.getenv("SQL_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+SQL_CACHE_MEMORY_ENTRIES = int(os.getenv("SQL_CACHE_MEMORY_ENTRIES", "128"))
+SQL_CACHE_DISK_MAX_BYTES = int(os.getenv("SQL_CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024)))
+SQL_CACHE_DIR = os.getenv(
+    "SQL_CACHE_DIR",
+    str(Path(__file__).parent.parent / ".cache"),
+)
+
+# ============================================
+# 2. CANONICALIZACIÓN DEL SQL
+# ============================================
+
+# Palabras reservadas de BigQuery: nunca pueden ser un alias implícito
+RESERVED_KEYWORDS = {
+    "all", "and", "any", "array", "as", "asc", "assert_rows_modified", "at", "between", "by",
+    "case", "cast", "collate", "contains", "create", "cross", "cube", "current", "default",
+    "define", "desc", "distinct", "else", "end", "enum", "escape", "except", "exclude",
+    "exists", "extract", "false", "fetch", "following", "for", "from", "full", "group",
+    "grouping", "groups", "hash", "having", "if", "ignore", "in", "inner", "intersect",
+    "interval", "into", "is", "join", "lateral", "left", "like", "limit", "lookup", "merge",
+    "natural", "new", "no", "not", "null", "nulls", "of", "offset", "on", "or", "order",
+    "outer", "over", "partition", "preceding", "proto", "qualify", "range", "recursive",
+    "respect", "right", "rollup", "rows", "select", "set", "some", "struct", "tablesample",
+    "then", "to", "treat", "true", "unbounded", "union", "unnest", "using", "when", "where",
+    "window", "with", "within",
+}
+
+# Cláusulas en las que BigQuery permite referenciar un alias de columna ya definido
+_ALIAS_REFERENCE_CLAUSES = {"group", "order", "having", "qualify"}
+_CLAUSE_KEYWORDS = {
+    "select", "from", "where", "group", "order", "having", "qualify", "limit", "window",
+    "join", "on", "using",
+}
+
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<comment>--[^\n]*|\#[^\n]*|/\*.*?\*/)
+    |(?P<string>[rRbB]{0,2}'(?:\\.|[^'\\])*'|[rRbB]{0,2}"(?:\\.|[^"\\])*")
+    |(?P<quoted>`[^`]*`)
+    |(?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)
+    |(?P<word>[A-Za-z_][A-Za-z0-9_]*)
+    |(?P<space>\s+)
+    |(?P<symbol>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def _tokenize(sql: str):
+    """Divide el SQL en tokens (tipo, valor), descartando comentarios y espacios."""
+    tokens = []
+    for match in _TOKEN_RE.finditer(sql):
+        kind = match.lastgroup
+        if kind in ("comment", "space"):
+            continue
+        value = match.group()
+        if kind == "word":
+            value = value.lower()
+        tokens.append((kind, value, match.group()))
+    # Un punto y coma final no cambia la consulta
+    while tokens and tokens[-1][1] == ";":
+        tokens.pop()
+    return tokens
+
+
+def _find_alias_definitions(tokens):
+    """
+    Localiza los alias definidos en la consulta (`AS alias` o alias implícito tras
+    un identificador entre backticks o un paréntesis de cierre).
+
+    Returns:
+        Lista de tuplas (índice del token, profundidad de paréntesis).
+    """
+    definitions = []
+    depth = 0
+    cast_depths = set()
+    for i, (kind, value, _) in enumerate(tokens):
+        if value == "(":
+            depth += 1
+            if i > 0 and tokens[i - 1][1] in ("cast", "safe_cast"):
+                cast_depths.add(depth)
+            continue
+        if value == ")":
+            cast_depths.discard(depth)
+            depth -= 1
+            continue
+        if kind != "word" or value in RESERVED_KEYWORDS or i == 0:
+            continue
+        previous_kind, previous_value, _ = tokens[i - 1]
+        next_value = tokens[i + 1][1] if i + 1 < len(tokens) else None
+        if next_value in (".", "("):
+            continue
+        if previous_value == "as" and depth not in cast_depths:
+            definitions.append((i, depth))
+        elif previous_kind == "quoted" or previous_value == ")":
+            definitions.append((i, depth))
+    return definitions
+
+
+def _alias_is_renamable(tokens, name, definitions):
+    """
+    Un alias solo se renombra si todas sus apariciones son inequívocas: su definición,
+    un prefijo calificado (`alias.columna`) o una referencia posterior en
+    GROUP BY / ORDER BY / HAVING / QUALIFY al mismo nivel de anidamiento.
+    Si el mismo nombre se usa como columna real, se deja tal cual.
+    """
+    definition_positions = {index: depth for index, depth in definitions}
+    first_definition = min(definition_positions)
+    depth = 0
+    clause = None
+    for i, (kind, value, _) in enumerate(tokens):
+        if value == "(":
+            depth += 1
+            continue
+        if value == ")":
+            depth -= 1
+            continue
+        if kind == "word" and value in _CLAUSE_KEYWORDS:
+            clause = value
+        if kind != "word" or value != name or i in definition_positions:
+            continue
+        if i > 0 and tokens[i - 1][1] == ".":
+            return False
+        if i + 1 < len(tokens) and tokens[i + 1][1] == ".":
+            continue
+        if (
+            i > first_definition
+            and clause in _ALIAS_REFERENCE_CLAUSES
+            and depth in definition_positions.values()
+        ):
+            continue
+        return False
+    return True
+
+
+def canonicalize_sql(sql: str):
+    """
+    Normaliza una consulta SQL para usarla como clave de caché.
+
+    Elimina comentarios y diferencias de espacios, pasa a minúsculas las palabras
+    clave e identificadores sin comillas (los literales y los identificadores entre
+    backticks se conservan) y renombra los alias de forma posicional.
+
+    Args:
+        sql: La consulta SQL tal como la escribió el agente.
+
+    Returns:
+        Tupla (sql_canónico, alias) donde `alias` mapea cada marcador `_alias{n}`
+        al nombre original que usó esta consulta.
+    """
+    tokens = _tokenize(sql)
+    definitions = _find_alias_definitions(tokens)
+
+    by_name = OrderedDict()
+    for index, depth in definitions:
+        by_name.setdefault(tokens[index][1], []).append((index, depth))
+
+    renames = {}
+    aliases = {}
+    for name, name_definitions in by_name.items():
+        if _alias_is_renamable(tokens, name, name_definitions):
+            placeholder = f"_alias{len(renames) + 1}"
+            renames[name] = placeholder
+            aliases[placeholder] = tokens[name_definitions[0][0]][2]
+
+    implicit = {index for index, _ in definitions if tokens[index - 1][1] != "as"}
+    parts = []
+    for i, (kind, value, _) in enumerate(tokens):
+        if kind == "word" and value in renames:
+            value = renames[value]
+        if i in implicit:
+            # `count(*) total` y `count(*) AS total` son la misma consulta
+            parts.append("as")
+        parts.append(value)
+
+    canonical = " ".join(parts)
+    # Sin espacios alrededor de la puntuación: "count ( * )" -> "count(*)"
+    canonical = re.sub(r" ?([(),.;\[\]]) ?", r"\1", canonical)
+    return canonical, aliases
+
+
+# ============================================
+# 3. CACHÉ DE RESULTADOS EN DOS NIVELES
+# ============================================
+
+class SQLResultCache:
+    """
+    Caché de resultados de consultas SQL con dos niveles:
+
+    1. Memoria: LRU con un número máximo de entradas.
+    2. Disco: archivo SQLite que sobrevive a reinicios, con límite de tamaño
+       en bytes (se expulsan las entradas usadas hace más tiempo).
+
+    Ambos niveles respetan el mismo TTL. Las claves se calculan sobre el SQL
+    canonicalizado, así que consultas que solo difieren en espacios, mayúsculas
+    o nombres de alias comparten la misma entrada.
+    """
+
+    def __init__(
+        self,
+        directory: str = SQL_CACHE_DIR,
+        ttl_seconds: float = SQL_CACHE_TTL_SECONDS,
+        memory_entries: int = SQL_CACHE_MEMORY_ENTRIES,
+        disk_max_bytes: int = SQL_CACHE_DISK_MAX_BYTES,
+        namespace: str = "",
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.namespace = namespace
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self._db_path = str(Path(directory) / "sql_results.sqlite")
+        with self._connect() as db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    canonical_sql TEXT NOT NULL,
+                    payload BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self._db_path, timeout=30)
+
+    def _key(self, canonical_sql: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\n{canonical_sql}".encode("utf-8")).hexdigest()
+
+    def get(self, query: str):
+        """
+        Busca el resultado de una consulta.
+
+        Returns:
+            Tupla (payload, nivel) con nivel "memoria" o "disco", o None si no hay
+            una entrada vigente. Los nombres de columna del payload ya vienen
+            traducidos a los alias que usa `query`.
+        """
+        canonical, aliases = canonicalize_sql(query)
+        key = self._key(canonical)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, payload = entry
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    return rename_columns(payload, aliases), "memoria"
+                del self._memory[key]
+
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT payload, created_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            blob, created_at = row
+            if now - created_at > self.ttl_seconds:
+                db.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            db.execute("UPDATE results SET last_access = ? WHERE key = ?", (now, key))
+
+        payload = pickle.loads(blob)
+        self._remember(key, created_at, payload)
+        return rename_columns(payload, aliases), "disco"
+
+    def put(self, query: str, payload: dict):
+        """
+        Guarda el resultado de una consulta en ambos niveles.
+
+        Args:
+            query: La consulta SQL original.
+            payload: Diccionario con al menos la clave "columns" (lista de nombres).
+        """
+        canonical, aliases = canonicalize_sql(query)
+        key = self._key(canonical)
+        now = time.time()
+        payload = dict(payload, aliases=aliases)
+        blob = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self._remember(key, now, payload)
+        if len(blob) > self.disk_max_bytes:
+            return
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (key, canonical, blob, len(blob), now, now),
+            )
+            self._evict_disk(db, now)
+
+    def invalidate(self, query: str = None):
+        """Elimina una consulta concreta de la caché, o toda la caché si no se indica ninguna."""
+        with self._lock, self._connect() as db:
+            if query is None:
+                self._memory.clear()
+                db.execute("DELETE FROM results")
+                return
+            key = self._key(canonicalize_sql(query)[0])
+            self._memory.pop(key, None)
+            db.execute("DELETE FROM results WHERE key = ?", (key,))
+
+    def _remember(self, key, created_at, payload):
+        with self._lock:
+            self._memory[key] = (created_at, payload)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _evict_disk(self, db, now):
+        db.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl_seconds,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.disk_max_bytes:
+            return
+        for key, size in db.execute(
+            "SELECT key, size FROM results ORDER BY last_access ASC"
+        ).fetchall():
+            db.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+            if total <= self.disk_max_bytes:
+                break
+
+
+def rename_columns(payload: dict, aliases: dict) -> dict:
+    """Traduce los nombres de columna guardados a los alias que usa la consulta actual."""
+    cached_aliases = payload.get("aliases", {})
+    mapping = {
+        cached_aliases[placeholder].lower(): new_name
+        for placeholder, new_name in aliases.items()
+        if placeholder in cached_aliases
+    }
+    if not mapping:
+        return payload
+    columns = [mapping.get(str(column).lower(), column) for column in payload["columns"]]
+    return dict(payload, columns=columns)
+
+
+# Instancias globales (lazy loading): una por namespace, es decir, por origen de los datos
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_sql_cache(namespace: str = ""):
+    """Obtiene la caché de resultados del namespace, o None si está desactivada por configuración."""
+    if not SQL_CACHE_ENABLED:
+        return None
+    with _caches_lock:
+        if namespace not in _caches:
+            _caches[namespace] = SQLResultCache(namespace=namespace)
+        return _caches[namespace]
@@ -0,0 +1,137 @@
+# tools/sql_validation.py
+
+import difflib
+import re
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Solo para las anotaciones: sqlglot se carga recién al validar la primera consulta
+    from sqlglot import exp
+
+# ============================================
+# 1. ESQUEMA A PARTIR DEL DDL
+# ============================================
+
+_CREATE_TABLE_RE = re.compile(r"CREATE\s+TABLE\s+`?([\w.-]+)`?\s*\((.*?)\)\s*$", re.I | re.S | re.M)
+_COLUMN_RE = re.compile(r"^\s*(\w+)\s+([\w<>,() ]+?)\s*,?\s*$", re.M)
+
+
+def parse_table_schema(ddl: str) -> dict:
+    """
+    Convierte uno o varios `CREATE TABLE` (como TABLE_SCHEMA) en un diccionario
+    {nombre_completo_tabla: {columna: tipo}}.
+    """
+    schema = {}
+    for table_name, body in _CREATE_TABLE_RE.findall(ddl):
+        schema[table_name] = {
+            column.lower(): column_type.strip() for column, column_type in _COLUMN_RE.findall(body)
+        }
+    return schema
+
+
+# ============================================
+# 2. VALIDACIÓN DE LA CONSULTA
+# ============================================
+
+def _suggest(name: str, candidates) -> str:
+    matches = difflib.get_close_matches(name, list(candidates), n=1, cutoff=0.6)
+    return f" ¿Quisiste decir `{matches[0]}`?" if matches else ""
+
+
+def _table_name(table: "exp.Table") -> str:
+    return ".".join(part for part in (table.catalog, table.db, table.name) if part)
+
+
+def validate_sql(query: str, schema: dict) -> list:
+    """
+    Valida una consulta en el dialecto de BigQuery sin ejecutarla.
+
+    Revisa que sea una única sentencia SELECT, que las tablas existan en `schema`
+    y que las columnas existan en sus tablas (o sean alias definidos en la consulta).
+
+    Args:
+        query: La consulta SQL generada por el agente.
+        schema: Esquema devuelto por `parse_table_schema`.
+
+    Returns:
+        Lista de errores (vacía si la consulta es válida).
+    """
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.errors import ParseError
+
+    try:
+        statements = [s for s in sqlglot.parse(query, read="bigquery") if s is not None]
+    except ParseError as e:
+        errors = []
+        for error in e.errors[:3]:
+            errors.append(
+                f"Error de sintaxis en la línea {error.get('line')}, columna {error.get('col')}: "
+                f"{error.get('description')} cerca de `{error.get('highlight')}`."
+            )
+        return errors or [f"Error de sintaxis: {e}"]
+
+    if len(statements) != 1:
+        return ["Envía una sola sentencia SQL por llamada."]
+    statement = statements[0]
+    if not isinstance(statement, exp.Query):
+        first_word = query.split()[0].upper() if query.split() else ""
+        return [
+            f"Solo se permiten consultas de lectura (SELECT); la sentencia empieza con `{first_word}`."
+        ]
+
+    errors = []
+    columns_by_table = {name.lower(): columns for name, columns in schema.items()}
+    all_columns = {column for columns in schema.values() for column in columns}
+
+    # Nombres definidos dentro de la propia consulta (CTEs, alias de tablas y de columnas)
+    cte_names = {cte.alias_or_name.lower() for cte in statement.find_all(exp.CTE)}
+    defined_names = {alias.alias.lower() for alias in statement.find_all(exp.Alias)}
+    for table_alias in statement.find_all(exp.TableAlias):
+        defined_names.update(column.name.lower() for column in table_alias.columns)
+
+    base_tables = {}
+    for table in statement.find_all(exp.Table):
+        full_name = _table_name(table).lower()
+        if not table.db and full_name in cte_names:
+            continue
+        if full_name not in columns_by_table:
+            errors.append(
+                f"Tabla desconocida `{_table_name(table)}`. Tablas disponibles: "
+                + ", ".join(f"`{name}`" for name in schema)
+                + "."
+            )
+            continue
+        base_tables[(table.alias or table.name).lower()] = full_name
+
+    for column in statement.find_all(exp.Column):
+        name = column.name.lower()
+        qualifier = column.table.lower()
+        if not name:
+            continue
+        if qualifier:
+            # Solo se pueden revisar las columnas calificadas con una tabla real
+            if qualifier in base_tables:
+                table_columns = columns_by_table[base_tables[qualifier]]
+                if name not in table_columns:
+                    errors.append(
+                        f"La columna `{column.name}` no existe en `{base_tables[qualifier]}`."
+                        + _suggest(name, table_columns)
+                    )
+            continue
+        if name not in all_columns and name not in defined_names:
+            errors.append(
+                f"Columna desconocida `{column.name}`." + _suggest(name, all_columns | defined_names)
+            )
+
+    # Sin duplicados, conservando el orden
+    return list(dict.fromkeys(errors))
+
+
+def format_validation_errors(errors: list) -> str:
+    """Mensaje para el modelo con el diagnóstico de una consulta rechazada."""
+    return (
+        "La consulta no pasó la validación local y no se envió a BigQuery. "
+        "Corrige estos problemas y vuelve a intentarlo:\n"
+        + "\n".join(f"- {error}" for error in errors)
+    )